@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import ProfessionalProfile, BusinessHours, Service, Appointment
+from django.utils import timezone
+from django.utils.html import format_html, format_html_join
+from .models import ProfessionalProfile, BusinessHours, Service, Appointment, AppointmentArchive, RequestProfile, Task
 
 # ---
 # Personalización del Admin (Opcional pero recomendado)
@@ -24,10 +26,86 @@ class ProfessionalProfileAdmin(admin.ModelAdmin):
 # Personaliza cómo se ven las Citas
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
-    list_display = ('client_name', 'professional', 'service', 'start_datetime', 'status')
+    list_display = ('client_name', 'professional', 'service', 'start_datetime', 'status', 'reminded_at')
     list_filter = ('status', 'professional', 'start_datetime') # Filtros al costado
     search_fields = ('client_name', 'professional__display_name')
 
+# Historial archivado (manage.py archive_appointments): solo lectura
+@admin.register(AppointmentArchive)
+class AppointmentArchiveAdmin(admin.ModelAdmin):
+    list_display = ('client_name', 'professional', 'service', 'start_datetime', 'status', 'archived_at')
+    list_filter = ('status',)
+    search_fields = ('client_name', 'professional__display_name')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# Cola de tareas: permite revisar errores y reintentar las que quedaron en DEAD
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('last_error',)
+    actions = ['retry_tasks']
+
+    @admin.action(description="Reintentar tareas seleccionadas")
+    def retry_tasks(self, request, queryset):
+        updated = queryset.exclude(status='RUNNING').update(status='PENDING', attempts=0, run_at=timezone.now(), finished_at=None)
+        self.message_user(request, f"{updated} tarea(s) volverán a ejecutarse.")
+
+# Perfiles de requests (?__profile=1): solo lectura; el detalle se lee desde el JSON guardado en disco
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view_name', 'status_code', 'duration_ms', 'sql_count', 'sql_ms', 'user', 'sampled')
+    list_filter = ('view_name', 'sampled', 'status_code')
+    search_fields = ('path', 'view_name')
+    fields = ('created_at', 'method', 'path', 'view_name', 'user', 'status_code', 'duration_ms', 'sql_count', 'sql_ms', 'sampled',
+              'top_functions', 'sql_queries', 'template_timings')
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None:
+            obj.report = obj.load_report() or {}  # Se lee una sola vez para las tres secciones
+        return obj
+
+    def _table(self, headers, rows):
+        if not rows:
+            return "—"
+        return format_html(
+            '<table><thead><tr>{}</tr></thead><tbody>{}</tbody></table>',
+            format_html_join('', '<th>{}</th>', ((header,) for header in headers)),
+            format_html_join('', '<tr>' + '<td>{}</td>' * len(headers) + '</tr>', rows),
+        )
+
+    @admin.display(description="Funciones (tiempo acumulado)")
+    def top_functions(self, obj):
+        rows = [(row['cumulative_ms'], row['own_ms'], row['calls'], row['function']) for row in obj.report.get('functions', [])]
+        return self._table(('Acumulado ms', 'Propio ms', 'Llamadas', 'Función'), rows)
+
+    @admin.display(description="Consultas SQL")
+    def sql_queries(self, obj):
+        rows = [
+            (query['ms'], format_html('<code>{}</code><br><small>{}</small>', query['sql'], query['params']), format_html_join('', '{}<br>', ((frame,) for frame in query['origin'])))
+            for query in obj.report.get('queries', [])
+        ]
+        hidden = obj.report.get('queries_not_shown', 0)
+        table = self._table(('ms', 'SQL', 'Origen'), rows)
+        return format_html('{}<p>{} consulta(s) más sin detalle.</p>', table, hidden) if hidden else table
+
+    @admin.display(description="Plantillas")
+    def template_timings(self, obj):
+        return self._table(('Plantilla', 'ms'), [(template['name'], template['ms']) for template in obj.report.get('templates', [])])
+
 # Registra los modelos que no necesitan tanta personalización (aún)
 # admin.site.register(Service) # Ya no es necesario, está en el Inline
 # admin.site.register(BusinessHours) # Ya no es necesario, está en el Inline
@@ -0,0 +1,28 @@
+from django.db import transaction
+
+from .models import Appointment, AppointmentArchive
+
+# --- ARCHIVO DE CITAS TERMINADAS ---
+# Cada lote es una transacción corta: se leen (y bloquean) hasta batch_size citas terminadas antes del corte,
+# se copian al archivo y se borran de la tabla activa. Si el proceso se corta, lo ya movido queda movido
+# y volver a ejecutarlo sigue con lo que falta. Las citas terminadas no ocupan horas, no están pendientes
+# y DailyStats suma ambas tablas, así que mover filas no invalida ninguna caché ni cambia los reportes.
+
+
+def archive_batch(cutoff, batch_size, after_pk=0):
+    # Devuelve (citas movidas, último id movido); (0, None) cuando ya no quedan
+    with transaction.atomic():
+        rows = list(
+            Appointment.objects.select_for_update(skip_locked=True)  # Nunca espera por una cita que otro request tiene tomada
+            .filter(pk__gt=after_pk, status__in=AppointmentArchive.FINISHED_STATUSES, end_datetime__lt=cutoff)
+            .order_by('pk').values(*AppointmentArchive.COPIED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0, None
+        AppointmentArchive.objects.bulk_create([AppointmentArchive(**row) for row in rows])
+        ids = [row['id'] for row in rows]
+        # Borrado sin señales: delete() del ORM dispararía por cada fila las señales de la cita (estadísticas,
+        # cachés) que el archivo no necesita. Ninguna tabla apunta a Appointment, así que no hay cascadas
+        moved = Appointment.objects.filter(pk__in=ids)
+        moved._raw_delete(moved.db)
+    return len(rows), ids[-1]
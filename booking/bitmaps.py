@@ -0,0 +1,100 @@
+from datetime import time
+
+# --- MAPA DE BITS DE DISPONIBILIDAD ---
+# Un día son 288 bits, uno por cada tramo de 5 minutos desde medianoche; el bit en 1 significa "libre":
+# dentro de un turno, fuera de la colación y sin cita (cita + descanso). Un día ocupa 36 bytes, así que
+# un mes de un profesional es ~1 KB y miles de profesionales caben en la caché sin problema.
+#
+# Los bloques candidatos son los mismos que recorre sweep_slots (la grilla no depende de las citas) y
+# revisar cada uno es un AND contra una máscara. Si los candidatos caen en múltiplos de 5 minutos,
+# redondear hacia afuera las citas y la colación da exactamente el mismo resultado que el barrido.
+
+GRANULARITY_MINUTES = 5
+BITS_PER_DAY = 24 * 60 // GRANULARITY_MINUTES
+BYTES_PER_DAY = BITS_PER_DAY // 8
+FULL_DAY = (1 << BITS_PER_DAY) - 1
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def is_aligned(*minutes):
+    return all(minute % GRANULARITY_MINUTES == 0 for minute in minutes)
+
+
+def _mask(first_bit, last_bit):
+    # Bits [first_bit, last_bit) en 1
+    if last_bit <= first_bit:
+        return 0
+    return ((1 << (last_bit - first_bit)) - 1) << first_bit
+
+
+def inner_mask(start, end):
+    # Tramos completamente dentro de [start, end) (minutos): para los turnos
+    return _mask(-(-start // GRANULARITY_MINUTES), end // GRANULARITY_MINUTES)
+
+
+def outer_mask(start, end):
+    # Tramos que tocan [start, end) (minutos): para lo que ocupa la agenda
+    return _mask(max(start // GRANULARITY_MINUTES, 0), min(-(-end // GRANULARITY_MINUTES), BITS_PER_DAY))
+
+
+def week_template(schedule, lunch=None):
+    # schedule: horario semanal compilado; lunch: (inicio, fin) en minutos. Devuelve un entero por día de la semana
+    lunch_mask = outer_mask(*lunch) if lunch else 0
+    template = []
+    for shifts in schedule:
+        bits = 0
+        for start_time, end_time in shifts:
+            bits |= inner_mask(to_minutes(start_time), to_minutes(end_time))
+        template.append(bits & ~lunch_mask)
+    return template
+
+
+def clear_busy(bits, busy):
+    # busy: pares (inicio, fin) en minutos desde la medianoche del día, con el descanso ya sumado al fin
+    for start, end in busy:
+        bits &= ~outer_mask(start, end)
+    return bits & FULL_DAY
+
+
+def is_free(bits, start, duration):
+    # start y duration en minutos, múltiplos de GRANULARITY_MINUTES
+    run = _mask(start // GRANULARITY_MINUTES, (start + duration) // GRANULARITY_MINUTES)
+    return bits & run == run
+
+
+def candidate_starts(shifts, duration, buffer, lunch=None):
+    # La misma grilla que sweep_slots, en minutos: la colación hace "saltar" al término de ella
+    for start_time, end_time in shifts:
+        current, end = to_minutes(start_time), to_minutes(end_time)
+        while current + duration <= end:
+            if lunch and current < lunch[1] and current + duration > lunch[0]:
+                current = lunch[1]
+                continue
+            yield current
+            current += duration + buffer
+
+
+def fits_grid(shifts_by_day, duration, buffer, lunch=None):
+    # La respuesta es exacta solo si todos los candidatos caen en la grilla de bits
+    starts = [to_minutes(start_time) for shifts in shifts_by_day for start_time, _ in shifts]
+    return is_aligned(duration, buffer, *starts, *(lunch[1:] if lunch else ()))
+
+
+def find_slots(bits, shifts, duration, buffer, lunch=None):
+    # Igual que is_free, pero con la máscara de la duración armada una sola vez
+    run = (1 << (duration // GRANULARITY_MINUTES)) - 1
+    return [
+        time(start // 60, start % 60) for start in candidate_starts(shifts, duration, buffer, lunch)
+        if (bits >> (start // GRANULARITY_MINUTES)) & run == run
+    ]
+
+
+def to_bytes(bits):
+    return bits.to_bytes(BYTES_PER_DAY, 'little')
+
+
+def from_bytes(data):
+    return int.from_bytes(data, 'little')
@@ -0,0 +1,279 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import inc
+
+# --- CACHÉ DE DISPONIBILIDAD ---
+# Cada profesional tiene un contador de versión. Las llaves de bloques incluyen esa versión, así que
+# invalidar es solo incrementar el contador: las entradas antiguas quedan huérfanas y expiran solas.
+
+SINGLE_FLIGHT_LOCK_TIMEOUT = 10  # segundos que un cálculo puede retener el candado
+SINGLE_FLIGHT_WAIT = 2.0         # cuánto espera un request a que otro termine el cálculo
+SINGLE_FLIGHT_POLL = 0.02
+
+
+def _version_key(profile_id):
+    return f"slots:version:{profile_id}"
+
+
+def _read_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Partimos desde el reloj para no revivir entradas viejas si el contador fue desalojado
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_availability_version(profile_id):
+    return _read_version(_version_key(profile_id))
+
+
+def bump_availability_version(profile_id):
+    _bump_version(_version_key(profile_id))
+
+
+def slots_key(profile_id, version, duration_minutes, day):
+    return f"slots:{profile_id}:{version}:{duration_minutes}:{day.isoformat()}"
+
+
+def get_or_compute_slots(profile_id, duration_minutes, day, compute):
+    key = slots_key(profile_id, get_availability_version(profile_id), duration_minutes, day)
+    slots = cache.get(key)
+    if slots is not None:
+        inc('nexthora_cache_requests_total', cache='slots', result='hit')
+        return slots
+    inc('nexthora_cache_requests_total', cache='slots', result='miss')
+    return _single_flight(key, compute)
+
+
+def get_many_slots(profile_id, duration_minutes, days):
+    version = get_availability_version(profile_id)
+    keys = {slots_key(profile_id, version, duration_minutes, day): day for day in days}
+    found = cache.get_many(list(keys))
+    _count_lookups('slots', len(found), len(keys) - len(found))
+    return version, {keys[key]: slots for key, slots in found.items()}
+
+
+def set_many_slots(profile_id, version, duration_minutes, slots_by_day):
+    cache.set_many(
+        {slots_key(profile_id, version, duration_minutes, day): slots for day, slots in slots_by_day.items()},
+        settings.AVAILABILITY_CACHE_TIMEOUT,
+    )
+
+
+# Mapas de bits por día (ver bitmaps.py): no dependen de la duración, así que todos los servicios los comparten
+def _bitmap_key(profile_id, version, day):
+    return f"bitmap:{profile_id}:{version}:{day.isoformat()}"
+
+
+def get_many_bitmaps(profile_id, version, days):
+    keys = {_bitmap_key(profile_id, version, day): day for day in days}
+    found = cache.get_many(list(keys))
+    _count_lookups('bitmap', len(found), len(keys) - len(found))
+    return {keys[key]: data for key, data in found.items()}
+
+
+def set_many_bitmaps(profile_id, version, bitmaps_by_day):
+    cache.set_many(
+        {_bitmap_key(profile_id, version, day): data for day, data in bitmaps_by_day.items()},
+        settings.AVAILABILITY_CACHE_TIMEOUT,
+    )
+
+
+# Fragmentos VEVENT del feed .ics (ver calendar_feed.py): la llave cambia con la cita, así que no se invalidan
+def get_many_vevents(keys):
+    found = cache.get_many(keys)
+    _count_lookups('vevent', len(found), len(keys) - len(found))
+    return found
+
+
+def set_many_vevents(fragments):
+    cache.set_many(fragments, settings.CALENDAR_FEED_EVENT_TIMEOUT)
+
+
+def _count_lookups(name, hits, misses):
+    if hits:
+        inc('nexthora_cache_requests_total', hits, cache=name, result='hit')
+    if misses:
+        inc('nexthora_cache_requests_total', misses, cache=name, result='miss')
+
+
+def _single_flight(key, compute, timeout=None):
+    # Solo el request que obtiene el candado calcula; el resto espera el resultado en la caché
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            slots = compute()
+            cache.set(key, slots, settings.AVAILABILITY_CACHE_TIMEOUT if timeout is None else timeout)
+            return slots
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL)
+        slots = cache.get(key)
+        if slots is not None:
+            return slots
+    return compute()
+
+
+# --- HORARIO SEMANAL COMPILADO ---
+# Los bloques de BusinessHours ya ordenados y fundidos por día de la semana. Tiene su propio contador de
+# versión porque solo cambia al editar el horario, no con cada cita como la disponibilidad.
+
+WEEKLY_SCHEDULE_TIMEOUT = 24 * 60 * 60
+
+
+def _schedule_version_key(profile_id):
+    return f"schedule:version:{profile_id}"
+
+
+def get_or_compute_weekly_schedule(profile_id, compute):
+    key = f"schedule:week:{profile_id}:{_read_version(_schedule_version_key(profile_id))}"
+    schedule = cache.get(key)
+    if schedule is None:
+        schedule = compute()
+        cache.set(key, schedule, WEEKLY_SCHEDULE_TIMEOUT)
+    return schedule
+
+
+def bump_schedule_version(profile_id):
+    _bump_version(_schedule_version_key(profile_id))
+
+
+# --- CONTADOR DE CITAS PENDIENTES ---
+# Se recalcula con un COUNT y se guarda bajo un contador de versión que las señales de Appointment incrementan.
+# Un lector que contó antes de un cambio guarda su resultado con la versión anterior, que ya nadie lee.
+
+PENDING_COUNT_TIMEOUT = 60 * 60
+
+
+def _pending_version_key(profile_id):
+    return f"pending:version:{profile_id}"
+
+
+def get_pending_count(profile_id, compute):
+    key = f"pending:count:{profile_id}:{_read_version(_pending_version_key(profile_id))}"
+    count = cache.get(key)
+    if count is None:
+        count = compute()
+        cache.set(key, count, PENDING_COUNT_TIMEOUT)
+    return count
+
+
+def bump_pending_version(profile_id):
+    _bump_version(_pending_version_key(profile_id))
+
+
+# --- CACHÉ DE LA PÁGINA PÚBLICA DEL PERFIL ---
+# El HTML ya renderizado se guarda por slug y versión. La versión es la marca de tiempo (ns) del último
+# cambio del perfil o sus servicios, así que sirve también como Last-Modified. Pasado el tiempo "fresco",
+# un solo request vuelve a renderizar mientras el resto sigue recibiendo la copia anterior.
+
+PROFILE_PAGE_REFRESH_LOCK_TIMEOUT = 30
+
+
+def _profile_page_version_key(slug):
+    return f"profile:page:version:{slug}"
+
+
+def get_profile_page_version(slug):
+    return _read_version(_profile_page_version_key(slug))
+
+
+def bump_profile_page_version(slug):
+    cache.set(_profile_page_version_key(slug), time.time_ns(), None)
+
+
+def get_or_render_profile_page(slug, render):
+    # render() devuelve el HTML (str); se retorna un dict con content, etag, last_modified y fresh_until
+    version = get_profile_page_version(slug)
+    key = f"profile:page:{slug}:{version}"
+    page = cache.get(key)
+    if page is None:
+        inc('nexthora_cache_requests_total', cache='profile_page', result='miss')
+        return _single_flight(key, lambda: _build_profile_page(version, render), _profile_page_timeout())
+    stale = time.time() > page['fresh_until']
+    inc('nexthora_cache_requests_total', cache='profile_page', result='stale' if stale else 'hit')
+    if stale and cache.add(f"{key}:refresh", 1, PROFILE_PAGE_REFRESH_LOCK_TIMEOUT):
+        try:
+            page = _build_profile_page(version, render)
+            cache.set(key, page, _profile_page_timeout())
+        finally:
+            cache.delete(f"{key}:refresh")
+    return page
+
+
+def _build_profile_page(version, render):
+    content = render().encode()
+    return {
+        'content': content,
+        'etag': f'"{hashlib.md5(content, usedforsecurity=False).hexdigest()}"',
+        'last_modified': version // 1_000_000_000,
+        'fresh_until': time.time() + settings.PROFILE_PAGE_CACHE_TIMEOUT,
+    }
+
+
+def _profile_page_timeout():
+    # La entrada vive más que su tiempo fresco para poder servirse "vencida" mientras se regenera
+    return settings.PROFILE_PAGE_CACHE_TIMEOUT + settings.PROFILE_PAGE_STALE_TIMEOUT
+
+
+# --- RESOLUCIÓN SLUG → PERFIL (EN MEMORIA DEL PROCESO) ---
+# LRU acotado con TTL. Cada entrada guarda también la versión de la página del perfil con que se leyó:
+# como cualquier guardado del perfil la cambia, los demás procesos notan el cambio sin esperar el TTL.
+
+class LRUCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+profile_resolver_cache = LRUCache(settings.PROFILE_RESOLVER_MAX_SIZE, settings.PROFILE_RESOLVER_TTL)
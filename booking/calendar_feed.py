@@ -0,0 +1,117 @@
+import hashlib
+import zlib
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .caching import get_many_vevents, get_profile_page_version, set_many_vevents
+from .models import Appointment
+
+# --- FEED ICALENDAR POR PROFESIONAL ---
+# Google Calendar y Apple Calendar consultan la suscripción cada pocos minutos. Antes de leer citas se
+# calcula un ETag con un solo agregado (máx. updated_at y cantidad en la ventana): si el calendario no
+# cambió, la respuesta es un 304. Si cambió, el feed se envía en streaming y cada VEVENT sale de la caché
+# mientras la cita no se modifique (su llave incluye updated_at).
+# No se envía Last-Modified: al cancelar o borrar la cita más reciente, el máximo del agregado retrocede y
+# un cliente que solo manda If-Modified-Since recibiría 304 sin ver el cambio. La cuenta sí lo detecta.
+
+FEED_CHUNK_SIZE = 500
+FEED_FIELDS = (
+    'start_datetime', 'end_datetime', 'status', 'created_at', 'updated_at', 'client_name', 'client_last_name',
+    'client_email', 'client_whatsapp', 'service__name',
+)
+VEVENT_STATUS = {'PENDING': 'TENTATIVE', 'CONFIRMED': 'CONFIRMED'}
+
+
+def feed_window(today):
+    return today - timedelta(days=settings.CALENDAR_FEED_PAST_DAYS), today + timedelta(days=settings.CALENDAR_FEED_FUTURE_DAYS)
+
+
+def feed_queryset(profile, start_day, end_day):
+    return Appointment.objects.in_range(profile, start_day, end_day).active()
+
+
+def feed_etag(profile, queryset, start_day):
+    # Una consulta: cualquier cita creada, editada, cancelada o borrada en la ventana cambia el máximo o la cuenta.
+    # La versión de la página pública cubre los cambios del perfil y de sus servicios (nombre del servicio)
+    summary = queryset.aggregate(last_modified=Max('updated_at'), total=Count('id'))
+    last_modified = summary['last_modified']
+    raw = f"{profile.pk}:{start_day}:{summary['total']}:{last_modified.timestamp() if last_modified else 0}:{get_profile_page_version(profile.slug)}"
+    return f'"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+
+def escape_text(value):
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    # RFC 5545: líneas de máximo 75 octetos; las siguientes parten con un espacio
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not parts else 74), len(data))
+        while end < len(data) and (data[end] & 0xC0) == 0x80:  # No cortar un carácter UTF-8 a la mitad
+            end -= 1
+        parts.append(data[start:end].decode())
+        start = end
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_vevent(appt):
+    service = appt.service.name if appt.service else 'Cita'
+    client = f"{appt.client_name} {appt.client_last_name}".strip()
+    details = [f"Cliente: {client}", f"Email: {appt.client_email}"]
+    if appt.client_whatsapp:
+        details.append(f"WhatsApp: {appt.client_whatsapp}")
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:appointment-{appt.pk}@nexthora",
+        f"DTSTAMP:{format_utc(appt.updated_at)}",
+        f"LAST-MODIFIED:{format_utc(appt.updated_at)}",
+        f"CREATED:{format_utc(appt.created_at)}",
+        f"DTSTART:{format_utc(appt.start_datetime)}",
+        f"DTEND:{format_utc(appt.end_datetime)}",
+        f"SUMMARY:{escape_text(f'{service} · {client}')}",
+        f"DESCRIPTION:{escape_text(chr(10).join(details))}",
+        f"STATUS:{VEVENT_STATUS.get(appt.status, 'CONFIRMED')}",
+        'END:VEVENT',
+    ]
+    return ''.join(fold(line) for line in lines)
+
+
+def vevent_key(appt):
+    # El fragmento depende de la cita y del nombre del servicio; ambos van en la llave, así nunca hay que borrarla
+    service = appt.service.name if appt.service else ''
+    return f"ics:vevent:{appt.pk}:{appt.updated_at.timestamp()}:{zlib.crc32(service.encode())}"
+
+
+def stream_feed(profile, queryset):
+    header = [
+        'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//Nexthora//Agenda//ES', 'CALSCALE:GREGORIAN', 'METHOD:PUBLISH',
+        f"X-WR-CALNAME:{escape_text(f'Nexthora · {profile.display_name}')}",
+        f"X-PUBLISHED-TTL:PT{settings.CALENDAR_FEED_REFRESH_MINUTES}M",
+        f"REFRESH-INTERVAL;VALUE=DURATION:PT{settings.CALENDAR_FEED_REFRESH_MINUTES}M",
+    ]
+    yield ''.join(fold(line) for line in header)
+
+    # Primero solo lo que forma la llave; las columnas completas se leen únicamente para los VEVENT que faltan
+    rows = queryset.select_related('service').only('id', 'updated_at', 'service__name').order_by('start_datetime', 'id').iterator(chunk_size=FEED_CHUNK_SIZE)
+    while chunk := list(islice(rows, FEED_CHUNK_SIZE)):
+        keys = {appt.pk: vevent_key(appt) for appt in chunk}
+        fragments = get_many_vevents(list(keys.values()))
+        missing = [pk for pk, key in keys.items() if key not in fragments]
+        if missing:
+            rendered = {keys[appt.pk]: render_vevent(appt) for appt in Appointment.objects.filter(pk__in=missing).select_related('service').only(*FEED_FIELDS)}
+            set_many_vevents(rendered)
+            fragments.update(rendered)
+        yield ''.join(fragments[key] for key in keys.values() if key in fragments)
+
+    yield 'END:VCALENDAR\r\n'
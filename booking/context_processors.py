@@ -0,0 +1,35 @@
+from functools import cached_property
+
+from .models import Appointment
+
+# Máximo de solicitudes que se muestran en el menú de notificaciones
+NOTIFICATIONS_LIMIT = 8
+
+
+class NotificationSummary:
+    # Se calcula una sola vez por request y solo si la plantilla lo usa
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def profile(self):
+        return self.user.profile
+
+    @cached_property
+    def pending_count(self):
+        return self.profile.pending_count
+
+    @cached_property
+    def pending_appointments(self):
+        if not self.pending_count:
+            return []
+        return list(
+            Appointment.objects.filter(professional=self.profile, status='PENDING')
+            .select_related('service').order_by('start_datetime')[:NOTIFICATIONS_LIMIT]
+        )
+
+
+def notifications(request):
+    if not request.user.is_authenticated:
+        return {}
+    return {'notifications': NotificationSummary(request.user)}
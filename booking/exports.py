@@ -0,0 +1,106 @@
+import csv
+import heapq
+import re
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+from .models import Appointment, AppointmentArchive, local_day_start
+
+# --- EXPORTACIÓN DEL HISTORIAL DE CITAS ---
+# El CSV se arma mientras se envía: la consulta se lee de a EXPORT_CHUNK_SIZE filas (iterator no guarda la
+# caché del queryset) y se despacha de a EXPORT_ROWS_PER_WRITE líneas. La memoria no crece con el historial.
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_ROWS_PER_WRITE = 500
+EXPORT_FIELDS = (
+    'start_datetime', 'end_datetime', 'status', 'created_at', 'client_name', 'client_last_name', 'client_rut',
+    'client_email', 'client_whatsapp', 'service__name', 'service__duration_minutes', 'service__price',
+)
+EXPORT_HEADER = (
+    'Fecha', 'Inicio', 'Término', 'Servicio', 'Duración (min)', 'Precio', 'Estado',
+    'Nombre', 'Apellido', 'RUT', 'Email', 'WhatsApp', 'Reservada el',
+)
+
+# Excel en español separa columnas con ";" y solo reconoce UTF-8 si el archivo parte con BOM
+EXPORT_FORMATS = {
+    'csv': {'delimiter': ',', 'bom': False},
+    'excel': {'delimiter': ';', 'bom': True},
+}
+
+# Un texto ingresado por el cliente que parte con = + - @ sería una fórmula al abrirlo en Excel
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+PHONE_RE = re.compile(r'\+?[\d ]+')
+
+
+class Echo:
+    # csv.writer escribe en un "archivo" que devuelve la línea en vez de guardarla
+    def write(self, value):
+        return value
+
+
+def export_querysets(profile, start_day=None, end_day=None, statuses=None):
+    # Citas activas y archivadas: dos querysets con el mismo orden que appointment_rows mezcla al vuelo
+    querysets = []
+    for model in (Appointment, AppointmentArchive):
+        queryset = model.objects.filter(professional=profile)
+        if start_day:
+            queryset = queryset.filter(start_datetime__gte=local_day_start(start_day))
+        if end_day:
+            queryset = queryset.filter(start_datetime__lt=local_day_start(end_day + timedelta(days=1)))
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        querysets.append(queryset.select_related('service').only(*EXPORT_FIELDS).order_by('start_datetime', 'id'))
+    return querysets
+
+
+def safe_cell(value):
+    if value and value.startswith(FORMULA_PREFIXES) and not PHONE_RE.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def export_row(appt, status_labels, tz):
+    start, end = appt.start_datetime.astimezone(tz), appt.end_datetime.astimezone(tz)
+    service = appt.service
+    return (
+        start.strftime('%Y-%m-%d'), start.strftime('%H:%M'), end.strftime('%H:%M'),
+        safe_cell(service.name) if service else '', service.duration_minutes if service else '', service.price if service else '',
+        status_labels.get(appt.status, appt.status),
+        safe_cell(appt.client_name), safe_cell(appt.client_last_name), safe_cell(appt.client_rut),
+        safe_cell(appt.client_email), safe_cell(appt.client_whatsapp),
+        appt.created_at.astimezone(tz).strftime('%Y-%m-%d %H:%M'),
+    )
+
+
+def appointment_rows(querysets):
+    # La zona horaria se resuelve una vez: timezone.localtime() la busca de nuevo en cada llamada
+    status_labels, tz = dict(Appointment.STATUS_CHOICES), timezone.get_current_timezone()
+    yield EXPORT_HEADER
+    appointments = heapq.merge(
+        *(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE) for queryset in querysets),
+        key=lambda appt: (appt.start_datetime, appt.pk),
+    )
+    for appt in appointments:
+        yield export_row(appt, status_labels, tz)
+
+
+def stream_csv(rows, delimiter=',', bom=False):
+    writer = csv.writer(Echo(), delimiter=delimiter)
+    lines = ['\ufeff'] if bom else []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) >= EXPORT_ROWS_PER_WRITE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+async def aiterate(chunks):
+    # Bajo ASGI Django juntaría en una lista un iterador síncrono completo: se avanza de a un bloque en el
+    # hilo sync (el mismo de la conexión a la base de datos), así la memoria sigue plana
+    done = object()
+    while (chunk := await sync_to_async(next)(chunks, done)) is not done:
+        yield chunk
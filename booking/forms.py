@@ -3,7 +3,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils.text import slugify
-from .models import Service, BusinessHours, TimeOff, ProfessionalProfile
+from .models import Service, BusinessHours, TimeOff, ProfessionalProfile, Appointment
 import datetime
 
 # --- FORMULARIO DE REGISTRO ---
@@ -36,8 +36,7 @@ class NexthoraUserCreationForm(UserCreationForm):
         slug = self.cleaned_data.get('slug')
         if slug:
             slug_formateado = slugify(slug)
-            palabras_reservadas = ['admin', 'dashboard', 'login', 'register', 'logout', 'api', 'settings']
-            if slug_formateado in palabras_reservadas:
+            if slug_formateado in ProfessionalProfile.RESERVED_SLUGS:
                 raise ValidationError("Esta URL no está disponible. Por favor, elige otra.")
             if ProfessionalProfile.objects.filter(slug=slug_formateado).exists():
                 raise ValidationError("Este enlace ya está en uso por otro profesional.")
@@ -131,8 +130,7 @@ class ProfessionalProfileForm(forms.ModelForm):
         slug = self.cleaned_data.get('slug')
         if slug:
             slug_formateado = slugify(slug)
-            palabras_reservadas = ['admin', 'dashboard', 'login', 'register', 'logout', 'api', 'settings']
-            if slug_formateado in palabras_reservadas:
+            if slug_formateado in ProfessionalProfile.RESERVED_SLUGS:
                 raise ValidationError("Esta URL no está disponible. Por favor, elige otra.")
             if ProfessionalProfile.objects.filter(slug=slug_formateado).exclude(pk=self.instance.pk).exists():
                 raise ValidationError("Este enlace ya está en uso por otro profesional.")
@@ -140,15 +138,19 @@ class ProfessionalProfileForm(forms.ModelForm):
         return slug
 
     def clean_profile_picture(self):
-        foto = self.cleaned_data.get('profile_picture')
-        if foto:
-            limite_mb = 2
-            if foto.size > limite_mb * 1024 * 1024:
-                raise ValidationError(f"La imagen es muy pesada. El tamaño máximo permitido es {limite_mb}MB.")
-            extensiones_validas = ['.jpg', '.jpeg', '.png', '.webp']
-            if not any(foto.name.lower().endswith(ext) for ext in extensiones_validas):
-                 raise ValidationError("Formato no válido. Sube una imagen en JPG, PNG o WEBP.")
-        return foto
+        return validar_imagen(self.cleaned_data.get('profile_picture'), limite_mb=2)
+
+    def clean_banner_image(self):
+        return validar_imagen(self.cleaned_data.get('banner_image'), limite_mb=4)
+
+def validar_imagen(foto, limite_mb):
+    if foto:
+        if foto.size > limite_mb * 1024 * 1024:
+            raise ValidationError(f"La imagen es muy pesada. El tamaño máximo permitido es {limite_mb}MB.")
+        extensiones_validas = ['.jpg', '.jpeg', '.png', '.webp']
+        if not any(foto.name.lower().endswith(ext) for ext in extensiones_validas):
+            raise ValidationError("Formato no válido. Sube una imagen en JPG, PNG o WEBP.")
+    return foto
 
 # --- FORMULARIO DE SERVICIOS ---
 class ServiceForm(forms.ModelForm):
@@ -195,6 +197,12 @@ class BatchScheduleForm(forms.Form):
         widget=forms.Select(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:ring-blue-600 focus:border-blue-600 bg-white text-center font-mono cursor-pointer outline-none'}),
         label="Hasta", initial="18:00"
     )
+    # NUEVO: Horario partido (p. ej. mañana y tarde): suma el bloque a los días en vez de reemplazarlos
+    add_shift = forms.BooleanField(
+        required=False,
+        widget=forms.CheckboxInput(attrs={'class': 'w-4 h-4 text-blue-600 border-gray-300 rounded focus:ring-blue-500 cursor-pointer'}),
+        label="Agregar como turno adicional (horario partido)",
+    )
 
     def clean(self):
         cleaned_data = super().clean()
@@ -253,4 +261,35 @@ class ProScheduleSettingsForm(forms.ModelForm):
             raise forms.ValidationError("La hora de fin de colación debe ser después del inicio.")
         if (start and not end) or (end and not start):
             raise forms.ValidationError("Debes especificar tanto el inicio como el fin de la colación, o dejar ambos vacíos.")
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+# --- FORMULARIO DE EXPORTACIÓN DEL HISTORIAL ---
+class AppointmentExportForm(forms.Form):
+    FORMAT_CHOICES = [('csv', 'CSV'), ('excel', 'Excel')]
+    FIELD_CLASS = 'w-full px-3 py-2 border border-gray-300 rounded-md focus:ring-blue-600 focus:border-blue-600 outline-none'
+
+    start_date = forms.DateField(required=False, label="Desde", widget=forms.DateInput(attrs={'type': 'date', 'class': FIELD_CLASS}))
+    end_date = forms.DateField(required=False, label="Hasta", widget=forms.DateInput(attrs={'type': 'date', 'class': FIELD_CLASS}))
+    status = forms.MultipleChoiceField(required=False, label="Estados", choices=Appointment.STATUS_CHOICES, widget=forms.CheckboxSelectMultiple)
+    format = forms.ChoiceField(required=False, label="Formato", choices=FORMAT_CHOICES, widget=forms.Select(attrs={'class': FIELD_CLASS}))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start = cleaned_data.get("start_date")
+        end = cleaned_data.get("end_date")
+        if start and end and start > end:
+            raise forms.ValidationError("La fecha de fin no puede ser anterior al inicio.")
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        return cleaned_data
+
+# --- FORMULARIO DE DATOS DEL CLIENTE AL RESERVAR ---
+class BookingClientForm(forms.ModelForm):
+    # Solo valida: la cita la crea book_appointment. Largos y formato salen del modelo (RUT: 12 caracteres)
+    class Meta:
+        model = Appointment
+        fields = ['client_name', 'client_last_name', 'client_rut', 'client_email', 'client_whatsapp']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in ('client_last_name', 'client_rut', 'client_whatsapp'):
+            self.fields[name].required = False
@@ -0,0 +1,136 @@
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from PIL import Image, ImageOps
+
+from .caching import bump_profile_page_version
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+# --- VARIANTES DE IMÁGENES DEL PERFIL ---
+# Cada imagen subida se re-codifica en tamaños fijos (WebP y JPEG, sin metadatos EXIF/GPS).
+# Los nombres salen del archivo original completo (con su extensión), así que se pueden borrar sin guardar
+# nada extra y dos originales distintos nunca comparten variantes.
+# (etiqueta, ancho, alto): con alto se recorta al cuadro; sin alto se respeta la proporción
+PROFILE_IMAGE_VARIANTS = {
+    'profile_picture': (('avatar', 96, 96), ('profile', 256, 256)),
+    'banner_image': (('sm', 640, None), ('md', 1280, None), ('lg', 1920, None)),
+}
+IMAGE_FORMATS = (('webp', 'WEBP'), ('jpg', 'JPEG'))
+IMAGE_QUALITY = 82
+
+
+def variant_name(name, label, ext):
+    # 'profile_pictures/foto.png' -> 'profile_pictures/variants/foto.png_avatar.webp'
+    # El storage solo evita choques del nombre completo: 'foto.png' y 'foto.jpg' pueden convivir
+    folder, filename = os.path.split(name)
+    return os.path.join(folder, 'variants', f"{filename}_{label}.{ext}")
+
+
+def generate_variants(fieldfile, specs):
+    # Devuelve [(etiqueta, ancho)] de las variantes creadas; nunca se agranda la imagen original
+    with fieldfile.open('rb') as fh:
+        original = ImageOps.exif_transpose(Image.open(fh))
+        original.load()
+    if original.mode not in ('RGB', 'RGBA'):
+        has_alpha = 'A' in original.getbands() or 'transparency' in original.info
+        original = original.convert('RGBA' if has_alpha else 'RGB')
+
+    created = []
+    for label, width, height in specs:
+        if height:
+            resized = ImageOps.fit(original, (width, height), Image.Resampling.LANCZOS)
+        elif original.width > width or not created:
+            width = min(width, original.width)
+            resized = original.resize((width, round(original.height * width / original.width)), Image.Resampling.LANCZOS)
+        else:
+            continue
+        for ext, pil_format in IMAGE_FORMATS:
+            # Al re-codificar sin pasar exif= se descartan los metadatos de la cámara
+            image = resized.convert('RGB') if pil_format == 'JPEG' else resized
+            buffer = BytesIO()
+            image.save(buffer, pil_format, quality=IMAGE_QUALITY, optimize=pil_format == 'JPEG')
+            name = variant_name(fieldfile.name, label, ext)
+            if fieldfile.storage.exists(name):
+                fieldfile.storage.delete(name)
+            fieldfile.storage.save(name, ContentFile(buffer.getvalue()))
+        created.append((label, width))
+    return created
+
+
+@task
+def delete_profile_files(files):
+    # files: [[campo, nombre del archivo], ...]; se borra el original y todas sus variantes
+    for field_name, name in files:
+        names = [name] + [variant_name(name, label, ext) for label, _, _ in PROFILE_IMAGE_VARIANTS[field_name] for ext, _ in IMAGE_FORMATS]
+        for name in names:
+            if default_storage.exists(name):
+                default_storage.delete(name)
+
+
+@task
+def process_profile_images(profile_id):
+    from .models import ProfessionalProfile
+
+    profile = ProfessionalProfile.objects.filter(pk=profile_id).first()
+    if profile is None:
+        return
+
+    variants, unchanged = {}, Q(pk=profile.pk)
+    for field_name, specs in PROFILE_IMAGE_VARIANTS.items():
+        fieldfile = getattr(profile, field_name)
+        if not fieldfile:
+            unchanged &= Q(**{field_name: ''}) | Q(**{f'{field_name}__isnull': True})
+            continue
+        unchanged &= Q(**{field_name: fieldfile.name})
+        current = profile.image_variants.get(field_name)
+        if current and current['source'] == fieldfile.name:
+            variants[field_name] = current
+            continue
+        try:
+            variants[field_name] = {'source': fieldfile.name, 'sizes': generate_variants(fieldfile, specs)}
+        except (OSError, Image.DecompressionBombError):
+            # Archivo dañado o no es una imagen: reintentar no ayuda, se sigue sirviendo el original
+            logger.exception("No se pudieron generar las variantes de %s", fieldfile.name)
+
+    # Si el profesional subió otra imagen mientras procesábamos, ese otro trabajo guardará el resultado
+    if ProfessionalProfile.objects.filter(unchanged).update(image_variants=variants):
+        bump_profile_page_version(profile.slug)
+
+
+class ProfileImage:
+    # Envoltorio para plantillas: URLs de cada variante y atributos srcset listos para usar
+    def __init__(self, fieldfile, processed):
+        self.fieldfile = fieldfile
+        self.sizes = processed['sizes'] if processed and fieldfile and processed['source'] == fieldfile.name else []
+
+    def __bool__(self):
+        return bool(self.fieldfile)
+
+    @property
+    def ready(self):
+        return bool(self.sizes)
+
+    def url(self, label, ext='jpg'):
+        return self.fieldfile.storage.url(variant_name(self.fieldfile.name, label, ext))
+
+    def srcset(self, ext):
+        return ', '.join(f"{self.url(label, ext)} {width}w" for label, width in self.sizes)
+
+    @property
+    def webp_srcset(self):
+        return self.srcset('webp')
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset('jpg')
+
+    @property
+    def src(self):
+        # La variante más pequeña como src por defecto; el original mientras se procesa
+        return self.url(self.sizes[0][0]) if self.sizes else self.fieldfile.url
@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from booking.archiving import archive_batch
+from booking.models import Appointment, AppointmentArchive
+
+
+class Command(BaseCommand):
+    help = "Mueve a AppointmentArchive las citas completadas o canceladas que terminaron hace más de N días."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=365, help="Días desde el término de la cita (mínimo 1).")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Citas por transacción.")
+        parser.add_argument('--sleep', type=float, default=0.0, help="Segundos de pausa entre lotes, para ceder la base al tráfico.")
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta las citas que se moverían.")
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 1:
+            # Los reportes asumen que el archivo no tiene citas de ayer en adelante (ver rollups.py)
+            raise CommandError("--older-than debe ser al menos 1 día.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size debe ser mayor que 0.")
+        cutoff = timezone.now() - timedelta(days=options['older_than'])
+
+        if options['dry_run']:
+            count = Appointment.objects.filter(status__in=AppointmentArchive.FINISHED_STATUSES, end_datetime__lt=cutoff).count()
+            self.stdout.write(f"{count} cita(s) terminadas antes de {timezone.localtime(cutoff):%d/%m/%Y %H:%M} se moverían al archivo.")
+            return
+
+        moved, last_pk, batches = 0, 0, 0
+        while True:
+            count, last_pk = archive_batch(cutoff, options['batch_size'], last_pk)
+            if not count:
+                break
+            moved += count
+            batches += 1
+            if batches % 10 == 0:
+                self.stdout.write(f"  {moved} cita(s) movidas (último id {last_pk})...")
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f"Archivo actualizado: {moved} cita(s) movidas en {batches} lote(s)."))
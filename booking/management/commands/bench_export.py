@@ -0,0 +1,83 @@
+import csv
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from booking.exports import EXPORT_HEADER, Echo, appointment_rows, export_querysets, export_row, stream_csv
+from booking.models import Appointment, Service
+
+INSERT_BATCH = 20_000
+
+
+def measure_export(consume, querysets):
+    # Segundos y MB de CSV de recorrer la exportación completa, y en una segunda pasada la memoria máxima
+    # (tracemalloc hace mucho más lenta cada asignación, así que no se mide el tiempo con él activo)
+    started = time.perf_counter()
+    size = consume(querysets)
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    consume(querysets)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, size / 1024 / 1024, peak / 1024 / 1024
+
+
+def streamed(querysets):
+    return sum(len(chunk.encode()) for chunk in stream_csv(appointment_rows(querysets)))
+
+
+def materialized(querysets):
+    # Como la página de citas: todo el historial en memoria y el CSV armado completo antes de enviarlo
+    appointments = [appt for queryset in querysets for appt in queryset]
+    status_labels, tz = dict(Appointment.STATUS_CHOICES), timezone.get_current_timezone()
+    writer = csv.writer(Echo())
+    content = ''.join([writer.writerow(EXPORT_HEADER), *(writer.writerow(export_row(appt, status_labels, tz)) for appt in appointments)])
+    return len(content.encode())
+
+
+class Command(BaseCommand):
+    help = "Mide tiempo y memoria máxima de exportar historiales de distinto tamaño (los datos se crean y se descartan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000', help="Cantidades de citas a exportar, separadas por coma.")
+        parser.add_argument('--materialize-max', type=int, default=100_000, help="Hasta qué tamaño medir también la lista en memoria.")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        self.stdout.write(f"{'citas':>10} {'seg':>8} {'CSV MB':>8} {'pico MB':>9} {'lista: pico MB':>15}")
+        with transaction.atomic():
+            user = User.objects.create_user(username='bench-export')
+            profile = user.profile
+            service = Service.objects.create(professional=profile, name='Corte', duration_minutes=30, price=10000)
+            created = 0
+            for size in sizes:
+                created = self.fill(profile, service, created, size)
+                querysets = export_querysets(profile)
+                seconds, csv_mb, peak_mb = measure_export(streamed, querysets)
+                listed = '-'
+                if size <= options['materialize_max']:
+                    listed = f"{measure_export(materialized, querysets)[2]:.1f}"
+                self.stdout.write(f"{size:>10} {seconds:>8.2f} {csv_mb:>8.1f} {peak_mb:>9.2f} {listed:>15}")
+            transaction.set_rollback(True)
+
+    def fill(self, profile, service, created, target):
+        # bulk_create sin señales: solo importa que existan las filas
+        first = timezone.make_aware(datetime(2015, 1, 1, 9, 0))
+        statuses = [choice[0] for choice in Appointment.STATUS_CHOICES]
+        while created < target:
+            batch = min(INSERT_BATCH, target - created)
+            Appointment.objects.bulk_create(
+                Appointment(
+                    professional=profile, service=service, status=statuses[n % len(statuses)],
+                    client_name=f'Cliente {n}', client_last_name='Soto', client_rut='11111111-1', client_email=f'c{n}@example.com',
+                    client_whatsapp='+56911112222', start_datetime=first + timedelta(minutes=30 * n), end_datetime=first + timedelta(minutes=30 * n + 30),
+                )
+                for n in range(created, created + batch)
+            )
+            created += batch
+        return created
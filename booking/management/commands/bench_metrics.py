@@ -0,0 +1,74 @@
+import statistics
+import time
+import timeit
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from booking.metrics import RequestStats, Registry, record_query
+
+from .run_benchmarks import pick_profile
+
+METRICS_MIDDLEWARE = 'booking.metrics.MetricsMiddleware'
+
+
+def median_request_ms(path, repeat):
+    client = Client()
+    client.get(path)  # Calentamiento: cachés, plantillas e imports
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.get(path)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+class Command(BaseCommand):
+    help = "Mide cuánto agrega la instrumentación de métricas a cada request del flujo público."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help="Slug del profesional a medir (por defecto, el con más citas).")
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=3, help="Rondas alternando sin y con métricas (se toma la mejor).")
+
+    def handle(self, *args, **options):
+        if METRICS_MIDDLEWARE not in settings.MIDDLEWARE:
+            raise CommandError("MetricsMiddleware no está en MIDDLEWARE.")
+        profile = pick_profile(options['profile'])
+        service = profile.services.order_by('duration_minutes').first()
+        if service is None:
+            raise CommandError(f"{profile.slug} no tiene servicios.")
+        day = (timezone.localdate() + timedelta(days=1)).isoformat()
+        paths = {
+            'public_profile': reverse('public_profile', args=[profile.slug]),
+            'booking_step1': f"{reverse('booking_step1', args=[profile.slug, service.id])}?date={day}",
+            'booking_availability': f"{reverse('booking_availability', args=[profile.slug, service.id])}?days=14",
+        }
+        # Sin métricas: sin el middleware y con el backend de plantillas estándar
+        plain = {
+            'MIDDLEWARE': [name for name in settings.MIDDLEWARE if name != METRICS_MIDDLEWARE],
+            'TEMPLATES': [{**engine, 'BACKEND': 'django.template.backends.django.DjangoTemplates'} for engine in settings.TEMPLATES],
+        }
+
+        self.stdout.write(f"{'vista':<22} {'sin (ms)':>10} {'con (ms)':>10} {'Δ (µs)':>9} {'Δ%':>7}")
+        for name, path in paths.items():
+            off, on = [], []
+            for _ in range(options['rounds']):
+                with override_settings(**plain):
+                    off.append(median_request_ms(path, options['repeat']))
+                on.append(median_request_ms(path, options['repeat']))
+            off_ms, on_ms = min(off), min(on)
+            self.stdout.write(f"{name:<22} {off_ms:>10.3f} {on_ms:>10.3f} {(on_ms - off_ms) * 1000:>9.1f} {(on_ms - off_ms) / off_ms * 100:>6.1f}%")
+
+        # Costo aislado de cada pieza, sin ruido de la vista
+        registry, stats = Registry(), RequestStats()
+        number = 100_000
+        record_ns = min(timeit.repeat(lambda: registry.record_request('booking_step1', 'GET', 200, 0.01, stats), number=number, repeat=3)) / number * 1e9
+        inc_ns = min(timeit.repeat(lambda: registry.inc('nexthora_cache_requests_total', cache='slots', result='hit'), number=number, repeat=3)) / number * 1e9
+        noop = lambda sql, params, many, context: None  # noqa: E731
+        query_ns = min(timeit.repeat(lambda: record_query(noop, '', None, False, None), number=number, repeat=3)) / number * 1e9
+        self.stdout.write(f"\nregistrar un request: {record_ns:.0f} ns · contador de dominio: {inc_ns:.0f} ns · envoltorio por consulta: {query_ns:.0f} ns")
@@ -0,0 +1,143 @@
+import http.client
+import importlib.util
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from .run_benchmarks import pick_profile
+
+# Un solo proceso worker por modo, para comparar requests/seg con la misma memoria
+SERVERS = {
+    'wsgi': ['-m', 'gunicorn', 'nexthora_config.wsgi', '--workers', '1'],
+    'asgi': ['-m', 'gunicorn', 'nexthora_config.asgi:application', '--workers', '1', '--worker-class', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def worker_rss_kb(master_pid):
+    # RSS del proceso worker (hijo del master de gunicorn); solo disponible en Linux
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as fh:
+            children = fh.read().split()
+        with open(f'/proc/{children[0]}/status') as fh:
+            return next(int(line.split()[1]) for line in fh if line.startswith('VmRSS:'))
+    except (OSError, IndexError, StopIteration):
+        return None
+
+
+def load(port, path, connections, duration):
+    # Cada hilo mantiene una conexión keep-alive y pide la misma ruta hasta que se acaba el tiempo
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                ok = response.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                ok = False
+            (latencies if ok else errors).append((time.perf_counter() - started) * 1000)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        'requests_per_sec': round(len(latencies) / duration, 1),
+        'p50_ms': round(statistics.median(latencies), 2) if latencies else None,
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None,
+        'errors': len(errors),
+    }
+
+
+def wait_for_port(port, process, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError("El servidor terminó antes de aceptar conexiones.")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError(f"El servidor no respondió en el puerto {port}.")
+
+
+class Command(BaseCommand):
+    help = "Compara requests/seg por worker del flujo público sirviendo con gunicorn (WSGI) y uvicorn (ASGI)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help="Slug del profesional a medir (por defecto, el con más citas).")
+        parser.add_argument('--modes', default='wsgi,asgi', help="Servidores a medir, separados por coma.")
+        parser.add_argument('--connections', type=int, default=16, help="Conexiones simultáneas del cliente.")
+        parser.add_argument('--duration', type=float, default=5.0, help="Segundos de carga por ruta.")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help="Archivo donde escribir el reporte JSON.")
+
+    def handle(self, *args, **options):
+        profile = pick_profile(options['profile'])
+        service = profile.services.order_by('duration_minutes').first()
+        if service is None:
+            raise CommandError(f"{profile.slug} no tiene servicios.")
+        day = (timezone.localdate() + timedelta(days=1)).isoformat()
+        paths = {
+            'profile_view': reverse('public_profile', args=[profile.slug]),
+            'booking_view': f"{reverse('booking_step1', args=[profile.slug, service.id])}?date={day}",
+        }
+        appointment = profile.appointments.order_by('-id').first()
+        if appointment:
+            paths['booking_success_view'] = reverse('booking_success', args=[profile.slug, appointment.id])
+
+        report = {}
+        for mode in options['modes'].split(','):
+            report[mode] = self.bench_mode(mode, paths, options)
+
+        self.stdout.write(f"{'modo':<6} {'vista':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'errores':>8} {'RSS MB':>8}")
+        for mode, results in report.items():
+            rss = results.pop('worker_rss_kb')
+            for name, result in results.items():
+                rss_mb = f"{rss / 1024:.1f}" if rss else '-'
+                self.stdout.write(f"{mode:<6} {name:<22} {result['requests_per_sec']:>9} {result['p50_ms']!s:>9} {result['p95_ms']!s:>9} {result['errors']:>8} {rss_mb:>8}")
+            results['worker_rss_kb'] = rss
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                json.dump({'connections': options['connections'], 'duration': options['duration'], 'results': report}, fh, indent=2)
+
+    def bench_mode(self, mode, paths, options):
+        if mode not in SERVERS:
+            raise CommandError(f"Modo desconocido: {mode} (usa {', '.join(SERVERS)}).")
+        if mode == 'asgi' and importlib.util.find_spec('uvicorn_worker') is None:
+            raise CommandError("El modo asgi necesita uvicorn: pip install -r requirements-dev.txt")
+        port = options['port']
+        command = [sys.executable, *SERVERS[mode], '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+        server = subprocess.Popen(command, env=os.environ.copy())
+        try:
+            wait_for_port(port, server)
+            results = {}
+            for name, path in paths.items():
+                load(port, path, options['connections'], 1.0)  # Calentamiento: cachés e imports
+                results[name] = load(port, path, options['connections'], options['duration'])
+            results['worker_rss_kb'] = worker_rss_kb(server.pid)
+            return results
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
@@ -0,0 +1,94 @@
+import random
+import timeit
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+
+from booking.bitmaps import clear_busy, find_slots, week_template
+from booking.slots import build_busy_intervals, sweep_slots
+
+
+# Implementación anterior (bloque x cita), usada solo como línea base de comparación
+def nested_loop_slots(work_start, work_end, duration, buffer, appointments, lunch=None):
+    slots = []
+    current_time = work_start
+    while current_time + duration <= work_end:
+        slot_start = current_time
+        slot_end = current_time + duration
+        if lunch and (slot_start < lunch[1] and slot_end > lunch[0]):
+            current_time = lunch[1]
+            continue
+        is_taken = False
+        for appt_start, appt_end in appointments:
+            if slot_start < appt_end + buffer and slot_end > appt_start:
+                is_taken = True
+                break
+        if not is_taken:
+            slots.append(current_time.time())
+        current_time += duration + buffer
+    return slots
+
+
+def synthetic_day(day, appointments, duration, seed=0):
+    rng = random.Random(seed)
+    work_start = datetime.combine(day, time(7, 0))
+    work_end = datetime.combine(day, time(23, 0))
+    total = int((work_end - work_start).total_seconds() // 60)
+    booked = []
+    for _ in range(appointments):
+        start = work_start + timedelta(minutes=rng.randrange(0, total - duration, 5))
+        booked.append((start, start + timedelta(minutes=duration)))
+    booked.sort()
+    return work_start, work_end, booked
+
+
+class Command(BaseCommand):
+    help = "Compara el motor de bloques por intervalos y el mapa de bits con el bucle anidado anterior."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, nargs='+', default=[10, 50, 100, 200])
+        parser.add_argument('--duration', type=int, default=5, help="Duración del servicio en minutos.")
+        parser.add_argument('--buffer', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        duration = timedelta(minutes=options['duration'])
+        buffer = timedelta(minutes=options['buffer'])
+        repeat = options['repeat']
+        lunch = (datetime.combine(date(2030, 1, 7), time(13, 0)), datetime.combine(date(2030, 1, 7), time(14, 0)))
+
+        # El mapa de bits trabaja en minutos desde la medianoche
+        shifts = ((time(7, 0), time(23, 0)),)
+        lunch_minutes = (13 * 60, 14 * 60)
+        template = week_template([shifts], lunch_minutes)[0]
+
+        # "bits" arma el mapa y busca; "búsqueda" usa un mapa ya armado, como cuando viene de la caché
+        self.stdout.write(f"{'citas':>6} {'anidado (ms)':>14} {'barrido (ms)':>14} {'bits (ms)':>11} {'búsqueda (ms)':>15} {'x':>7}")
+        for count in options['appointments']:
+            work_start, work_end, booked = synthetic_day(date(2030, 1, 7), count, options['duration'])
+            midnight = datetime.combine(work_start.date(), time.min)
+            booked_minutes = [
+                (int((start - midnight).total_seconds() // 60), int((end - midnight).total_seconds() // 60) + options['buffer'])
+                for start, end in booked
+            ]
+
+            def nested():
+                return nested_loop_slots(work_start, work_end, duration, buffer, booked, lunch)
+
+            def sweep():
+                return sweep_slots(work_start, work_end, duration, buffer, build_busy_intervals(booked, buffer), lunch)
+
+            def bits():
+                return find_slots(clear_busy(template, booked_minutes), shifts, options['duration'], options['buffer'], lunch_minutes)
+
+            day_bits = clear_busy(template, booked_minutes)
+
+            def search():
+                return find_slots(day_bits, shifts, options['duration'], options['buffer'], lunch_minutes)
+
+            assert nested() == sweep() == bits()
+            nested_ms = min(timeit.repeat(nested, number=repeat, repeat=3)) / repeat * 1000
+            sweep_ms = min(timeit.repeat(sweep, number=repeat, repeat=3)) / repeat * 1000
+            bits_ms = min(timeit.repeat(bits, number=repeat, repeat=3)) / repeat * 1000
+            search_ms = min(timeit.repeat(search, number=repeat, repeat=3)) / repeat * 1000
+            self.stdout.write(f"{count:>6} {nested_ms:>14.3f} {sweep_ms:>14.3f} {bits_ms:>11.3f} {search_ms:>15.3f} {nested_ms / sweep_ms:>6.1f}x")
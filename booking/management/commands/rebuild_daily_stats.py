@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from booking.models import ProfessionalProfile
+from booking.rollups import refresh_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Reconstruye la tabla DailyStats a partir del historial de citas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help="Slug de un profesional (por defecto, todos).")
+
+    def handle(self, *args, **options):
+        profiles = ProfessionalProfile.objects.order_by('pk')
+        if options['profile']:
+            profiles = profiles.filter(slug=options['profile'])
+
+        total_days = 0
+        for profile_id in profiles.values_list('pk', flat=True).iterator():
+            total_days += refresh_daily_stats(profile_id)
+        self.stdout.write(self.style.SUCCESS(f"DailyStats reconstruido: {total_days} días."))
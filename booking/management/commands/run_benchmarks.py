@@ -0,0 +1,123 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from booking.models import Appointment, ProfessionalProfile
+from booking.slots import compute_available_slots, get_available_slots
+
+
+def measure(func, repeat):
+    # Tiempo (mediana y peor caso), consultas SQL y memoria máxima de func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def pick_profile(slug=None):
+    # El perfil indicado o, si no, el profesional con más citas
+    if slug:
+        try:
+            return ProfessionalProfile.objects.select_related('user').get(slug=slug)
+        except ProfessionalProfile.DoesNotExist:
+            raise CommandError(f"No existe el perfil {slug}.")
+    profile = ProfessionalProfile.objects.select_related('user').annotate(total=Count('appointments')).order_by('-total').first()
+    if profile is None:
+        raise CommandError("No hay profesionales; ejecuta primero manage.py seed_data.")
+    return profile
+
+
+class Command(BaseCommand):
+    help = "Mide vistas y cálculo de disponibilidad sobre los datos actuales y genera un reporte JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', help="Slug del profesional a medir (por defecto, el con más citas).")
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--output', help="Archivo donde escribir el reporte JSON (por defecto, stdout).")
+        parser.add_argument('--compare', help="Reporte JSON anterior contra el cual comparar.")
+
+    def handle(self, *args, **options):
+        profile = pick_profile(options['profile'])
+        service = profile.services.order_by('duration_minutes').first()
+        if service is None:
+            raise CommandError(f"{profile.slug} no tiene servicios.")
+
+        day = timezone.localdate() + timedelta(days=1)
+        anonymous, owner = Client(), Client()
+        owner.force_login(profile.user)
+
+        def cold_slots():
+            return compute_available_slots(profile, service.duration_minutes, day)
+
+        def warm_slots():
+            return get_available_slots(profile, service, day)
+
+        cases = {
+            'slots_uncached': cold_slots,
+            'slots_cached': warm_slots,
+            'booking_view': lambda: anonymous.get(reverse('booking_step1', args=[profile.slug, service.id]), {'date': day.isoformat()}),
+            'profile_view': lambda: anonymous.get(reverse('public_profile', args=[profile.slug])),
+            'dashboard_view': lambda: owner.get(reverse('dashboard')),
+            'appointments_view': lambda: owner.get(reverse('appointments')),
+        }
+
+        cache.clear()
+        results = {name: measure(func, options['repeat']) for name, func in cases.items()}
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'environment': {'python': platform.python_version(), 'django': django.get_version(), 'database': connection.vendor},
+            'dataset': {
+                'profile': profile.slug,
+                'profile_appointments': Appointment.objects.filter(professional=profile).count(),
+                'total_appointments': Appointment.objects.count(),
+                'professionals': ProfessionalProfile.objects.count(),
+            },
+            'results': results,
+        }
+
+        payload = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(payload)
+        else:
+            self.stdout.write(payload)
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as fh:
+                self.print_comparison(json.load(fh)['results'], results)
+
+    def print_comparison(self, before, after):
+        self.stderr.write(f"{'caso':<20} {'ms antes':>10} {'ms ahora':>10} {'Δ%':>8} {'consultas':>12}")
+        for name, now in after.items():
+            old = before.get(name)
+            if not old:
+                continue
+            delta = (now['median_ms'] - old['median_ms']) / old['median_ms'] * 100 if old['median_ms'] else 0
+            self.stderr.write(f"{name:<20} {old['median_ms']:>10.2f} {now['median_ms']:>10.2f} {delta:>7.1f}% {old['queries']:>5} → {now['queries']:<5}")
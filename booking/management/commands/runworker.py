@@ -0,0 +1,55 @@
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from booking.tasks import work
+
+
+class Command(BaseCommand):
+    help = "Ejecuta las tareas en segundo plano guardadas en la base de datos."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.TASK_WORKER_CONCURRENCY, help="Hilos que procesan tareas en paralelo.")
+        parser.add_argument('--burst', action='store_true', help="Termina cuando la cola queda vacía (útil en cron o pruebas).")
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        previous = {}
+        if threading.current_thread() is threading.main_thread():
+            # Ctrl+C o SIGTERM (deploy o reinicio): cada hilo termina su tarea actual y se detiene
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                previous[signum] = signal.signal(signum, lambda *_: stop.set())
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f"Worker {prefix} iniciado con {concurrency} hilo(s).")
+        try:
+            if concurrency == 1:
+                # Con un solo hilo no hace falta lanzar otro: se trabaja en el hilo principal
+                processed = [work(f"{prefix}:0", burst=options['burst'], stop=stop)]
+            else:
+                processed = []
+                threads = [
+                    threading.Thread(target=self.run_worker, args=(f"{prefix}:{n}", options['burst'], stop, processed))
+                    for n in range(concurrency)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(timeout=0.5)  # join con timeout para que las señales lleguen al hilo principal
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Worker detenido: {sum(processed)} tarea(s) procesadas."))
+
+    def run_worker(self, worker_id, burst, stop, processed):
+        try:
+            processed.append(work(worker_id, burst=burst, stop=stop))
+        finally:
+            connection.close()
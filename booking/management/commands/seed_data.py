@@ -0,0 +1,161 @@
+import random
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from booking.caching import bump_availability_version
+from booking.models import Appointment, AppointmentArchive, BusinessHours, DailyStats, ProfessionalProfile, Service, TimeOff
+from booking.rollups import refresh_daily_stats
+
+SEED_PREFIX = 'bench_pro_'
+SERVICE_CATALOG = [
+    ('Corte de pelo', 30, 12000), ('Corte + barba', 45, 18000), ('Barba', 15, 7000), ('Manicure', 60, 15000),
+    ('Pedicure', 60, 17000), ('Masaje descontracturante', 90, 35000), ('Tatuaje pequeño', 120, 60000), ('Consulta', 45, 25000),
+]
+FIRST_NAMES = ['Camila', 'Benjamín', 'Sofía', 'Matías', 'Valentina', 'Tomás', 'Isidora', 'Agustín', 'Florencia', 'Vicente']
+LAST_NAMES = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda']
+
+
+class Command(BaseCommand):
+    help = "Genera profesionales, servicios, horarios, bloqueos y citas sintéticas para medir rendimiento."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professionals', type=int, default=50)
+        parser.add_argument('--days-back', type=int, default=365, help="Días de historial hacia atrás.")
+        parser.add_argument('--days-ahead', type=int, default=60, help="Días de agenda hacia adelante.")
+        parser.add_argument('--occupancy', type=float, default=0.6, help="Probabilidad de que cada bloque esté reservado (0-1).")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help="Borra antes los datos sintéticos generados previamente.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['clear']:
+            deleted = self.clear(options['batch_size'])
+            self.stdout.write(f"Eliminados {deleted} registros sintéticos previos.")
+
+        profiles = self.create_profiles(options['professionals'], rng)
+        total = 0
+        for profile in profiles:
+            services = self.create_schedule(profile, rng, options)
+            total += self.create_appointments(profile, services, rng, options)
+            refresh_daily_stats(profile.pk)
+            bump_availability_version(profile.pk)
+            self.stdout.write(f"  {profile.slug}: {total} citas acumuladas")
+        self.stdout.write(self.style.SUCCESS(f"Listo: {len(profiles)} profesionales y {total} citas."))
+
+    def clear(self, batch_size):
+        # Las tablas grandes se borran por lotes de pk con DELETE directo: sin cargar filas, sin señales por fila
+        # y sin el UPDATE ... SET NULL de millones de citas. Solo usuarios y perfiles (pocos) pasan por el ORM,
+        # para que sus señales invaliden la página pública de slugs que se volverán a usar.
+        users = User.objects.filter(username__startswith=SEED_PREFIX)
+        profile_ids = list(ProfessionalProfile.objects.filter(user__in=users).values_list('pk', flat=True))
+        deleted = 0
+        for queryset in (
+            Appointment.objects.filter(Q(professional__in=profile_ids) | Q(professional__isnull=True, client_email__endswith='@seed.nexthora')),
+            AppointmentArchive.objects.filter(professional__in=profile_ids),
+            DailyStats.objects.filter(professional__in=profile_ids),
+            TimeOff.objects.filter(professional__in=profile_ids),
+            BusinessHours.objects.filter(professional__in=profile_ids),
+            Service.objects.filter(professional__in=profile_ids),
+        ):
+            deleted += self.delete_in_batches(queryset, batch_size)
+        return deleted + users.delete()[0]
+
+    def delete_in_batches(self, queryset, batch_size):
+        deleted = 0
+        while ids := list(queryset.values_list('pk', flat=True)[:batch_size]):
+            batch = queryset.model.objects.filter(pk__in=ids)
+            deleted += batch._raw_delete(batch.db)
+        return deleted
+
+    def create_profiles(self, count, rng):
+        start = User.objects.filter(username__startswith=SEED_PREFIX).count()
+        password = make_password('bench-password')
+        users = User.objects.bulk_create([
+            User(username=f"{SEED_PREFIX}{n}", email=f"{SEED_PREFIX}{n}@seed.nexthora", password=password)
+            for n in range(start, start + count)
+        ])
+        # bulk_create no dispara la señal que crea el perfil, así que los creamos aquí
+        users = User.objects.filter(username__in=[user.username for user in users])
+        ProfessionalProfile.objects.bulk_create([
+            ProfessionalProfile(
+                user=user, slug=user.username.replace('_', '-'), display_name=f"Estudio {user.username[len(SEED_PREFIX):]}",
+                plan=rng.choice(['FREE', 'PRO', 'PRO', 'BUSINESS']), buffer_time_minutes=rng.choice([0, 0, 5, 10, 15]),
+                lunch_start_time=time(13, 0), lunch_end_time=time(14, 0), whatsapp_number='+56912345678',
+            )
+            for user in users
+        ])
+        return list(ProfessionalProfile.objects.filter(user__in=users).order_by('pk'))
+
+    def create_schedule(self, profile, rng, options):
+        catalog = rng.sample(SERVICE_CATALOG, rng.randint(2, 5))
+        services = Service.objects.bulk_create([
+            Service(professional=profile, name=name, duration_minutes=duration, price=price) for name, duration, price in catalog
+        ])
+        open_from = rng.choice([time(8, 0), time(9, 0), time(10, 0)])
+        open_until = rng.choice([time(18, 0), time(19, 0), time(20, 0)])
+        weekdays = range(6) if rng.random() < 0.4 else range(5)
+        BusinessHours.objects.bulk_create([
+            BusinessHours(professional=profile, weekday=weekday, start_time=open_from, end_time=open_until) for weekday in weekdays
+        ])
+        today = timezone.localdate()
+        time_off = []
+        for _ in range(rng.randint(0, 4)):
+            start = today + timedelta(days=rng.randint(-options['days_back'], options['days_ahead']))
+            time_off.append(TimeOff(professional=profile, start_date=start, end_date=start + timedelta(days=rng.randint(0, 10)), description='Vacaciones'))
+        TimeOff.objects.bulk_create(time_off)
+        return services, {weekday: (open_from, open_until) for weekday in weekdays}
+
+    def create_appointments(self, profile, schedule, rng, options):
+        services, hours = schedule
+        now = timezone.now()
+        today = timezone.localdate()
+        batch, created = [], 0
+        for offset in range(-options['days_back'], options['days_ahead'] + 1):
+            day = today + timedelta(days=offset)
+            if day.weekday() not in hours:
+                continue
+            current = datetime.combine(day, hours[day.weekday()][0])
+            day_end = datetime.combine(day, hours[day.weekday()][1])
+            while True:
+                service = rng.choice(services)
+                start = current
+                current += timedelta(minutes=service.duration_minutes + profile.buffer_time_minutes)
+                if current > day_end:
+                    break
+                if rng.random() > options['occupancy']:
+                    continue
+                aware_start = timezone.make_aware(start)
+                batch.append(Appointment(
+                    professional=profile, service=service, status=self.pick_status(aware_start < now, rng),
+                    client_name=rng.choice(FIRST_NAMES), client_last_name=rng.choice(LAST_NAMES), client_rut='11.111.111-1',
+                    client_email=f"cliente{rng.randint(1, 10 ** 6)}@seed.nexthora", client_whatsapp='+569' + str(rng.randint(10 ** 7, 10 ** 8 - 1)),
+                    start_datetime=aware_start, end_datetime=aware_start + timedelta(minutes=service.duration_minutes),
+                ))
+                if len(batch) >= options['batch_size']:
+                    created += self.flush(batch)
+        return created + self.flush(batch)
+
+    def flush(self, batch):
+        count = len(batch)
+        if count:
+            with transaction.atomic():
+                Appointment.objects.bulk_create(batch)
+            batch.clear()
+        return count
+
+    def pick_status(self, in_past, rng):
+        roll = rng.random()
+        if in_past:
+            if roll < 0.65: return 'COMPLETED'
+            if roll < 0.85: return 'CONFIRMED'
+            return 'CANCELLED_BY_CLIENT' if roll < 0.95 else 'CANCELLED_BY_PRO'
+        if roll < 0.35: return 'PENDING'
+        if roll < 0.9: return 'CONFIRMED'
+        return 'CANCELLED_BY_CLIENT'
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from booking.reminders import due_reminders, send_reminders
+
+
+class Command(BaseCommand):
+    help = "Envía por email el recordatorio de las citas confirmadas que empiezan pronto (pensado para cron, cada minuto)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.REMINDER_HOURS_BEFORE, help="Horas antes de la cita en que se envía.")
+        parser.add_argument('--batch-size', type=int, default=settings.REMINDER_BATCH_SIZE, help="Citas que se reclaman por transacción.")
+        parser.add_argument('--dry-run', action='store_true', help="Solo cuenta los recordatorios pendientes.")
+
+    def handle(self, *args, **options):
+        if options['hours'] < 1:
+            raise CommandError("--hours debe ser al menos 1.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size debe ser mayor que 0.")
+
+        if options['dry_run']:
+            count = due_reminders(timezone.now(), options['hours']).count()
+            self.stdout.write(f"{count} recordatorio(s) por enviar.")
+            return
+
+        sent, refused = send_reminders(batch_size=options['batch_size'], hours=options['hours'])
+        message = f"{sent} recordatorio(s) enviados."
+        if refused:
+            message += f" {refused} dirección(es) rechazadas por el servidor de correo."
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,218 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates
+
+# --- MÉTRICAS EN FORMATO DE TEXTO DE PROMETHEUS ---
+# Contadores e histogramas en memoria del proceso. Cada worker de gunicorn lleva los suyos: Prometheus
+# debe raspar cada proceso (o correr un worker por contenedor) y sumar con sum() en las consultas.
+# Registrar es sumar en un dict bajo un lock; la página /metrics se arma solo cuando alguien la pide.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'nexthora_http_requests_total': ('counter', "Requests atendidos por vista, método y código de respuesta."),
+    'nexthora_http_request_duration_seconds': ('histogram', "Latencia de los requests por vista."),
+    'nexthora_db_queries_total': ('counter', "Consultas SQL ejecutadas por vista."),
+    'nexthora_db_query_duration_seconds_total': ('counter', "Tiempo total en consultas SQL por vista."),
+    'nexthora_template_render_duration_seconds_total': ('counter', "Tiempo total renderizando plantillas por vista."),
+    'nexthora_bookings_created_total': ('counter', "Citas creadas desde el flujo público."),
+    'nexthora_booking_conflicts_total': ('counter', "Reservas rechazadas porque el bloque ya no estaba libre."),
+    'nexthora_slot_computations_total': ('counter', "Cálculos de disponibilidad contra la base de datos (day: un día, range: varios)."),
+    'nexthora_cache_requests_total': ('counter', "Lecturas de caché por caché y resultado (hit, miss, stale)."),
+}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (nombre, etiquetas) -> valor
+        self._histograms = {}  # (nombre, etiquetas) -> [conteo por bucket..., +Inf, suma, total]
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._observe(key, value)
+
+    def _observe(self, key, value):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def record_request(self, view, method, status, seconds, stats):
+        # Todo lo del request bajo una sola toma del lock
+        by_view = (('view', view),)
+        with self._lock:
+            counters = self._counters
+            for key, amount in (
+                (('nexthora_http_requests_total', (('view', view), ('method', method), ('status', status))), 1),
+                (('nexthora_db_queries_total', by_view), stats.queries),
+                (('nexthora_db_query_duration_seconds_total', by_view), stats.query_seconds),
+                (('nexthora_template_render_duration_seconds_total', by_view), stats.template_seconds),
+            ):
+                counters[key] = counters.get(key, 0) + amount
+            self._observe(('nexthora_http_request_duration_seconds', by_view), seconds)
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(labels.items())), 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for (metric, labels), histogram in histograms:
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), histogram):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-2])}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+            else:
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for (metric, labels), value in counters if metric == name)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+inc = registry.inc
+
+
+# --- MEDICIÓN POR REQUEST ---
+# El middleware deja un RequestStats en una ContextVar; el envoltorio de consultas y el backend de
+# plantillas le suman su tiempo. Las vistas async lo ven igual: asgiref copia el contexto a sus hilos.
+
+class RequestStats:
+    __slots__ = ('queries', 'query_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+_current = contextvars.ContextVar('metrics_request_stats', default=None)
+# Lista de (plantilla, segundos) que llena TimedTemplate mientras profiling.py perfila un request
+template_timings = contextvars.ContextVar('profiling_template_timings', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(db_connection):
+    if record_query not in db_connection.execute_wrappers:
+        db_connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    if settings.METRICS_ENABLED:
+        install_query_recorder(connection)
+
+
+class TimedTemplate:
+    # Envuelve la plantilla del backend de Django; los {% include %} quedan dentro del tiempo de la principal
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats, timings = _current.get(), template_timings.get()
+        if stats is None and timings is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            elapsed = time.perf_counter() - started
+            if stats is not None:
+                stats.template_seconds += elapsed
+            if timings is not None:
+                timings.append((self.template.origin.template_name, elapsed))
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+# El método lo elige el cliente: los no estándar comparten la etiqueta "other" para no crear series sin límite
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # La conexión de este hilo pudo abrirse antes de cargar el middleware (p. ej. en las pruebas)
+        install_query_recorder(connection)
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        match = request.resolver_match
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        registry.record_request(match.view_name if match else 'unmatched', method, response.status_code, time.perf_counter() - started, stats)
+        return response
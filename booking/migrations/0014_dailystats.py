@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0013_professionalprofile_banner_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='Día (hora local)')),
+                ('confirmed_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0, help_text='Suma de precios de las citas confirmadas del día.')),
+                ('professional', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='booking.professionalprofile')),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('professional', 'day')},
+            },
+        ),
+    ]
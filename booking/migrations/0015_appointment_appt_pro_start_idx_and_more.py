@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0014_dailystats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['professional', 'start_datetime'], name='appt_pro_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['professional', 'status', 'start_datetime'], name='appt_pro_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timeoff',
+            index=models.Index(fields=['professional', 'start_date', 'end_date'], name='timeoff_pro_range_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0017_task'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view_name', models.CharField(blank=True, max_length=200)),
+                ('status_code', models.IntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('sql_count', models.IntegerField(default=0)),
+                ('sql_ms', models.FloatField(default=0)),
+                ('sampled', models.BooleanField(default=False, help_text='Tomado por muestreo (PROFILER_SAMPLE_RATE) y no pedido por un staff.')),
+                ('report_file', models.CharField(help_text='Archivo JSON dentro de PROFILER_DIR.', max_length=100)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0019_professionalprofile_calendar_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('client_name', models.CharField(max_length=100, verbose_name='Nombre')),
+                ('client_last_name', models.CharField(default='', max_length=100, verbose_name='Apellido')),
+                ('client_rut', models.CharField(default='', max_length=12, verbose_name='RUT')),
+                ('client_email', models.EmailField(max_length=254, verbose_name='Email')),
+                ('client_whatsapp', models.CharField(default='', max_length=20, verbose_name='WhatsApp')),
+                ('start_datetime', models.DateTimeField()),
+                ('end_datetime', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('CONFIRMED', 'Confirmada'), ('CANCELLED_BY_CLIENT', 'Cancelada por Cliente'), ('CANCELLED_BY_PRO', 'Cancelada por Profesional'), ('COMPLETED', 'Completada')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('professional', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_appointments', to='booking.professionalprofile')),
+                ('service', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_appointments', to='booking.service')),
+            ],
+            options={
+                'ordering': ['start_datetime'],
+                'indexes': [models.Index(fields=['professional', 'start_datetime'], name='appt_archive_pro_start_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0020_appointmentarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reminded_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('reminded_at__isnull', True), ('status', 'CONFIRMED')), fields=['start_datetime'], name='appt_reminder_due_idx'),
+        ),
+    ]
@@ -1,12 +1,81 @@
-import os
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.text import slugify
+from django.conf import settings
+import copy
 import datetime
+import json
+import os
+import secrets
+
+from .images import PROFILE_IMAGE_VARIANTS, ProfileImage, delete_profile_files, process_profile_images
+from .caching import bump_availability_version, bump_pending_version, bump_profile_page_version, bump_schedule_version, get_pending_count, profile_resolver_cache
+
+# --- SEGUIMIENTO DE CAMPOS MODIFICADOS ---
+# Al leer una fila se guardan sus valores. save() escribe solo las columnas que cambiaron (update_fields) y,
+# si no cambió ninguna, no toca la base ni dispara señales. Las señales usan has_changed() y loaded_value()
+# para saltarse trabajo: los valores leídos se actualizan recién después del post_save.
+class DirtyFieldsMixin:
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        self._remember(fields)
+
+    def _remember(self, fields=None):
+        # Los campos diferidos no están en __dict__ y no se registran (tampoco se escriben)
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields or field.attname in fields):
+                value = self._comparable(field, self.__dict__[field.attname])
+                loaded[field.attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    @staticmethod
+    def _comparable(field, value):
+        # De un archivo se guarda y compara el nombre; vacío puede venir como None o como ''
+        if isinstance(field, models.FileField):
+            return getattr(value, 'name', value) or ''
+        return value
+
+    def changed_fields(self):
+        loaded = self.__dict__.get('_loaded_values')
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if loaded is None or field.attname not in loaded or \
+                    self._comparable(field, self.__dict__[field.attname]) != loaded[field.attname]:
+                changed.append(field.attname)
+        return changed
+
+    def has_changed(self, *names):
+        # Una instancia nueva (sin valores leídos) cuenta como cambiada en todo
+        changed = self.changed_fields()
+        return any(name in changed for name in names)
+
+    def loaded_value(self, name, default=None):
+        return self.__dict__.get('_loaded_values', {}).get(name, default)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and '_loaded_values' in self.__dict__ and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            changed = self.changed_fields()
+            if not changed:
+                return
+            if self._meta.pk.attname not in changed:
+                auto_now = [field.attname for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+                kwargs['update_fields'] = changed + [name for name in auto_now if name not in changed]
+        super().save(*args, **kwargs)
+        self._remember(kwargs.get('update_fields'))
 
-class ProfessionalProfile(models.Model):
+class ProfessionalProfile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     slug = models.SlugField(max_length=100, unique=True, blank=True, help_text="La URL pública de tu perfil.")
     display_name = models.CharField(max_length=100, help_text="El nombre de tu negocio.")
@@ -38,9 +107,28 @@ class ProfessionalProfile(models.Model):
     lunch_start_time = models.TimeField(blank=True, null=True, help_text="Hora de inicio de colación.")
     lunch_end_time = models.TimeField(blank=True, null=True, help_text="Hora de fin de colación.")
 
+    # NUEVO: Token secreto del feed .ics (se crea al activar la sincronización; rotarlo revoca el enlace anterior)
+    calendar_token = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
+
+    # NUEVO: Variantes ya generadas de cada imagen ({campo: {'source': nombre, 'sizes': [[etiqueta, ancho]]}})
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
     def __str__(self):
         return self.user.username
 
+    @property
+    def picture_variants(self):
+        return ProfileImage(self.profile_picture, self.image_variants.get('profile_picture'))
+
+    @property
+    def banner_variants(self):
+        return ProfileImage(self.banner_image, self.image_variants.get('banner_image'))
+
+    # Campos que cambian el cálculo de horas disponibles
+    SCHEDULE_FIELDS = ('plan', 'buffer_time_minutes', 'lunch_start_time', 'lunch_end_time')
+    # Primeros segmentos de URL que usa la app: un perfil con ese slug quedaría tapado por la ruta
+    RESERVED_SLUGS = ('admin', 'dashboard', 'login', 'register', 'logout', 'api', 'settings', 'metrics', 'calendar')
+
     @property
     def pending_appointments(self):
         # We query the Appointment model here to avoid circular imports if any, but since it's defined later it works fine.
@@ -49,38 +137,65 @@ class ProfessionalProfile(models.Model):
 
     @property
     def pending_count(self):
-        return self.pending_appointments.count()
+        return get_pending_count(self.pk, lambda: Appointment.objects.filter(professional=self, status='PENDING').count())
     
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.user.username) if self.user.username else "perfil"
-            new_slug = base_slug
-            counter = 1
-            while ProfessionalProfile.objects.filter(slug=new_slug).exists():
-                new_slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = new_slug
+            self.slug = self.allocate_slug(slugify(self.user.username) or "perfil")
         super().save(*args, **kwargs)
 
-# NUEVO: MAGIA PARA REEMPLAZAR LA FOTO ANTIGUA Y NO ACUMULAR BASURA
+    def rotate_calendar_token(self):
+        self.calendar_token = secrets.token_urlsafe(32)
+        self.save(update_fields=['calendar_token'])
+        return self.calendar_token
+
+    @classmethod
+    def allocate_slug(cls, base_slug):
+        # Una sola consulta trae "base" y todos los "base-N"; el primer hueco libre se elige en memoria
+        taken = set(cls.objects.filter(models.Q(slug=base_slug) | models.Q(slug__startswith=f"{base_slug}-")).values_list('slug', flat=True))
+        taken.update(cls.RESERVED_SLUGS)
+        new_slug = base_slug
+        counter = 1
+        while new_slug in taken:
+            new_slug = f"{base_slug}-{counter}"
+            counter += 1
+        return new_slug
+
+# NUEVO: MAGIA PARA REEMPLAZAR LA FOTO ANTIGUA Y NO ACUMULAR BASURA (también banners y sus variantes)
+# Los archivos se borran en el worker. Qué borrar se decide en pre_save, pero la tarea se encola con on_commit:
+# save() no abre transacción propia, y encolarla antes haría que el worker borre la imagen mientras la fila aún
+# la apunta (o aunque el guardado falle). Si la transacción se revierte, la tarea nunca se crea.
 @receiver(pre_save, sender=ProfessionalProfile)
 def auto_delete_file_on_change(sender, instance, **kwargs):
     if not instance.pk:
+        instance._images_changed = any(getattr(instance, name) for name in PROFILE_IMAGE_VARIANTS)
         return False
-    try:
-        old_file = ProfessionalProfile.objects.get(pk=instance.pk).profile_picture
-    except ProfessionalProfile.DoesNotExist:
-        return False
-    new_file = instance.profile_picture
-    if not old_file == new_file and old_file:
-        if os.path.isfile(old_file.path):
-            os.remove(old_file.path)
+    # Los nombres anteriores son los leídos con la fila: no hace falta volver a consultarla
+    replaced = [name for name in PROFILE_IMAGE_VARIANTS if instance.has_changed(name)]
+    instance._images_changed = bool(replaced)
+    old_files = [[name, instance.loaded_value(name)] for name in replaced if instance.loaded_value(name)]
+    if old_files:
+        transaction.on_commit(lambda: delete_profile_files.delay(old_files))
+
+@receiver(post_save, sender=ProfessionalProfile)
+def process_images_on_change(sender, instance, **kwargs):
+    # Las variantes se generan en segundo plano; mientras tanto las plantillas usan el original
+    if getattr(instance, '_images_changed', False):
+        instance._images_changed = False
+        profile_id = instance.pk
+        transaction.on_commit(lambda: process_profile_images.delay(profile_id))
+
+@receiver(post_delete, sender=ProfessionalProfile)
+def auto_delete_files_on_delete(sender, instance, **kwargs):
+    files = [[name, getattr(instance, name).name] for name in PROFILE_IMAGE_VARIANTS if getattr(instance, name)]
+    if files:
+        transaction.on_commit(lambda: delete_profile_files.delay(files))
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
+    # Solo al crear: un login guarda last_login en el usuario y no tiene nada que escribir en el perfil
     if created:
         ProfessionalProfile.objects.create(user=instance)
-    instance.profile.save()
 
 class BusinessHours(models.Model):
     WEEKDAYS = [(0, "Lunes"), (1, "Martes"), (2, "Miércoles"), (3, "Jueves"), (4, "Viernes"), (5, "Sábado"), (6, "Domingo")]
@@ -96,7 +211,7 @@ class BusinessHours(models.Model):
         ordering = ['weekday', 'start_time']
         unique_together = ('professional', 'weekday', 'start_time', 'end_time')
 
-class Service(models.Model):
+class Service(DirtyFieldsMixin, models.Model):
     professional = models.ForeignKey(ProfessionalProfile, on_delete=models.CASCADE, related_name="services")
     name = models.CharField(max_length=150)
     description = models.TextField(blank=True, null=True)
@@ -107,7 +222,26 @@ class Service(models.Model):
     def __str__(self):
         return f"{self.name} ({self.professional.display_name})"
 
-class Appointment(models.Model):
+def local_day_start(day):
+    # Medianoche local (America/Santiago) como datetime con zona horaria
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+class AppointmentQuerySet(models.QuerySet):
+    # Rangos semiabiertos [inicio, fin) sobre la columna: a diferencia de start_datetime__date, usan el índice
+    def in_range(self, profile, start_day, end_day):
+        return self.filter(
+            professional=profile,
+            start_datetime__gte=local_day_start(start_day),
+            start_datetime__lt=local_day_start(end_day + datetime.timedelta(days=1)),
+        )
+
+    def for_day(self, profile, day):
+        return self.in_range(profile, day, day)
+
+    def active(self):
+        return self.filter(status__in=Appointment.ACTIVE_STATUSES)
+
+class Appointment(DirtyFieldsMixin, models.Model):
     STATUS_CHOICES = [
         ('PENDING', 'Pendiente'),
         ('CONFIRMED', 'Confirmada'),
@@ -128,6 +262,20 @@ class Appointment(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # NUEVO: Cuándo se envió (o se está enviando) el recordatorio por email; manage.py send_reminders lo marca
+    reminded_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    # Estados que ocupan espacio en la agenda
+    ACTIVE_STATUSES = ['PENDING', 'CONFIRMED']
+    # Campos que cambian la disponibilidad y el resumen diario (editar el nombre del cliente no afecta ninguno)
+    SCHEDULE_FIELDS = ('professional_id', 'service_id', 'start_datetime', 'end_datetime', 'status')
+    # Cambios de estado que el profesional puede aplicar en lote; canceladas y completadas son finales
+    STATUS_TRANSITIONS = {
+        'PENDING': ['CONFIRMED', 'CANCELLED_BY_PRO'],
+        'CONFIRMED': ['COMPLETED', 'CANCELLED_BY_PRO'],
+    }
+
+    objects = AppointmentQuerySet.as_manager()
 
     def __str__(self):
         return f"Cita: {self.client_name} {self.client_last_name} - {self.start_datetime}"
@@ -141,10 +289,74 @@ class Appointment(models.Model):
                 self.client_whatsapp = f"+569{clean_number}"
             elif len(clean_number) == 9 and clean_number.startswith('9'):
                 self.client_whatsapp = f"+56{clean_number}"
+        if not self._state.adding and self.reminded_at and self.has_changed('start_datetime'):
+            self.reminded_at = None  # Cita movida: el recordatorio enviado tenía la hora anterior
         super().save(*args, **kwargs)
     
     class Meta:
         ordering = ['start_datetime']
+        indexes = [
+            models.Index(fields=['professional', 'start_datetime'], name='appt_pro_start_idx'),
+            models.Index(fields=['professional', 'status', 'start_datetime'], name='appt_pro_status_start_idx'),
+            # Parcial: solo las citas que aún esperan recordatorio, así la búsqueda de cada minuto recorre un índice chico
+            models.Index(fields=['start_datetime'], condition=models.Q(status='CONFIRMED', reminded_at__isnull=True), name='appt_reminder_due_idx'),
+        ]
+
+# NUEVO: Historial frío. manage.py archive_appointments mueve aquí las citas terminadas (completadas o
+# canceladas) antiguas, así la tabla de citas y sus índices, que el motor de reservas recorre a diario,
+# no crecen para siempre. Mismas columnas y el mismo id; un solo índice (profesional, fecha), que es como
+# se lee el historial. Reportes, exportación y pestañas de historial leen ambas tablas.
+class AppointmentArchive(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    professional = models.ForeignKey(ProfessionalProfile, on_delete=models.SET_NULL, null=True, related_name="archived_appointments", db_index=False)
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, related_name="archived_appointments")
+    client_name = models.CharField(max_length=100, verbose_name="Nombre")
+    client_last_name = models.CharField(max_length=100, verbose_name="Apellido", default="")
+    client_rut = models.CharField(max_length=12, verbose_name="RUT", default="")
+    client_email = models.EmailField(verbose_name="Email")
+    client_whatsapp = models.CharField(max_length=20, verbose_name="WhatsApp", default="")
+
+    start_datetime = models.DateTimeField()
+    end_datetime = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Appointment.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Solo se archivan citas que ya no pueden cambiar
+    FINISHED_STATUSES = ['COMPLETED', 'CANCELLED_BY_CLIENT', 'CANCELLED_BY_PRO']
+    # Columnas que se copian desde Appointment
+    COPIED_FIELDS = [
+        'id', 'professional_id', 'service_id', 'client_name', 'client_last_name', 'client_rut', 'client_email',
+        'client_whatsapp', 'start_datetime', 'end_datetime', 'status', 'created_at', 'updated_at',
+    ]
+
+    objects = AppointmentQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Cita archivada: {self.client_name} {self.client_last_name} - {self.start_datetime}"
+
+    class Meta:
+        ordering = ['start_datetime']
+        indexes = [
+            models.Index(fields=['professional', 'start_datetime'], name='appt_archive_pro_start_idx'),
+        ]
+
+class DailyStats(models.Model):
+    # Resumen diario por profesional (se recalcula al cambiar sus citas); el dashboard suma días, no citas
+    professional = models.ForeignKey(ProfessionalProfile, on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField(help_text="Día (hora local)")
+    confirmed_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    revenue = models.IntegerField(default=0, help_text="Suma de precios de las citas confirmadas del día.")
+
+    def __str__(self):
+        return f"{self.professional} {self.day}: ${self.revenue}"
+
+    class Meta:
+        ordering = ['day']
+        unique_together = ('professional', 'day')
 
 class TimeOff(models.Model):
     professional = models.ForeignKey(ProfessionalProfile, on_delete=models.CASCADE, related_name="time_off")
@@ -153,4 +365,158 @@ class TimeOff(models.Model):
     description = models.CharField(max_length=100, blank=True)
 
     def __str__(self):
-        return f"{self.professional} off: {self.start_date} - {self.end_date}"
\ No newline at end of file
+        return f"{self.professional} off: {self.start_date} - {self.end_date}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['professional', 'start_date', 'end_date'], name='timeoff_pro_range_idx'),
+        ]
+
+# NUEVO: Cola de tareas en la base de datos (ver tasks.py y manage.py runworker)
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendiente'),
+        ('RUNNING', 'En ejecución'),
+        ('DONE', 'Terminada'),
+        ('DEAD', 'Fallida definitivamente'),
+    ]
+    name = models.CharField(max_length=200, help_text="Ruta de la función registrada con @task.")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="No se ejecuta antes de esta hora (reintentos con espera).")
+    locked_at = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+# NUEVO: Perfiles de requests tomados con ?__profile=1 o por muestreo (ver profiling.py)
+# La fila guarda el resumen para listar y filtrar en el admin; el detalle (funciones, SQL, plantillas) va en un JSON en disco
+class RequestProfile(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name="+")
+    status_code = models.IntegerField()
+    duration_ms = models.FloatField()
+    sql_count = models.IntegerField(default=0)
+    sql_ms = models.FloatField(default=0)
+    sampled = models.BooleanField(default=False, help_text="Tomado por muestreo (PROFILER_SAMPLE_RATE) y no pedido por un staff.")
+    report_file = models.CharField(max_length=100, help_text="Archivo JSON dentro de PROFILER_DIR.")
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+    @property
+    def report_path(self):
+        return os.path.join(settings.PROFILER_DIR, self.report_file)
+
+    def load_report(self):
+        try:
+            with open(self.report_path, encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    class Meta:
+        ordering = ['-created_at']
+
+@receiver(post_delete, sender=RequestProfile)
+def delete_request_profile_report(sender, instance, **kwargs):
+    try:
+        os.remove(instance.report_path)
+    except FileNotFoundError:
+        pass
+
+# NUEVO: Invalidación de la caché de disponibilidad
+@receiver(post_save, sender=ProfessionalProfile)
+def invalidate_profile_availability(sender, instance, **kwargs):
+    if instance.has_changed(*instance.SCHEDULE_FIELDS):
+        bump_availability_version(instance.pk)
+
+# --- CACHÉ DE LA PÁGINA PÚBLICA: cualquier cambio del perfil o sus servicios la invalida ---
+@receiver(post_save, sender=ProfessionalProfile)
+@receiver(post_delete, sender=ProfessionalProfile)
+def invalidate_profile_page(sender, instance, **kwargs):
+    old_slug = instance.loaded_value('slug')
+    if old_slug and old_slug != instance.slug:
+        bump_profile_page_version(old_slug)
+        profile_resolver_cache.discard(old_slug)
+    bump_profile_page_version(instance.slug)
+    profile_resolver_cache.discard(instance.slug)
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def invalidate_service_profile_page(sender, instance, **kwargs):
+    try:
+        slug = instance.professional.slug
+    except ProfessionalProfile.DoesNotExist:
+        return  # El perfil se está borrando y su propia señal invalida la página
+    bump_profile_page_version(slug)
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=BusinessHours)
+@receiver(post_delete, sender=BusinessHours)
+@receiver(post_save, sender=TimeOff)
+@receiver(post_delete, sender=TimeOff)
+def invalidate_availability(sender, instance, created=True, **kwargs):
+    # Las versiones suben al confirmar: si subieran dentro de la transacción (book_appointment), otro request
+    # podría leer la versión nueva antes del COMMIT y guardar bajo ella bloques que aún no ven el cambio
+    if not created and sender is Appointment and not instance.has_changed(*Appointment.SCHEDULE_FIELDS):
+        return
+    if instance.professional_id:
+        profile_id = instance.professional_id
+        transaction.on_commit(lambda: bump_availability_version(profile_id))
+
+@receiver(post_save, sender=BusinessHours)
+@receiver(post_delete, sender=BusinessHours)
+def invalidate_weekly_schedule(sender, instance, **kwargs):
+    profile_id = instance.professional_id
+    transaction.on_commit(lambda: bump_schedule_version(profile_id))
+
+# NUEVO: Contador de solicitudes pendientes para la campana de notificaciones
+@receiver(post_save, sender=Appointment)
+def track_pending_on_save(sender, instance, **kwargs):
+    was_pending = instance.loaded_value('status') == 'PENDING'
+    is_pending = instance.status == 'PENDING'
+    if instance.professional_id and was_pending != is_pending:
+        profile_id = instance.professional_id
+        transaction.on_commit(lambda: bump_pending_version(profile_id))
+
+@receiver(post_delete, sender=Appointment)
+def track_pending_on_delete(sender, instance, **kwargs):
+    if instance.professional_id and instance.loaded_value('status', instance.status) == 'PENDING':
+        profile_id = instance.professional_id
+        transaction.on_commit(lambda: bump_pending_version(profile_id))
+
+# NUEVO: Resumen diario para el dashboard
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def refresh_appointment_stats(sender, instance, created=True, **kwargs):
+    from .rollups import refresh_daily_stats_for_datetimes
+    if not created and not instance.has_changed(*Appointment.SCHEDULE_FIELDS):
+        return
+    if instance.professional_id:
+        refresh_daily_stats_for_datetimes(instance.professional_id, [instance.start_datetime, instance.loaded_value('start_datetime')])
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def refresh_service_stats(sender, instance, created=False, **kwargs):
+    from .rollups import refresh_daily_stats
+    # El ingreso usa el precio vigente del servicio, así que un cambio de precio afecta todo su historial
+    if not created and (kwargs.get('signal') is post_delete or instance.has_changed('price')):
+        refresh_daily_stats(instance.professional_id)
@@ -0,0 +1,59 @@
+import base64
+import heapq
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import Q
+
+# Paginación por llave (start_datetime, id): cada página cuesta lo mismo sin importar cuánto historial exista
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(start_datetime, pk):
+    raw = f"{start_datetime.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        start, pk = raw.split('|')
+        return datetime.fromisoformat(start), int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(token) from e
+
+
+def _keyset_filter(queryset, cursor, descending):
+    if descending:
+        queryset = queryset.order_by('-start_datetime', '-id')
+    else:
+        queryset = queryset.order_by('start_datetime', 'id')
+
+    if cursor:
+        start, pk = cursor
+        if descending:
+            queryset = queryset.filter(Q(start_datetime__lt=start) | Q(start_datetime=start, id__lt=pk))
+        else:
+            queryset = queryset.filter(Q(start_datetime__gt=start) | Q(start_datetime=start, id__gt=pk))
+    return queryset
+
+
+def keyset_page(queryset, size, cursor=None, descending=False):
+    # queryset puede ser una lista de querysets con la misma llave (citas y archivo): se pide una página a
+    # cada uno y se mezclan; los ids no se repiten porque el archivo conserva el id original
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    position = decode_cursor(cursor) if cursor else None
+    pages = [list(_keyset_filter(qs, position, descending)[:size + 1]) for qs in querysets]
+    if len(pages) == 1:
+        items = pages[0]
+    else:
+        items = list(heapq.merge(*pages, key=lambda item: (item.start_datetime, item.pk), reverse=descending))[:size + 1]
+
+    if len(items) <= size:
+        return KeysetPage(items, None)
+    items = items[:size]
+    return KeysetPage(items, encode_cursor(items[-1].start_datetime, items[-1].pk))
@@ -0,0 +1,28 @@
+from django.http import Http404
+
+from .caching import get_profile_page_version, profile_resolver_cache
+from .metrics import inc
+from .models import ProfessionalProfile
+
+# --- RESOLUCIÓN SLUG → PERFIL ---
+# Solo los campos que deciden la respuesta (si está activo y el cálculo de horas), en el orden del modelo.
+# El resto queda diferido, igual que con .only(): si una vista los usa, Django los pide al acceder.
+
+RESOLVED_FIELDS = ('id', 'slug', 'is_active', 'plan', 'buffer_time_minutes', 'lunch_start_time', 'lunch_end_time')
+
+
+def get_profile_or_404(slug):
+    # La versión se lee antes que la base: si el perfil cambia entremedio, la entrada ya nace vencida
+    version = get_profile_page_version(slug)
+    entry = profile_resolver_cache.get(slug)
+    if entry is not None and entry[0] == version:
+        inc('nexthora_cache_requests_total', cache='profile_resolver', result='hit')
+        values = entry[1]
+    else:
+        inc('nexthora_cache_requests_total', cache='profile_resolver', result='miss')
+        values = ProfessionalProfile.objects.filter(slug=slug).values_list(*RESOLVED_FIELDS).first()
+        if values is None:
+            raise Http404("No existe un perfil con ese enlace.")
+        profile_resolver_cache.set(slug, (version, values))
+    # Una instancia nueva por request: nada mutable se comparte entre hilos
+    return ProfessionalProfile.from_db('default', RESOLVED_FIELDS, values)
@@ -0,0 +1,161 @@
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import traceback
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.urls import reverse
+
+from . import metrics
+from .metrics import template_timings
+from .models import RequestProfile
+
+# --- PERFILADOR DE REQUESTS ---
+# Un staff agrega ?__profile=1 a cualquier URL (o PROFILER_SAMPLE_RATE elige requests al azar) y ese request
+# corre bajo cProfile, guardando además cada consulta SQL con su duración y su origen en el código, y el
+# tiempo de cada plantilla. El resultado queda en PROFILER_DIR y se revisa en el admin (Request profiles).
+# Con PROFILER_ENABLED=False el middleware ni se carga; activo, un request normal solo paga buscar
+# "__profile" en el query string. cProfile mide el hilo del request: las vistas del dashboard son síncronas.
+
+PROFILE_PARAM = '__profile'
+MAX_FUNCTIONS = 60   # funciones que se guardan, ordenadas por tiempo acumulado
+MAX_QUERIES = 500    # consultas que se guardan por request; del resto solo se cuenta la cantidad
+MAX_SQL_LENGTH = 2000
+
+# cProfile no admite dos perfiladores activos a la vez: si otro request ya se está perfilando, este corre normal
+_profiler_lock = threading.Lock()
+
+
+def _short_path(filename):
+    base = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        return filename[len(base):]
+    marker = f"site-packages{os.sep}"
+    return filename.split(marker, 1)[1] if marker in filename else filename
+
+
+# Marcos de la propia instrumentación, que aparecen en todas las consultas y no dicen nada del origen
+_INSTRUMENTATION = {__file__, metrics.__file__}
+
+
+def query_origin(limit=3):
+    # Los últimos marcos del proyecto (fuera de librerías y de la instrumentación) que llevaron a la consulta
+    base = str(settings.BASE_DIR) + os.sep
+    frames = [
+        f"{_short_path(frame.filename)}:{frame.lineno} in {frame.name}"
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base) and 'site-packages' not in frame.filename and frame.filename not in _INSTRUMENTATION
+    ]
+    return frames[-limit:][::-1]
+
+
+class SQLRecorder:
+    def __init__(self):
+        self.queries = []
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.seconds += elapsed
+            if len(self.queries) < MAX_QUERIES:
+                self.queries.append({
+                    'sql': sql[:MAX_SQL_LENGTH],
+                    'params': repr(params)[:MAX_SQL_LENGTH] if params else '',
+                    'ms': round(elapsed * 1000, 3),
+                    'origin': query_origin(),
+                })
+
+
+def top_functions(profiler, limit=MAX_FUNCTIONS):
+    rows = [
+        {'function': f"{_short_path(filename)}:{line}({name})", 'calls': calls, 'own_ms': round(own * 1000, 3), 'cumulative_ms': round(cumulative * 1000, 3)}
+        for (filename, line, name), (_, calls, own, cumulative, _) in pstats.Stats(profiler).stats.items()
+    ]
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:limit]
+
+
+def save_request_profile(request, response, profiler, recorder, templates, seconds, sampled):
+    report = {
+        'functions': top_functions(profiler),
+        'queries': recorder.queries,
+        'queries_not_shown': recorder.count - len(recorder.queries),
+        'templates': [{'name': name, 'ms': round(elapsed * 1000, 3)} for name, elapsed in templates],
+    }
+    os.makedirs(settings.PROFILER_DIR, exist_ok=True)
+    report_file = f"{uuid.uuid4().hex}.json"
+    with open(os.path.join(settings.PROFILER_DIR, report_file), 'w', encoding='utf-8') as fh:
+        json.dump(report, fh)
+
+    match = request.resolver_match
+    user = getattr(request, 'user', None)
+    record = RequestProfile.objects.create(
+        method=request.method, path=request.get_full_path()[:500], view_name=match.view_name if match else '',
+        user=user if user is not None and user.is_authenticated else None, status_code=response.status_code,
+        duration_ms=round(seconds * 1000, 3), sql_count=recorder.count, sql_ms=round(recorder.seconds * 1000, 3),
+        sampled=sampled, report_file=report_file,
+    )
+    prune_request_profiles()
+    return record
+
+
+def prune_request_profiles():
+    # El almacén es acotado: se conservan los PROFILER_MAX_ENTRIES más recientes (la señal borra sus archivos)
+    ids = list(RequestProfile.objects.order_by('-created_at', '-id').values_list('id', flat=True)[settings.PROFILER_MAX_ENTRIES:])
+    if ids:
+        RequestProfile.objects.filter(id__in=ids).delete()
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.PROFILER_SAMPLE_RATE
+
+    def __call__(self, request):
+        # Búsqueda barata en el query string; solo si aparece se parsea para exigir exactamente __profile=1
+        requested = (
+            PROFILE_PARAM in request.META.get('QUERY_STRING', '') and request.GET.get(PROFILE_PARAM) == '1' and request.user.is_staff
+        )
+        sampled = not requested and self.sample_rate > 0 and random.random() < self.sample_rate
+        if not (requested or sampled) or not _profiler_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self.profile(request, sampled)
+        finally:
+            _profiler_lock.release()
+
+    def profile(self, request, sampled):
+        recorder, templates = SQLRecorder(), []
+        token = template_timings.set(templates)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+        finally:
+            template_timings.reset(token)
+        record = save_request_profile(request, response, profiler, recorder, templates, time.perf_counter() - started, sampled)
+        # Los muestreados al azar pueden ser de cualquier visitante: el enlace al admin solo se muestra a staff
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_staff:
+            response['X-Request-Profile'] = reverse('admin:booking_requestprofile_change', args=[record.pk])
+        return response
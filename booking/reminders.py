@@ -0,0 +1,108 @@
+import smtplib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import dateformat, timezone
+
+from .models import Appointment
+
+# --- RECORDATORIOS POR EMAIL ---
+# Cron ejecuta manage.py send_reminders cada minuto. Las citas confirmadas que empiezan dentro de las próximas
+# REMINDER_HOURS_BEFORE horas y aún no tienen reminded_at salen del índice parcial appt_reminder_due_idx, que solo
+# contiene citas esperando recordatorio. Cada lote se reclama marcando reminded_at en la misma transacción en que
+# se lee: dos ejecuciones que se cruzan nunca envían el mismo recordatorio. Todos los lotes usan una sola conexión
+# SMTP; si el servidor falla, se quita la marca de lo que no alcanzó a salir y la siguiente ejecución lo reintenta.
+
+REMINDER_FIELDS = (
+    'client_name', 'client_email', 'start_datetime', 'service__name',
+    'professional__display_name', 'professional__whatsapp_number',
+)
+# "lunes 3 de marzo a las 10:00" (los nombres salen en español por LANGUAGE_CODE)
+BODY_DATE_FORMAT = r'l j \d\e F \a \l\a\s H:i'
+SUBJECT_DATE_FORMAT = r'j/m \a \l\a\s H:i'
+
+
+def due_reminders(now, hours=None):
+    hours = settings.REMINDER_HOURS_BEFORE if hours is None else hours
+    # status='CONFIRMED' y reminded_at vacío: la condición del índice parcial, para que la consulta lo use
+    return Appointment.objects.filter(
+        status='CONFIRMED', reminded_at__isnull=True,
+        start_datetime__gt=now, start_datetime__lte=now + timedelta(hours=hours),
+    )
+
+
+def claim_batch(now, batch_size, hours=None):
+    # Devuelve los ids reclamados en orden de inicio; lista vacía cuando ya no quedan
+    with transaction.atomic():
+        ids = list(
+            due_reminders(now, hours).select_for_update(skip_locked=True)  # Otra ejecución ya tiene esas filas
+            .order_by('start_datetime', 'id').values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            Appointment.objects.filter(pk__in=ids).update(reminded_at=now)
+    return ids
+
+
+def release(ids, now):
+    Appointment.objects.filter(pk__in=ids, reminded_at=now).update(reminded_at=None)
+
+
+def reminder_message(appt, tz, connection):
+    start = appt.start_datetime.astimezone(tz)
+    business = appt.professional.display_name if appt.professional else 'Nexthora'
+    service = appt.service.name if appt.service else 'tu cita'
+    lines = [
+        f"Hola {appt.client_name},",
+        "",
+        f"Te recordamos tu cita de {service} en {business}, el {dateformat.format(start, BODY_DATE_FORMAT)}.",
+    ]
+    if appt.professional and appt.professional.whatsapp_number:
+        lines.append(f"Si necesitas cambiarla o cancelarla, escribe al WhatsApp {appt.professional.whatsapp_number}.")
+    lines += ["", "¡Te esperamos!"]
+    return EmailMessage(
+        subject=f"Recordatorio: {service} el {dateformat.format(start, SUBJECT_DATE_FORMAT)}",
+        body='\n'.join(lines), to=[appt.client_email], connection=connection,
+    )
+
+
+def send_reminders(now=None, batch_size=None, hours=None):
+    # Devuelve (enviados, rechazados). Un destinatario rechazado no se reintenta; un error del servidor sí
+    now = now or timezone.now()
+    batch_size = batch_size or settings.REMINDER_BATCH_SIZE
+    ids = claim_batch(now, batch_size, hours)
+    if not ids:
+        return 0, 0  # Lo normal cada minuto: sin conexión SMTP (ni TLS ni AUTH) si no hay nada que enviar
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:
+        release(ids, now)
+        raise
+
+    tz = timezone.get_current_timezone()
+    sent = refused = 0
+    try:
+        while ids:
+            pending = set(ids)
+            rows = (
+                Appointment.objects.filter(pk__in=ids).select_related('service', 'professional')
+                .only(*REMINDER_FIELDS).order_by('start_datetime', 'id').iterator(chunk_size=batch_size)
+            )
+            try:
+                for appt in rows:
+                    try:
+                        connection.send_messages([reminder_message(appt, tz, connection)])
+                        sent += 1
+                    except smtplib.SMTPRecipientsRefused:
+                        refused += 1
+                    pending.discard(appt.pk)
+            except Exception:
+                release(pending, now)
+                raise
+            ids = claim_batch(now, batch_size, hours)
+    finally:
+        connection.close()
+    return sent, refused
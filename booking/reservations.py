@@ -0,0 +1,82 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import bump_availability_version, bump_pending_version
+from .metrics import inc
+from .models import Appointment, ProfessionalProfile
+from .rollups import refresh_daily_stats
+from .slots import compute_available_slots, drop_past_slots, load_weekly_schedule
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+# Respaldo para bases sin SELECT ... FOR UPDATE (SQLite): un candado por profesional dentro del proceso.
+# Entre procesos, settings.py abre las transacciones de SQLite con BEGIN IMMEDIATE.
+_local_locks = defaultdict(threading.Lock)
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _local_lock(profile_id):
+    with _local_locks_guard:
+        lock = _local_locks[profile_id]
+    with lock:
+        yield
+
+
+def book_appointment(profile, service, start_datetime, **client_data):
+    # Revalida el bloque contra la base de datos (sin caché) mientras se tiene el candado del profesional
+    serialized = nullcontext() if connection.features.has_select_for_update else _local_lock(profile.pk)
+    with serialized, transaction.atomic():
+        profile = ProfessionalProfile.objects.select_for_update().get(pk=profile.pk)
+        local_start = timezone.localtime(start_datetime)
+        slots = compute_available_slots(profile, service.duration_minutes, local_start.date(), schedule=load_weekly_schedule(profile.pk))
+        if local_start.time() not in drop_past_slots(slots, local_start.date()):
+            inc('nexthora_booking_conflicts_total')
+            raise SlotUnavailable(f"{local_start:%d/%m/%Y %H:%M} ya no está disponible.")
+        appointment = Appointment.objects.create(professional=profile, service=service, start_datetime=start_datetime, **client_data)
+    inc('nexthora_bookings_created_total')
+    return appointment
+
+
+def bulk_update_status(profile, appointment_ids, new_status):
+    # Una consulta valida dueño y transición de todo el lote y un solo UPDATE lo aplica. update() no dispara
+    # señales, así que aquí se hace lo que harían: versión de disponibilidad, contador de pendientes y DailyStats.
+    # Devuelve {id: resultado}: 'updated', 'unchanged', 'invalid_transition' o 'not_found' (inexistente o ajena)
+    ids = set(appointment_ids)
+    with transaction.atomic():
+        current = {
+            pk: (status, start)
+            for pk, status, start in Appointment.objects.select_for_update()
+            .filter(professional=profile, id__in=ids).values_list('id', 'status', 'start_datetime')
+        }
+        results = {pk: 'not_found' for pk in ids - current.keys()}
+        changed = []
+        for pk, (status, _) in current.items():
+            if status == new_status:
+                results[pk] = 'unchanged'
+            elif new_status in Appointment.STATUS_TRANSITIONS.get(status, []):
+                results[pk] = 'updated'
+                changed.append(pk)
+            else:
+                results[pk] = 'invalid_transition'
+        if not changed:
+            return results
+
+        Appointment.objects.filter(id__in=changed).update(status=new_status, updated_at=timezone.now())
+        days = [timezone.localtime(current[pk][1]).date() for pk in changed]
+        refresh_daily_stats(profile.pk, min(days), max(days))
+
+    # Confirmar una pendiente no libera ni ocupa horas; cancelar o completar sí
+    now_active = new_status in Appointment.ACTIVE_STATUSES
+    if any((current[pk][0] in Appointment.ACTIVE_STATUSES) != now_active for pk in changed):
+        bump_availability_version(profile.pk)
+    if any((current[pk][0] == 'PENDING') != (new_status == 'PENDING') for pk in changed):
+        bump_pending_version(profile.pk)
+    return results
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Appointment, AppointmentArchive, DailyStats, local_day_start
+
+CANCELLED_STATUSES = ['CANCELLED_BY_CLIENT', 'CANCELLED_BY_PRO']
+STATS_FIELDS = ['confirmed_count', 'completed_count', 'cancelled_count', 'revenue']
+
+
+def _grouped_stats(model, professional_id, start_day, end_day):
+    appointments = model.objects.filter(professional_id=professional_id)
+    if start_day:
+        appointments = appointments.filter(start_datetime__gte=local_day_start(start_day))
+    if end_day:
+        appointments = appointments.filter(start_datetime__lt=local_day_start(end_day + timedelta(days=1)))
+    return (
+        appointments.annotate(day=TruncDate('start_datetime')).values('day').order_by()
+        .annotate(
+            confirmed_count=Count('id', filter=Q(status='CONFIRMED')),
+            completed_count=Count('id', filter=Q(status='COMPLETED')),
+            cancelled_count=Count('id', filter=Q(status__in=CANCELLED_STATUSES)),
+            revenue=Coalesce(Sum('service__price', filter=Q(status='CONFIRMED')), 0),
+        )
+    )
+
+
+def refresh_daily_stats(professional_id, start_day=None, end_day=None):
+    # Recalcula las filas de DailyStats del rango [start_day, end_day] (todo el historial si no hay rango).
+    # Suma la tabla de citas y el archivo: archivar no cambia los números
+    stats = DailyStats.objects.filter(professional_id=professional_id)
+    if start_day:
+        stats = stats.filter(day__gte=start_day)
+    if end_day:
+        stats = stats.filter(day__lte=end_day)
+
+    # El archivo solo guarda citas de hace al menos un día: las reservas de hoy en adelante no lo consultan
+    models = [Appointment]
+    if start_day is None or start_day < timezone.localdate():
+        models.append(AppointmentArchive)
+    by_day = {}
+    for model in models:
+        for row in _grouped_stats(model, professional_id, start_day, end_day):
+            day = row.pop('day')
+            if day in by_day:
+                by_day[day] = {field: by_day[day][field] + row[field] for field in STATS_FIELDS}
+            else:
+                by_day[day] = row
+    rows = [DailyStats(professional_id=professional_id, day=day, **row) for day, row in by_day.items()]
+
+    with transaction.atomic():
+        stats.exclude(day__in=[row.day for row in rows]).delete()
+        if rows:
+            DailyStats.objects.bulk_create(rows, update_conflicts=True, unique_fields=['professional', 'day'], update_fields=STATS_FIELDS)
+    return len(rows)
+
+
+def refresh_daily_stats_for_datetimes(professional_id, datetimes):
+    for day in {timezone.localtime(value).date() for value in datetimes if value}:
+        refresh_daily_stats(professional_id, day, day)
+
+
+def revenue_between(profile, start_day, end_day):
+    # Ingreso de las citas confirmadas entre start_day y end_day (ambos incluidos)
+    total = DailyStats.objects.filter(professional=profile, day__gte=start_day, day__lte=end_day).aggregate(total=Sum('revenue'))['total']
+    return total or 0
@@ -0,0 +1,255 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .bitmaps import clear_busy, find_slots, fits_grid, from_bytes, to_bytes, to_minutes, week_template
+from .caching import (
+    bump_availability_version, bump_schedule_version, get_many_bitmaps, get_many_slots, get_or_compute_slots,
+    get_or_compute_weekly_schedule, set_many_bitmaps, set_many_slots,
+)
+from .metrics import inc
+from .models import Appointment, BusinessHours, TimeOff
+
+ACTIVE_STATUSES = Appointment.ACTIVE_STATUSES
+
+# Rango permitido para la consulta de disponibilidad de varios días
+AVAILABILITY_DEFAULT_DAYS = 30
+AVAILABILITY_MAX_DAYS = 60
+
+
+# --- MOTOR DE BLOQUES: construye la lista de intervalos ocupados una sola vez y la recorre en una pasada ---
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def build_busy_intervals(appointments, buffer):
+    # appointments: pares (inicio, fin) en hora local sin tzinfo
+    return merge_intervals([(start, end + buffer) for start, end in appointments])
+
+
+def sweep_slots(work_start, work_end, duration, buffer, busy, lunch=None):
+    # La colación conserva su comportamiento de "salto": el siguiente bloque parte justo al terminar
+    slots = []
+    current_time = work_start
+    i, n = 0, len(busy)
+    while current_time + duration <= work_end:
+        slot_end = current_time + duration
+
+        if lunch and current_time < lunch[1] and slot_end > lunch[0]:
+            current_time = lunch[1]
+            continue
+
+        # Los bloques avanzan en orden, así que el puntero nunca retrocede
+        while i < n and busy[i][1] <= current_time:
+            i += 1
+        if i == n or busy[i][0] >= slot_end:
+            slots.append(current_time.time())
+        current_time = slot_end + buffer
+    return slots
+
+
+def profile_buffer(profile):
+    if profile.plan == 'FREE':
+        return timedelta(minutes=0)
+    return timedelta(minutes=profile.buffer_time_minutes)
+
+
+def profile_lunch(profile, check_date):
+    if profile.plan != 'FREE' and profile.lunch_start_time and profile.lunch_end_time:
+        return (datetime.combine(check_date, profile.lunch_start_time), datetime.combine(check_date, profile.lunch_end_time))
+    return None
+
+
+def compute_day_slots(profile, duration_minutes, check_date, start_time, end_time, appointments):
+    # appointments: pares (start_datetime, end_datetime) con zona horaria, tal como vienen de la base de datos.
+    # No recorta las horas ya pasadas para que el resultado se pueda guardar en caché; ver drop_past_slots.
+    buffer = profile_buffer(profile)
+    local_appointments = [
+        (timezone.localtime(start).replace(tzinfo=None), timezone.localtime(end).replace(tzinfo=None))
+        for start, end in appointments
+    ]
+    return sweep_slots(
+        datetime.combine(check_date, start_time),
+        datetime.combine(check_date, end_time),
+        timedelta(minutes=duration_minutes),
+        buffer,
+        build_busy_intervals(local_appointments, buffer),
+        profile_lunch(profile, check_date),
+    )
+
+
+def compute_shift_slots(profile, duration_minutes, check_date, shifts, appointments):
+    # Un día con horario partido (p. ej. 09-13 y 15-19): cada turno arma su propia grilla desde su inicio
+    slots = []
+    for start_time, end_time in shifts:
+        slots.extend(compute_day_slots(profile, duration_minutes, check_date, start_time, end_time, appointments))
+    return slots
+
+
+def drop_past_slots(slots, check_date, now=None):
+    # Saltarse un bloque pasado no altera la grilla, así que basta con filtrar al final
+    now = now or timezone.localtime(timezone.now())
+    if check_date != now.date():
+        return slots
+    current_time = now.time()
+    return [slot for slot in slots if slot >= current_time]
+
+
+def compute_available_slots(profile, duration_minutes, check_date, schedule=None):
+    # schedule: horario semanal compilado; si no se entrega se lee desde la caché
+    inc('nexthora_slot_computations_total', kind='day')
+    shifts = (schedule or get_weekly_schedule(profile.pk))[check_date.weekday()]
+    if not shifts: return []
+
+    is_blocked = TimeOff.objects.filter(professional=profile, start_date__lte=check_date, end_date__gte=check_date).exists()
+    if is_blocked: return []
+
+    existing_appointments = list(Appointment.objects.for_day(profile, check_date).active().values_list('start_datetime', 'end_datetime'))
+
+    return compute_shift_slots(profile, duration_minutes, check_date, shifts, existing_appointments)
+
+
+def get_available_slots(profile, service, check_date):
+    slots = get_or_compute_slots(
+        profile.pk, service.duration_minutes, check_date,
+        lambda: compute_available_slots(profile, service.duration_minutes, check_date),
+    )
+    return drop_past_slots(slots, check_date)
+
+
+def get_availability_range(profile, service, start_date, days):
+    # Un número fijo de consultas (horario, bloqueos, citas) para todo el rango; cada día se calcula en memoria
+    all_days = [start_date + timedelta(days=offset) for offset in range(days)]
+    now = timezone.localtime(timezone.now())
+    version, cached = get_many_slots(profile.pk, service.duration_minutes, all_days)
+    missing = [day for day in all_days if day not in cached]
+    if missing:
+        computed = _compute_availability_range(profile, service.duration_minutes, missing, version)
+        set_many_slots(profile.pk, version, service.duration_minutes, computed)
+        cached.update(computed)
+    return {day: drop_past_slots(cached[day], day, now) for day in all_days}
+
+
+def _load_range(profile, start_date, end_date):
+    # Días bloqueados y citas activas (agrupadas por día local) de todo el rango: dos consultas
+    blocked_days = set()
+    time_off = TimeOff.objects.filter(professional=profile, start_date__lte=end_date, end_date__gte=start_date).values_list('start_date', 'end_date')
+    for off_start, off_end in time_off:
+        day = max(off_start, start_date)
+        while day <= min(off_end, end_date):
+            blocked_days.add(day)
+            day += timedelta(days=1)
+
+    appointments_by_day = defaultdict(list)
+    existing_appointments = Appointment.objects.in_range(profile, start_date, end_date).active().values_list('start_datetime', 'end_datetime')
+    for start, end in existing_appointments:
+        appointments_by_day[timezone.localtime(start).date()].append((start, end))
+    return blocked_days, appointments_by_day
+
+
+def _compute_availability_range(profile, duration_minutes, days, version):
+    inc('nexthora_slot_computations_total', kind='range')
+    schedule = get_weekly_schedule(profile.pk)
+    buffer = int(profile_buffer(profile).total_seconds() // 60)
+    lunch = profile_lunch(profile, days[0])
+    lunch = (to_minutes(lunch[0]), to_minutes(lunch[1])) if lunch else None
+    if fits_grid(schedule, duration_minutes, buffer, lunch):
+        bitmaps = get_day_bitmaps(profile, schedule, days, version)
+        return {day: find_slots(bitmaps[day], schedule[day.weekday()], duration_minutes, buffer, lunch) for day in days}
+
+    # Horas fuera de la grilla de 5 minutos (p. ej. servicios de 22 minutos): barrido exacto sobre las citas
+    blocked_days, appointments_by_day = _load_range(profile, days[0], days[-1])
+    availability = {}
+    for day in days:
+        shifts = schedule[day.weekday()]
+        if day in blocked_days or not shifts:
+            availability[day] = []
+            continue
+        availability[day] = compute_shift_slots(profile, duration_minutes, day, shifts, appointments_by_day[day])
+    return availability
+
+
+# --- MAPAS DE BITS POR DÍA (ver bitmaps.py) ---
+
+def busy_minutes(day, appointments, buffer):
+    # Citas como minutos desde la medianoche local del día; el fin se redondea hacia arriba y suma el descanso
+    midnight = datetime.combine(day, datetime.min.time())
+    busy = []
+    for start, end in appointments:
+        start_offset = timezone.localtime(start).replace(tzinfo=None) - midnight
+        end_offset = timezone.localtime(end).replace(tzinfo=None) - midnight
+        busy.append((math.floor(start_offset.total_seconds() / 60), math.ceil(end_offset.total_seconds() / 60) + buffer))
+    return busy
+
+
+def build_day_bitmaps(profile, schedule, days):
+    buffer = int(profile_buffer(profile).total_seconds() // 60)
+    lunch = profile_lunch(profile, days[0])
+    template = week_template(schedule, (to_minutes(lunch[0]), to_minutes(lunch[1])) if lunch else None)
+    blocked_days, appointments_by_day = _load_range(profile, days[0], days[-1])
+    return {
+        day: 0 if day in blocked_days else clear_busy(template[day.weekday()], busy_minutes(day, appointments_by_day[day], buffer))
+        for day in days
+    }
+
+
+def get_day_bitmaps(profile, schedule, days, version):
+    # Se guardan como bytes (36 por día) bajo la misma versión que los bloques: cualquier cambio los invalida
+    bitmaps = {day: from_bytes(data) for day, data in get_many_bitmaps(profile.pk, version, days).items()}
+    missing = [day for day in days if day not in bitmaps]
+    if missing:
+        built = build_day_bitmaps(profile, schedule, missing)
+        set_many_bitmaps(profile.pk, version, {day: to_bytes(bits) for day, bits in built.items()})
+        bitmaps.update(built)
+    return bitmaps
+
+
+# --- HORARIO SEMANAL COMPILADO ---
+# Una tupla por día de la semana (0 = lunes) con sus turnos (inicio, fin) ordenados; los bloques que se
+# traslapan o se tocan quedan fundidos en uno solo.
+
+def compile_weekly_schedule(rows):
+    # rows: tríos (weekday, start_time, end_time)
+    days = [[] for _ in range(7)]
+    for weekday, start_time, end_time in rows:
+        days[weekday].append((start_time, end_time))
+    return tuple(tuple((start, end) for start, end in merge_intervals(intervals)) for intervals in days)
+
+
+def load_weekly_schedule(profile_id):
+    return compile_weekly_schedule(BusinessHours.objects.filter(professional_id=profile_id).values_list('weekday', 'start_time', 'end_time'))
+
+
+def get_weekly_schedule(profile_id):
+    return get_or_compute_weekly_schedule(profile_id, lambda: load_weekly_schedule(profile_id))
+
+
+def set_business_hours(profile, weekdays, start_time, end_time, add=False):
+    # Reemplaza los turnos de varios días (o les suma uno, con add=True) en una sola transacción:
+    # un DELETE y un INSERT para todos los días, en vez de dos consultas por día
+    shifts = {weekday: [(start_time, end_time)] for weekday in weekdays}
+    with transaction.atomic():
+        current = BusinessHours.objects.filter(professional=profile, weekday__in=weekdays)
+        if add:
+            for weekday, start, end in current.values_list('weekday', 'start_time', 'end_time'):
+                shifts[weekday].append((start, end))
+        current.delete()
+        BusinessHours.objects.bulk_create([
+            BusinessHours(professional=profile, weekday=weekday, start_time=start, end_time=end)
+            for weekday, intervals in shifts.items()
+            for start, end in merge_intervals(intervals)
+        ])
+    # bulk_create no dispara señales: se invalidan a mano el horario compilado y la disponibilidad
+    bump_schedule_version(profile.pk)
+    bump_availability_version(profile.pk)
@@ -0,0 +1,123 @@
+import functools
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+# --- COLA DE TAREAS ---
+# Las tareas se guardan como filas de Task (dentro de la misma transacción que las crea, así que un
+# rollback también las descarta) y las ejecuta `manage.py runworker`, fuera del ciclo de los requests.
+# En PostgreSQL cada worker reserva filas con SELECT ... FOR UPDATE SKIP LOCKED; en SQLite, que no
+# tiene bloqueo por fila, con un UPDATE condicional que solo un worker puede ganar.
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+class TaskFunction:
+    def __init__(self, func, max_attempts):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        # Los argumentos se guardan como JSON: deben ser ids, textos o números, nunca objetos
+        from .models import Task
+        return Task.objects.create(name=self.name, args=list(args), kwargs=kwargs, max_attempts=self.max_attempts)
+
+
+def task(func=None, *, max_attempts=None):
+    def register(func):
+        wrapped = TaskFunction(func, max_attempts or settings.TASK_MAX_ATTEMPTS)
+        REGISTRY[wrapped.name] = wrapped
+        return wrapped
+    return register(func) if func else register
+
+
+def retry_delay(attempts):
+    # Espera exponencial: 10 s, 20 s, 40 s... hasta TASK_RETRY_MAX_DELAY
+    return min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_MAX_DELAY)
+
+
+def _ready(now):
+    # Pendientes cuya hora llegó, o "en ejecución" cuyo worker murió sin terminarlas
+    stale = now - timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    return Q(status='PENDING', run_at__lte=now) | Q(status='RUNNING', locked_at__lt=stale)
+
+
+def claim_tasks(worker_id, limit=1):
+    from .models import Task
+    now = timezone.now()
+    claim = {'status': 'RUNNING', 'locked_at': now, 'locked_by': worker_id, 'attempts': F('attempts') + 1}
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(Task.objects.select_for_update(skip_locked=True).filter(_ready(now)).values_list('id', flat=True)[:limit])
+            Task.objects.filter(id__in=ids).update(**claim)
+    else:
+        ids = []
+        for candidate in Task.objects.filter(_ready(now)).values_list('id', flat=True)[:limit * 4]:
+            if Task.objects.filter(_ready(now), id=candidate).update(**claim):
+                ids.append(candidate)
+            if len(ids) == limit:
+                break
+    return list(Task.objects.filter(id__in=ids))
+
+
+def run_task(task):
+    from .models import Task
+    func = REGISTRY.get(task.name)
+    try:
+        if func is None:
+            raise LookupError(f"No hay una tarea registrada con el nombre {task.name}.")
+        func(*task.args, **task.kwargs)
+    except Exception:
+        if task.attempts >= task.max_attempts:
+            outcome = {'status': 'DEAD', 'finished_at': timezone.now()}
+        else:
+            outcome = {'status': 'PENDING', 'run_at': timezone.now() + timedelta(seconds=retry_delay(task.attempts))}
+        Task.objects.filter(pk=task.pk, locked_by=task.locked_by).update(locked_at=None, last_error=traceback.format_exc(), **outcome)
+        return False
+    Task.objects.filter(pk=task.pk, locked_by=task.locked_by).update(status='DONE', locked_at=None, finished_at=timezone.now())
+    return True
+
+
+def work(worker_id, burst=False, stop=None):
+    # Procesa tareas una a una; con burst=True termina apenas la cola queda vacía
+    stop = stop or threading.Event()
+    processed = failures = 0
+    while not stop.is_set():
+        if not connection.in_atomic_block:
+            # Como al empezar un request: descarta conexiones caídas o más viejas que CONN_MAX_AGE
+            close_old_connections()
+        try:
+            tasks = claim_tasks(worker_id)
+            for claimed in tasks:
+                run_task(claimed)
+                processed += 1
+        except DatabaseError:
+            # "database is locked" en SQLite o una conexión cortada: el hilo espera y vuelve a intentar.
+            # Una tarea que quedó en RUNNING la recupera _ready() pasado TASK_LOCK_TIMEOUT
+            if burst:
+                raise
+            failures += 1
+            delay = min(settings.TASK_POLL_INTERVAL * 2 ** (failures - 1), settings.TASK_DB_RETRY_MAX_DELAY)
+            logger.exception("Error de base de datos en el worker %s; reintento en %.0f s", worker_id, delay)
+            stop.wait(delay)
+            continue
+        failures = 0
+        if not tasks:
+            if burst:
+                break
+            stop.wait(settings.TASK_POLL_INTERVAL)
+    return processed
@@ -1,3 +1,1612 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import smtplib
+import shutil
+import tempfile
+import threading
+import unittest
+import time as _time
+from datetime import date, datetime, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models.signals import post_delete
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from .context_processors import NotificationSummary
+from . import metrics
+from .forms import ProfessionalProfileForm
+from .bitmaps import BITS_PER_DAY, clear_busy, from_bytes, is_free, to_bytes, week_template
+from .images import variant_name
+from .tasks import claim_tasks, retry_delay, run_task, task, work
+from .caching import LRUCache, bump_pending_version, bump_profile_page_version, get_availability_version, get_or_compute_slots, get_pending_count, get_profile_page_version, profile_resolver_cache
+from .rollups import revenue_between
+from .profiles import get_profile_or_404
+from .reservations import SlotUnavailable, book_appointment
+from .management.commands.bench_slots import nested_loop_slots, synthetic_day
+from .models import Appointment, AppointmentArchive, BusinessHours, DailyStats, ProfessionalProfile, RequestProfile, Service, Task, TimeOff
+from .slots import (
+    build_busy_intervals, compile_weekly_schedule, compute_available_slots, compute_day_slots, drop_past_slots, get_availability_range,
+    get_available_slots, get_weekly_schedule, merge_intervals, set_business_hours, sweep_slots,
+)
+
+
+def make_profile(username='pro', **fields):
+    user = User.objects.create_user(username=username, password='x')
+    profile = user.profile
+    for name, value in fields.items():
+        setattr(profile, name, value)
+    if fields:
+        profile.save()
+    return profile
+
+
+class SlotEngineTests(SimpleTestCase):
+    def test_merge_intervals(self):
+        a, b, c, d = (datetime(2030, 1, 1, h) for h in (9, 10, 11, 12))
+        self.assertEqual(merge_intervals([(c, d), (a, b), (b, c)]), [[a, d]])
+
+    def test_sweep_matches_nested_loop(self):
+        day = date(2030, 1, 7)
+        lunch = (datetime.combine(day, time(13, 0)), datetime.combine(day, time(14, 30)))
+        rng = random.Random(42)
+        for seed in range(200):
+            duration = timedelta(minutes=rng.choice([5, 15, 30, 45, 60]))
+            buffer = timedelta(minutes=rng.choice([0, 5, 10]))
+            work_start, work_end, booked = synthetic_day(day, rng.randint(0, 80), int(duration.total_seconds() // 60), seed)
+            for day_lunch in (None, lunch):
+                expected = nested_loop_slots(work_start, work_end, duration, buffer, booked, day_lunch)
+                busy = build_busy_intervals(booked, buffer)
+                self.assertEqual(sweep_slots(work_start, work_end, duration, buffer, busy, day_lunch), expected)
+
+
+class AvailableSlotsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(plan='PRO', buffer_time_minutes=10, lunch_start_time=time(13, 0), lunch_end_time=time(14, 0))
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30)
+        self.day = date(2030, 1, 7)
+        BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=time(9, 0), end_time=time(18, 0))
+
+    def book(self, hour, minute=0, status='PENDING'):
+        start = timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+        return Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana',
+                                          client_email='ana@example.com', start_datetime=start, status=status)
+
+    def test_buffer_lunch_and_appointments(self):
+        self.book(10, 20)
+        self.book(16, 0, status='CANCELLED_BY_CLIENT')
+        slots = get_available_slots(self.profile, self.service, self.day)
+        self.assertEqual(slots, [time(9, 0), time(9, 40), time(11, 0), time(11, 40), time(12, 20), time(14, 0), time(14, 40),
+                                 time(15, 20), time(16, 0), time(16, 40), time(17, 20)])
+
+    def test_time_off_blocks_day(self):
+        TimeOff.objects.create(professional=self.profile, start_date=self.day, end_date=self.day)
+        self.assertEqual(get_available_slots(self.profile, self.service, self.day), [])
+
+    def test_past_slots_are_hidden_today(self):
+        now = timezone.localtime(timezone.make_aware(datetime.combine(self.day, time(15, 5))))
+        slots = compute_day_slots(self.profile, 30, self.day, time(9, 0), time(18, 0), [])
+        self.assertEqual(drop_past_slots(slots, self.day, now), [time(15, 20), time(16, 0), time(16, 40), time(17, 20)])
+        self.assertEqual(drop_past_slots(slots, self.day + timedelta(days=1), now), slots)
+
+
+class SplitShiftScheduleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=60)
+        self.day = date(2030, 1, 7)
+        for start, end in ((time(9, 0), time(11, 0)), (time(15, 0), time(17, 0))):
+            BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=start, end_time=end)
+
+    def test_each_shift_has_its_own_slots(self):
+        expected = [time(9, 0), time(10, 0), time(15, 0), time(16, 0)]
+        self.assertEqual(get_available_slots(self.profile, self.service, self.day), expected)
+        self.assertEqual(get_availability_range(self.profile, self.service, self.day, 7)[self.day], expected)
+        start = timezone.make_aware(datetime.combine(self.day, time(15, 0)))
+        with self.captureOnCommitCallbacks(execute=True):
+            book_appointment(self.profile, self.service, start, client_name='Ana', client_email='ana@example.com')
+        self.assertEqual(get_available_slots(self.profile, self.service, self.day), [time(9, 0), time(10, 0), time(16, 0)])
+
+    def test_compiled_schedule_sorts_and_merges_overlaps(self):
+        rows = [(0, time(15, 0), time(19, 0)), (0, time(9, 0), time(13, 0)), (0, time(12, 0), time(14, 0)), (2, time(8, 0), time(9, 0))]
+        schedule = compile_weekly_schedule(rows)
+        self.assertEqual(schedule[0], ((time(9, 0), time(14, 0)), (time(15, 0), time(19, 0))))
+        self.assertEqual(schedule[1], ())
+        self.assertEqual(schedule[2], ((time(8, 0), time(9, 0)),))
+
+    def test_slot_computation_reads_the_compiled_schedule_from_cache(self):
+        get_weekly_schedule(self.profile.pk)
+        with CaptureQueriesContext(connection) as queries:
+            compute_available_slots(self.profile, 60, self.day)
+            compute_available_slots(self.profile, 60, self.day + timedelta(days=1))  # Día sin turnos: ni siquiera consulta bloqueos
+        self.assertFalse(any('booking_businesshours' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(len(queries), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=time(18, 0), end_time=time(19, 0))
+        self.assertEqual(len(get_weekly_schedule(self.profile.pk)[self.day.weekday()]), 3)
+
+    def test_set_business_hours_replaces_or_adds_shifts_in_bulk(self):
+        get_available_slots(self.profile, self.service, self.day)
+        with self.assertNumQueries(5):  # SAVEPOINT, SELECT y DELETE de los días, INSERT masivo y RELEASE: nada por día
+            set_business_hours(self.profile, [0, 1, 2, 3], time(9, 0), time(12, 0))
+        self.assertEqual(get_weekly_schedule(self.profile.pk)[0], ((time(9, 0), time(12, 0)),))
+        self.assertEqual(get_available_slots(self.profile, self.service, self.day), [time(9, 0), time(10, 0), time(11, 0)])
+
+        set_business_hours(self.profile, [0, 4], time(11, 0), time(14, 0), add=True)
+        schedule = get_weekly_schedule(self.profile.pk)
+        self.assertEqual(schedule[0], ((time(9, 0), time(14, 0)),))
+        self.assertEqual(schedule[4], ((time(11, 0), time(14, 0)),))
+        self.assertEqual(BusinessHours.objects.filter(professional=self.profile).count(), 5)
+
+    def test_schedule_view_adds_a_shift(self):
+        self.client.force_login(self.profile.user)
+        response = self.client.post(reverse('schedule'), {
+            'submit_hours': '1', 'hours-days': ['0', '1'], 'hours-start_time': '18:00', 'hours-end_time': '20:00', 'hours-add_shift': 'on',
+        })
+        self.assertRedirects(response, reverse('schedule'))
+        self.assertEqual(get_weekly_schedule(self.profile.pk)[0][-1], (time(18, 0), time(20, 0)))
+        self.assertEqual(len(get_weekly_schedule(self.profile.pk)[0]), 3)
+        self.assertEqual(get_weekly_schedule(self.profile.pk)[1], ((time(18, 0), time(20, 0)),))
+
+
+class AvailabilityRangeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(plan='PRO', buffer_time_minutes=5)
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=45)
+        self.start = date(2030, 1, 7)
+        for weekday in range(5):
+            BusinessHours.objects.create(professional=self.profile, weekday=weekday, start_time=time(9, 0), end_time=time(13, 0))
+        TimeOff.objects.create(professional=self.profile, start_date=date(2030, 1, 9), end_date=date(2030, 1, 10))
+        rng = random.Random(7)
+        for offset in range(21):
+            for _ in range(rng.randint(0, 4)):
+                start = datetime.combine(self.start + timedelta(days=offset), time(rng.randint(9, 12), rng.choice([0, 15, 30])))
+                Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana', client_email='ana@example.com',
+                                           start_datetime=timezone.make_aware(start))
+
+    def test_range_matches_single_day_computation(self):
+        availability = get_availability_range(self.profile, self.service, self.start, 21)
+        self.assertEqual(len(availability), 21)
+        for day, slots in availability.items():
+            self.assertEqual(slots, get_available_slots(self.profile, self.service, day), day)
+
+    def test_endpoint_uses_fixed_number_of_queries(self):
+        url = reverse('booking_availability', args=[self.profile.slug, self.service.id])
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'start': '2030-01-07', 'days': 60})
+        days = response.json()['days']
+        self.assertEqual(len(days), 60)
+        self.assertFalse(days[2]['available'])
+        self.assertFalse(days[5]['available'])
+
+    def test_endpoint_rejects_bad_dates(self):
+        url = reverse('booking_availability', args=[self.profile.slug, self.service.id])
+        self.assertEqual(self.client.get(url, {'start': 'mañana'}).status_code, 400)
+
+
+class AvailabilityBitmapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start = date(2030, 1, 7)
+
+    def test_bitmap_primitives(self):
+        self.assertEqual(BITS_PER_DAY, 288)
+        bits = clear_busy(week_template([((time(9, 0), time(12, 0)),)], (600, 610))[0], [(662, 671)])
+        self.assertEqual(len(to_bytes(bits)), 36)
+        self.assertEqual(from_bytes(to_bytes(bits)), bits)
+        self.assertTrue(is_free(bits, 540, 60))
+        self.assertFalse(is_free(bits, 570, 60))   # Toca la colación (10:00-10:10)
+        self.assertFalse(is_free(bits, 660, 15))   # Cita 11:02-11:11, redondeada hacia afuera
+        self.assertTrue(is_free(bits, 675, 5))
+        self.assertFalse(is_free(bits, 690, 60))   # Se pasa del turno
+
+    def test_bitmap_slots_match_the_sweep_on_random_calendars(self):
+        # Misma respuesta que get_available_slots (barrido sobre la base) para planes, turnos, descansos y duraciones variadas
+        rng = random.Random(17)
+        for n in range(6):
+            profile = make_profile(username=f'pro{n}', plan=rng.choice(['FREE', 'PRO']), buffer_time_minutes=rng.choice([0, 5, 10, 15]),
+                                   lunch_start_time=time(13, rng.choice([0, 10])), lunch_end_time=time(14, rng.choice([0, 30])))
+            for weekday in range(6):
+                BusinessHours.objects.create(professional=profile, weekday=weekday, start_time=time(8, rng.choice([0, 30])), end_time=time(12, 0))
+                if rng.random() < 0.5:
+                    BusinessHours.objects.create(professional=profile, weekday=weekday, start_time=time(12, 30), end_time=time(19, 0))
+            TimeOff.objects.create(professional=profile, start_date=self.start + timedelta(days=3), end_date=self.start + timedelta(days=3))
+            services = [Service.objects.create(professional=profile, name=f'S{minutes}', duration_minutes=minutes) for minutes in (15, 30, 45, 60, 22)]
+            for _ in range(40):
+                start = datetime.combine(self.start + timedelta(days=rng.randrange(14)), time(rng.randint(8, 18), rng.choice([0, 5, 20, 35, 47])))
+                Appointment.objects.create(professional=profile, service=rng.choice(services), client_name='Ana', client_email='ana@example.com',
+                                           start_datetime=timezone.make_aware(start), status=rng.choice(['PENDING', 'CONFIRMED', 'COMPLETED']))
+            for service in services:
+                availability = get_availability_range(profile, service, self.start, 14)
+                cache.clear()
+                for day, slots in availability.items():
+                    self.assertEqual(slots, get_available_slots(profile, service, day), (profile.plan, service.duration_minutes, day))
+                cache.clear()
+
+    def test_cached_bitmaps_are_shared_between_durations(self):
+        profile = make_profile(plan='PRO')
+        BusinessHours.objects.create(professional=profile, weekday=self.start.weekday(), start_time=time(9, 0), end_time=time(18, 0))
+        short = Service.objects.create(professional=profile, name='Corto', duration_minutes=15)
+        long = Service.objects.create(professional=profile, name='Largo', duration_minutes=90)
+        get_availability_range(profile, short, self.start, 30)
+        with CaptureQueriesContext(connection) as queries:
+            availability = get_availability_range(profile, long, self.start, 30)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(availability[self.start][:2], [time(9, 0), time(10, 30)])
+
+
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(plan='PRO')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=60)
+        self.day = date(2030, 1, 7)
+        BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=time(9, 0), end_time=time(12, 0))
+
+    def test_cached_slots_skip_the_database(self):
+        expected = get_available_slots(self.profile, self.service, self.day)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_available_slots(self.profile, self.service, self.day), expected)
+
+    def test_appointment_changes_invalidate(self):
+        self.assertEqual(len(get_available_slots(self.profile, self.service, self.day)), 3)
+        with self.captureOnCommitCallbacks(execute=True):  # Las versiones suben al confirmar la transacción
+            appt = Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana', client_email='ana@example.com',
+                                              start_datetime=timezone.make_aware(datetime.combine(self.day, time(10, 0))))
+        self.assertEqual(get_available_slots(self.profile, self.service, self.day), [time(9, 0), time(11, 0)])
+        appt.status = 'CANCELLED_BY_CLIENT'
+        with self.captureOnCommitCallbacks(execute=True):
+            appt.save()
+        self.assertEqual(len(get_available_slots(self.profile, self.service, self.day)), 3)
+
+    def test_versions_move_only_after_the_booking_commits(self):
+        availability, pending = get_availability_version(self.profile.pk), self.profile.pending_count
+        start = timezone.make_aware(datetime.combine(self.day, time(10, 0)))
+        with self.captureOnCommitCallbacks() as callbacks:
+            book_appointment(self.profile, self.service, start, client_name='Ana', client_email='ana@example.com')
+            # Sin COMMIT, otro request que calcule ahora no ve la cita: debe guardar bajo la versión vieja
+            self.assertEqual(get_availability_version(self.profile.pk), availability)
+            self.assertEqual(self.profile.pending_count, pending)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_availability_version(self.profile.pk), availability)
+        self.assertEqual(self.profile.pending_count, pending + 1)
+
+    def test_only_schedule_fields_bump_profile_version(self):
+        version = get_availability_version(self.profile.pk)
+        self.profile.bio = 'Nueva bio'
+        self.profile.save()
+        self.assertEqual(get_availability_version(self.profile.pk), version)
+        self.profile.buffer_time_minutes = 15
+        self.profile.save()
+        self.assertNotEqual(get_availability_version(self.profile.pk), version)
+
+
+
+class DirtyFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(display_name='Estudio')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+
+    def profile_writes(self, queries):
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].startswith(('UPDATE', 'INSERT')) and 'booking_professionalprofile' in query['sql']]
+
+    def test_login_does_not_write_the_profile(self):
+        version = get_profile_page_version(self.profile.slug)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login'), {'username': 'pro', 'password': 'x'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertTrue(any('"last_login"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(self.profile_writes(queries), [])
+        self.assertEqual(get_profile_page_version(self.profile.slug), version)
+
+    def test_toggles_write_only_the_changed_column(self):
+        self.client.force_login(self.profile.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('toggle_profile_visibility'))
+        writes = self.profile_writes(queries)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('SET "is_active" = ', writes[0])
+        self.assertNotIn('"bio"', writes[0])
+        self.assertFalse(ProfessionalProfile.objects.get(pk=self.profile.pk).is_active)
+
+    def test_unchanged_save_is_skipped_and_signals_check_fields(self):
+        appt = Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana', client_email='ana@example.com',
+                                          start_datetime=timezone.make_aware(datetime.combine(date(2031, 3, 3), time(10, 0))))
+        appt = Appointment.objects.select_related('service').get(pk=appt.pk)  # save() recalcula el término con el servicio
+        with self.assertNumQueries(0):
+            appt.save()
+
+        version = get_availability_version(self.profile.pk)
+        self.assertEqual(self.profile.pending_count, 1)
+        appt.client_name = 'Ana María'
+        with CaptureQueriesContext(connection) as queries:
+            appt.save()
+        self.assertEqual(len(queries), 1)  # Solo el UPDATE: ni estadísticas ni cachés
+        self.assertIn('"client_name" = ', queries.captured_queries[0]['sql'])
+        self.assertIn('"updated_at" = ', queries.captured_queries[0]['sql'])
+        self.assertEqual(get_availability_version(self.profile.pk), version)
+
+        appt.status = 'CONFIRMED'
+        with self.captureOnCommitCallbacks(execute=True):
+            appt.save()
+        self.assertNotEqual(get_availability_version(self.profile.pk), version)
+        self.assertEqual(self.profile.pending_count, 0)
+        self.assertEqual(DailyStats.objects.get(professional=self.profile, day=date(2031, 3, 3)).confirmed_count, 1)
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_misses_compute_once(self):
+        cache.clear()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            _time.sleep(0.1)
+            return [time(9, 0)]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get_or_compute_slots(99, 30, date(2030, 1, 7), compute))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[time(9, 0)]] * 8)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30)
+        self.day = date(2030, 1, 7)
+        BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=time(9, 0), end_time=time(18, 0))
+
+    def test_parallel_confirmations_book_the_slot_once(self):
+        url = reverse('booking_step2', args=[self.profile.slug, self.service.id]) + '?date=2030-01-07&time=10:00'
+        barrier = threading.Barrier(10)
+        outcomes = []
+
+        def confirm(n):
+            try:
+                barrier.wait()
+                response = self.client_class().post(url, {'client_name': f'Cliente {n}', 'client_last_name': 'Pérez', 'client_email': f'c{n}@example.com', 'client_whatsapp': '912345678'})
+                outcomes.append(response['Location'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=confirm, args=(n,)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Appointment.objects.filter(professional=self.profile).count(), 1)
+        self.assertEqual(sum('/book/success/' in location for location in outcomes), 1)
+        self.assertEqual(sum('?date=2030-01-07' in location for location in outcomes), 9)
+
+    def test_overlapping_slot_is_rejected(self):
+        start = timezone.make_aware(datetime.combine(self.day, time(10, 0)))
+        book_appointment(self.profile, self.service, start, client_name='Ana', client_email='ana@example.com')
+        with self.assertRaises(SlotUnavailable):
+            book_appointment(self.profile, self.service, start + timedelta(minutes=15), client_name='Bea', client_email='bea@example.com')
+
+
+class NotificationSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30)
+
+    def book(self, hour, status='PENDING'):
+        start = timezone.make_aware(datetime.combine(date(2030, 1, 7), time(hour, 0)))
+        return Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana',
+                                          client_email='ana@example.com', start_datetime=start, status=status)
+
+    def summary(self):
+        return NotificationSummary(User.objects.select_related('profile').get(pk=self.profile.user_id))
+
+    def test_counter_follows_status_changes(self):
+        first = self.book(9)
+        self.book(10, status='CONFIRMED')
+        self.assertEqual(self.summary().pending_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Appointment.objects.get(pk=self.book(11).pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile.pending_count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile.pending_count, 2)
+        second.status = 'CONFIRMED'
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+            first.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.profile.pending_count, 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile.pending_count, 0)
+
+    def test_count_taken_before_a_change_is_not_served_after_it(self):
+        def stale_count():
+            bump_pending_version(self.profile.pk)  # Otro request cambia una cita mientras este cuenta
+            return 5
+
+        self.assertEqual(get_pending_count(self.profile.pk, stale_count), 5)
+        self.assertEqual(get_pending_count(self.profile.pk, lambda: 4), 4)
+
+    def test_summary_queries_once_with_services(self):
+        for hour in range(9, 13):
+            self.book(hour)
+        summary = self.summary()
+        self.assertEqual(summary.pending_count, 4)
+        with self.assertNumQueries(1):
+            names = [notif.service.name for notif in summary.pending_appointments]
+            names += [notif.service.name for notif in summary.pending_appointments]
+        self.assertEqual(len(names), 8)
+
+    def test_no_pending_means_no_list_query(self):
+        summary = self.summary()
+        summary.pending_count
+        with self.assertNumQueries(0):
+            self.assertEqual(summary.pending_appointments, [])
+
+
+class DailyStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.cut = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.dye = Service.objects.create(professional=self.profile, name='Tinte', duration_minutes=60, price=25000)
+
+    def book(self, day, hour, service, status='PENDING'):
+        start = timezone.make_aware(datetime.combine(day, time(hour, 0)))
+        return Appointment.objects.create(professional=self.profile, service=service, client_name='Ana',
+                                          client_email='ana@example.com', start_datetime=start, status=status)
+
+    def stats(self, day):
+        row = DailyStats.objects.get(professional=self.profile, day=day)
+        return row.confirmed_count, row.completed_count, row.cancelled_count, row.revenue
+
+    def test_status_transitions_update_the_day(self):
+        day = date(2030, 1, 7)
+        appt = self.book(day, 9, self.cut)
+        self.book(day, 23, self.dye, status='CONFIRMED')
+        self.assertEqual(self.stats(day), (1, 0, 0, 25000))
+        appt.status = 'CONFIRMED'
+        appt.save()
+        self.assertEqual(self.stats(day), (2, 0, 0, 35000))
+        appt.status = 'CANCELLED_BY_PRO'
+        appt.save()
+        self.assertEqual(self.stats(day), (1, 0, 1, 25000))
+
+    def test_moving_and_deleting_refresh_both_days(self):
+        appt = self.book(date(2030, 1, 7), 9, self.cut, status='CONFIRMED')
+        appt.start_datetime += timedelta(days=1)
+        appt.save()
+        self.assertFalse(DailyStats.objects.filter(day=date(2030, 1, 7)).exists())
+        self.assertEqual(self.stats(date(2030, 1, 8)), (1, 0, 0, 10000))
+        appt.delete()
+        self.assertFalse(DailyStats.objects.exists())
+
+    def test_price_change_and_range_totals(self):
+        for offset in range(10):
+            self.book(date(2030, 1, 1) + timedelta(days=offset), 10, self.cut, status='CONFIRMED')
+        self.assertEqual(revenue_between(self.profile, date(2030, 1, 1), date(2030, 1, 5)), 50000)
+        self.cut.price = 12000
+        self.cut.save()
+        self.assertEqual(revenue_between(self.profile, date(2030, 1, 1), date(2030, 1, 31)), 120000)
+
+    def test_rebuild_command_matches_incremental_rows(self):
+        rng = random.Random(3)
+        for offset in range(20):
+            self.book(date(2030, 1, 1) + timedelta(days=offset // 2), 8 + offset % 12, rng.choice([self.cut, self.dye]),
+                      status=rng.choice(['PENDING', 'CONFIRMED', 'COMPLETED', 'CANCELLED_BY_CLIENT']))
+        incremental = list(DailyStats.objects.values_list('day', 'confirmed_count', 'completed_count', 'cancelled_count', 'revenue'))
+        DailyStats.objects.all().delete()
+        call_command('rebuild_daily_stats', stdout=StringIO())
+        self.assertEqual(list(DailyStats.objects.values_list('day', 'confirmed_count', 'completed_count', 'cancelled_count', 'revenue')), incremental)
+
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.day = date(2030, 1, 7)
+        self.first = self.book(9, 'PENDING')
+        self.second = self.book(10, 'PENDING')
+        self.cancelled = self.book(11, 'CANCELLED_BY_CLIENT')
+        self.foreign = Appointment.objects.create(professional=make_profile(username='otro'), service=self.service, client_name='Eva',
+                                                  client_email='eva@example.com', start_datetime=self.at(9))
+        self.client.force_login(self.profile.user)
+        self.url = reverse('bulk_update_appointments')
+
+    def at(self, hour):
+        return timezone.make_aware(datetime.combine(self.day, time(hour, 0)))
+
+    def book(self, hour, status):
+        return Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana',
+                                          client_email='ana@example.com', start_datetime=self.at(hour), status=status)
+
+    def test_one_update_for_the_batch_with_per_id_results(self):
+        pending = self.profile.pending_count
+        version = get_availability_version(self.profile.pk)
+        loaded_at = self.first.updated_at
+        ids = [self.first.id, self.second.id, self.cancelled.id, self.foreign.id, 999999]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'status': 'CONFIRMED', 'ids': ids})
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "booking_appointment"')]
+        self.assertEqual(len(updates), 1)
+
+        data = response.json()
+        self.assertEqual(data['updated'], 2)
+        self.assertEqual(data['results'], {
+            str(self.first.id): 'updated', str(self.second.id): 'updated', str(self.cancelled.id): 'invalid_transition',
+            str(self.foreign.id): 'not_found', '999999': 'not_found',
+        })
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, 'CONFIRMED')
+        self.assertGreater(self.first.updated_at, loaded_at)  # El feed .ics y su ETag ven el cambio
+        self.assertEqual(Appointment.objects.get(pk=self.foreign.pk).status, 'PENDING')
+        self.assertEqual(self.profile.pending_count, pending - 2)
+        self.assertEqual(get_availability_version(self.profile.pk), version)  # Siguen ocupando las mismas horas
+        self.assertEqual(DailyStats.objects.get(professional=self.profile, day=self.day).confirmed_count, 2)
+
+    def test_cancelling_frees_the_hours_and_repeating_is_unchanged(self):
+        version = get_availability_version(self.profile.pk)
+        self.client.post(self.url, {'status': 'CANCELLED_BY_PRO', 'ids': [self.first.id]})
+        self.assertNotEqual(get_availability_version(self.profile.pk), version)
+        stats = DailyStats.objects.get(professional=self.profile, day=self.day)
+        self.assertEqual(stats.cancelled_count, 2)
+        again = self.client.post(self.url, {'status': 'CANCELLED_BY_PRO', 'ids': [self.first.id]}).json()
+        self.assertEqual((again['updated'], again['results']), (0, {str(self.first.id): 'unchanged'}))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'status': 'BORRADA', 'ids': [self.first.id]}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'status': 'CONFIRMED', 'ids': ['x']}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'status': 'CONFIRMED'}).status_code, 400)
+
+    def test_single_status_change_follows_the_same_transitions(self):
+        url = reverse('update_appointment_status', args=[self.cancelled.id, 'PENDING'])
+        response = self.client.post(url)
+        self.assertEqual(Appointment.objects.get(pk=self.cancelled.pk).status, 'CANCELLED_BY_CLIENT')
+        self.assertEqual([str(m) for m in get_messages(response.wsgi_request)], ["La cita con Ana no admite ese cambio de estado."])
+
+        self.client.post(reverse('update_appointment_status', args=[self.first.id, 'CONFIRMED']))
+        self.assertEqual(Appointment.objects.get(pk=self.first.pk).status, 'CONFIRMED')
+
+class AppointmentsPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30)
+        self.client.force_login(self.profile.user)
+
+    def add_history(self, count, status='COMPLETED'):
+        # Varias citas comparten la misma hora para ejercitar el desempate por id
+        base = timezone.make_aware(datetime(2020, 1, 1, 9, 0))
+        Appointment.objects.bulk_create([
+            Appointment(professional=self.profile, service=self.service, client_name=f'C{n}', client_email='c@example.com',
+                        start_datetime=base + timedelta(hours=n // 3), end_datetime=base + timedelta(hours=n // 3, minutes=30), status=status)
+            for n in range(count)
+        ])
+
+    def test_fragments_walk_the_whole_history_once(self):
+        self.add_history(55)
+        response = self.client.get(reverse('appointments'))
+        seen = [cita.pk for cita in response.context['past_page'].items]
+        cursor = response.context['past_page'].next_cursor
+        while cursor:
+            fragment = self.client.get(reverse('appointments_page', args=['past']), {'cursor': cursor})
+            seen += [cita.pk for cita in fragment.context['appointments']]
+            cursor = fragment.get('X-Next-Cursor')
+        expected = list(Appointment.objects.order_by('-start_datetime', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_queries_do_not_grow_with_history(self):
+        self.add_history(10)
+        self.client.get(reverse('appointments'))
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('appointments'))
+        self.add_history(300)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('appointments'))
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(len(response.context['past_page'].items), 20)
+
+    def test_bad_cursor_and_tab(self):
+        self.assertEqual(self.client.get(reverse('appointments_page', args=['past']), {'cursor': '%%%'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('appointments_page', args=['nope'])).status_code, 404)
+
+
+
+class AppointmentArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.old_day = timezone.localdate() - timedelta(days=400)
+        self.old = [self.book(self.old_day, hour, status) for hour, status in ((9, 'COMPLETED'), (10, 'CANCELLED_BY_PRO'), (11, 'CONFIRMED'), (12, 'COMPLETED'))]
+        self.recent = self.book(timezone.localdate() - timedelta(days=5), 9, 'COMPLETED')
+        self.client.force_login(self.profile.user)
+
+    def book(self, day, hour, status):
+        start = timezone.make_aware(datetime.combine(day, time(hour, 0)))
+        return Appointment.objects.create(professional=self.profile, service=self.service, client_name=f'Cliente {hour}',
+                                          client_email='c@example.com', start_datetime=start, status=status)
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_appointments', '--older-than', '365', *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_only_old_finished_rows_in_batches_and_is_resumable(self):
+        stats = DailyStats.objects.get(professional=self.profile, day=self.old_day)
+        self.assertIn('3 cita(s)', self.archive('--dry-run'))
+        self.assertEqual(AppointmentArchive.objects.count(), 0)
+
+        self.assertIn('3 cita(s) movidas en 3 lote(s)', self.archive('--batch-size', '1'))
+        finished = [self.old[0], self.old[1], self.old[3]]
+        self.assertEqual(sorted(AppointmentArchive.objects.values_list('id', flat=True)), [appt.pk for appt in finished])
+        self.assertEqual(sorted(Appointment.objects.values_list('id', flat=True)), [self.old[2].pk, self.recent.pk])
+        archived = AppointmentArchive.objects.get(pk=self.old[0].pk)
+        self.assertEqual((archived.client_name, archived.service_id, archived.created_at), (self.old[0].client_name, self.service.pk, self.old[0].created_at))
+        self.assertIn('0 cita(s) movidas', self.archive())
+
+        # Los reportes no cambian, ni al reconstruirlos
+        call_command('rebuild_daily_stats', stdout=StringIO())
+        rebuilt = DailyStats.objects.get(professional=self.profile, day=self.old_day)
+        self.assertEqual((rebuilt.confirmed_count, rebuilt.completed_count, rebuilt.cancelled_count, rebuilt.revenue),
+                         (stats.confirmed_count, stats.completed_count, stats.cancelled_count, stats.revenue))
+
+    def test_history_tabs_and_export_read_both_tables(self):
+        self.archive()
+        response = self.client.get(reverse('appointments'))
+        past = [appt.pk for appt in response.context['past_page'].items]
+        self.assertEqual(past, [self.recent.pk, self.old[3].pk, self.old[2].pk, self.old[0].pk])
+        self.assertEqual([appt.pk for appt in response.context['cancelled_page'].items], [self.old[1].pk])
+
+        content = b''.join(self.client.get(reverse('export_appointments')).streaming_content).decode()
+        names = [line.split(',')[7] for line in content.splitlines()[1:]]
+        self.assertEqual(names, ['Cliente 9', 'Cliente 10', 'Cliente 11', 'Cliente 12', 'Cliente 9'])
+
+    def test_older_than_must_be_at_least_a_day(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_appointments', '--older-than', '0', stdout=StringIO())
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    connections = 0
+
+    def open(self):
+        type(self).connections += 1
+        return super().open()
+
+
+class AppointmentReminderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(display_name='Estudio Sol', whatsapp_number='+56911112222')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.now = timezone.now()
+
+    def book(self, hours, status='CONFIRMED', email='ana@example.com'):
+        return Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana', client_email=email,
+                                          start_datetime=self.now + timedelta(hours=hours), status=status)
+
+    def remind(self, *args):
+        out = StringIO()
+        call_command('send_reminders', *args, stdout=out)
+        return out.getvalue()
+
+    @override_settings(EMAIL_BACKEND='booking.tests.CountingEmailBackend')
+    def test_sends_each_due_reminder_once_over_one_connection(self):
+        due = [self.book(2), self.book(5), self.book(23)]
+        skipped = [self.book(30), self.book(-1), self.book(3, status='PENDING'), self.book(3, status='CANCELLED_BY_CLIENT')]
+        CountingEmailBackend.connections = 0
+
+        self.assertIn('3 recordatorio(s) por enviar', self.remind('--dry-run'))
+        self.assertIn('3 recordatorio(s) enviados', self.remind('--batch-size', '2'))
+        self.assertEqual(CountingEmailBackend.connections, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['ana@example.com'])
+        self.assertIn('Corte en Estudio Sol', mail.outbox[0].body)
+        self.assertIn('+56911112222', mail.outbox[0].body)
+        self.assertTrue(all(reminded for reminded in Appointment.objects.filter(pk__in=[a.pk for a in due]).values_list('reminded_at', flat=True)))
+        self.assertFalse(any(Appointment.objects.filter(pk__in=[a.pk for a in skipped]).values_list('reminded_at', flat=True)))
+
+        self.assertIn('0 recordatorio(s) enviados', self.remind())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(CountingEmailBackend.connections, 1)  # Sin citas por recordar no se abre la conexión
+
+    def test_failed_send_releases_the_claim(self):
+        first, second = self.book(2), self.book(3)
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=[1, OSError('SMTP caído')]):
+            with self.assertRaises(OSError):
+                self.remind()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNotNone(first.reminded_at)
+        self.assertIsNone(second.reminded_at)
+
+        self.remind()
+        self.assertEqual([message.subject.startswith('Recordatorio: Corte') for message in mail.outbox], [True])
+
+    def test_connection_failure_releases_the_first_batch(self):
+        appt = self.book(2)
+        with mock.patch.object(locmem.EmailBackend, 'open', side_effect=OSError('Sin conexión')):
+            with self.assertRaises(OSError):
+                self.remind()
+        self.assertIsNone(Appointment.objects.get(pk=appt.pk).reminded_at)
+
+    def test_refused_address_is_not_retried(self):
+        self.book(2, email='rebota@example.com')
+        refused = smtplib.SMTPRecipientsRefused({'rebota@example.com': (550, b'No such user')})
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=refused):
+            self.assertIn('1 dirección(es) rechazadas', self.remind())
+        self.assertIn('0 recordatorio(s) enviados', self.remind())
+
+    def test_rescheduling_clears_the_marker(self):
+        appt = self.book(2)
+        self.remind()
+        appt.refresh_from_db()
+        appt.start_datetime += timedelta(hours=1)
+        appt.save()
+        self.assertIsNone(Appointment.objects.get(pk=appt.pk).reminded_at)
+        self.remind()
+        self.assertEqual(len(mail.outbox), 2)
+
+class SargableQueryTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile()
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30)
+
+    def test_for_day_uses_local_midnights(self):
+        day = date(2030, 1, 7)
+        for hour, minute in [(0, 0), (23, 59)]:
+            Appointment.objects.create(professional=self.profile, service=self.service, client_name='Ana', client_email='ana@example.com',
+                                       start_datetime=timezone.make_aware(datetime.combine(day, time(hour, minute))))
+        Appointment.objects.create(professional=self.profile, service=self.service, client_name='Bea', client_email='bea@example.com',
+                                   start_datetime=timezone.make_aware(datetime.combine(day + timedelta(days=1), time(0, 0))))
+        self.assertEqual(Appointment.objects.for_day(self.profile, day).count(), 2)
+        self.assertEqual(Appointment.objects.in_range(self.profile, day, day + timedelta(days=1)).count(), 3)
+
+    def plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    @unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'), "EXPLAIN solo verificado en SQLite y PostgreSQL")
+    def test_day_queries_use_composite_indexes(self):
+        day_plan = self.plan(Appointment.objects.for_day(self.profile, date(2030, 1, 7)).active())
+        self.assertRegex(day_plan, r'appt_pro_(status_)?start_idx')
+        pending_plan = self.plan(Appointment.objects.filter(professional=self.profile, status='PENDING', start_datetime__gte=timezone.now()))
+        self.assertIn('appt_pro_status_start_idx', pending_plan)
+        off_plan = self.plan(TimeOff.objects.filter(professional=self.profile, start_date__lte=date(2030, 1, 7), end_date__gte=date(2030, 1, 7)))
+        self.assertIn('timeoff_pro_range_idx', off_plan)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_seed_and_benchmark_report(self):
+        cache.clear()
+        call_command('seed_data', professionals=2, days_back=10, days_ahead=5, stdout=StringIO())
+        self.assertEqual(User.objects.filter(username__startswith='bench_pro_').count(), 2)
+        self.assertTrue(Appointment.objects.exists())
+        self.assertTrue(DailyStats.objects.exists())
+
+        out = StringIO()
+        call_command('run_benchmarks', repeat=1, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['results']), {'slots_uncached', 'slots_cached', 'booking_view', 'profile_view', 'dashboard_view', 'appointments_view'})
+        self.assertEqual(report['results']['slots_cached']['queries'], 0)
+
+    def test_clear_removes_seeded_rows_only(self):
+        cache.clear()
+        keep = make_profile()
+        start = timezone.make_aware(datetime(2030, 1, 7, 10, 0))
+        Appointment.objects.create(professional=keep, client_name='Ana', client_email='ana@example.com', start_datetime=start, end_datetime=start + timedelta(minutes=30))
+        call_command('seed_data', professionals=2, days_back=10, days_ahead=5, stdout=StringIO())
+        Appointment.objects.create(client_name='Sin pro', client_email='x@seed.nexthora', start_datetime=start, end_datetime=start + timedelta(minutes=30))
+
+        per_row = mock.Mock()
+        post_delete.connect(per_row, sender=Appointment)
+        self.addCleanup(post_delete.disconnect, per_row, sender=Appointment)
+        call_command('seed_data', clear=True, professionals=0, batch_size=7, stdout=StringIO())
+        per_row.assert_not_called()
+        self.assertFalse(User.objects.filter(username__startswith='bench_pro_').exists())
+        self.assertEqual(list(ProfessionalProfile.objects.all()), [keep])
+        self.assertEqual(Appointment.objects.get().professional, keep)
+        self.assertFalse(Service.objects.exclude(professional=keep).exists())
+        self.assertFalse(DailyStats.objects.exclude(professional=keep).exists())
+
+
+# --- PRESUPUESTO DE CONSULTAS POR VISTA ---
+# Máximo de consultas SQL por request, medido con la caché vacía. Cada vista se mide con pocos datos y
+# luego con muchos más: el número debe ser el mismo (sin N+1) y no superar su presupuesto.
+# Las llaves son nombres de URL; 'nombre:post' mide el POST de una vista que también responde GET.
+QUERY_BUDGETS = {
+    'index': 0,
+    'register': 0,
+    'login': 0,
+    'logout': 4,
+    'dashboard': 9,
+    'profile_setup': 5,
+    'toggle_profile_visibility': 4,
+    'toggle_plan': 4,
+    'account_settings': 5,
+    'services': 7,
+    'edit_service': 6,
+    'toggle_service': 5,
+    'delete_service': 13,
+    'schedule': 7,
+    'delete_schedule': 5,
+    'delete_timeoff': 5,
+    'appointments': 13,
+    'appointments_page': 5,
+    'export_appointments': 5,
+    'calendar_token': 4,
+    'calendar_feed': 4,
+    'update_appointment_status': 11,
+    'bulk_update_appointments': 12,
+    'metrics': 2,
+    'booking_step1': 4,
+    'booking_availability': 5,
+    'booking_step2': 1,
+    'booking_step2:post': 13,
+    'booking_success': 1,
+    'public_profile': 2,
+}
+
+
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(plan='PRO', display_name='Estudio', lunch_start_time=time(13, 0), lunch_end_time=time(14, 0))
+        User.objects.filter(pk=self.profile.user_id).update(is_staff=True)  # /metrics es solo para staff
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        for weekday in range(7):
+            BusinessHours.objects.create(professional=self.profile, weekday=weekday, start_time=time(8, 0), end_time=time(20, 0))
+        self.booking_day = timezone.localdate() + timedelta(days=3)
+        self.rng = random.Random(7)
+
+    def grow(self, appointments, services):
+        # create() para que corran las señales igual que en producción (caché, contadores, estadísticas)
+        today = timezone.localdate()
+        catalog = [self.service] + [
+            Service.objects.create(professional=self.profile, name=f'Servicio {n}', duration_minutes=15, price=5000 + n)
+            for n in range(services)
+        ]
+        statuses = [choice[0] for choice in Appointment.STATUS_CHOICES]
+        for n in range(appointments):
+            day = today + timedelta(days=self.rng.choice([-40, -3, -1, 0, 1, 2, 5]))
+            start = timezone.make_aware(datetime.combine(day, time(8, 0)) + timedelta(minutes=5 * self.rng.randint(0, 130)))
+            Appointment.objects.create(
+                professional=self.profile, service=self.rng.choice(catalog), status=self.rng.choice(statuses),
+                client_name=f'Cliente {n}', client_email='c@example.com', start_datetime=start, end_datetime=start + timedelta(minutes=15),
+            )
+        TimeOff.objects.create(professional=self.profile, start_date=today + timedelta(days=30), end_date=today + timedelta(days=31))
+
+    def fresh_appointment(self):
+        start = timezone.make_aware(datetime.combine(self.booking_day + timedelta(days=1), time(7, 0)))
+        return Appointment.objects.create(professional=self.profile, service=self.service, status='PENDING', client_name='Nuevo',
+                                          client_email='n@example.com', start_datetime=start, end_datetime=start + timedelta(minutes=30))
+
+    def build_request(self, label):
+        # Devuelve (método, ruta, datos, ¿con sesión?); los objetos que la vista borra se crean de nuevo en cada medición
+        name, _, method = label.partition(':')
+        slug, service_id = self.profile.slug, self.service.id
+        booking = {'date': self.booking_day.isoformat()}
+        free = get_available_slots(self.profile, self.service, self.booking_day)
+        requests = {
+            'index': ('get', [], {}, False),
+            'register': ('get', [], {}, False),
+            'login': ('get', [], {}, False),
+            'logout': ('post', [], {}, True),
+            'dashboard': ('get', [], {}, True),
+            'profile_setup': ('get', [], {}, True),
+            'toggle_profile_visibility': ('post', [], {}, True),
+            'toggle_plan': ('post', [], {}, True),
+            'account_settings': ('get', [], {}, True),
+            'services': ('get', [], {}, True),
+            'edit_service': ('get', [service_id], {}, True),
+            'toggle_service': ('post', [lambda: Service.objects.create(professional=self.profile, name='Temporal', duration_minutes=15).id], {}, True),
+            'delete_service': ('post', [lambda: Service.objects.create(professional=self.profile, name='Temporal', duration_minutes=15).id], {}, True),
+            'schedule': ('get', [], {}, True),
+            'delete_schedule': ('post', [lambda: BusinessHours.objects.create(professional=self.profile, weekday=6, start_time=time(21, 0), end_time=time(22, 0)).id], {}, True),
+            'delete_timeoff': ('post', [lambda: TimeOff.objects.create(professional=self.profile, start_date=date(2031, 1, 1), end_date=date(2031, 1, 2)).id], {}, True),
+            'appointments': ('get', [], {}, True),
+            'appointments_page': ('get', ['past'], {}, True),
+            'export_appointments': ('get', [], {'format': 'excel'}, True),
+            'calendar_token': ('post', [], {}, True),
+            'calendar_feed': ('get', [lambda: self.profile.rotate_calendar_token()], {}, False),
+            'update_appointment_status': ('post', [lambda: self.fresh_appointment().id, 'CONFIRMED'], {}, True),
+            'bulk_update_appointments': ('post', [], {'status': 'CONFIRMED', 'ids': lambda: [self.fresh_appointment().id, self.fresh_appointment().id]}, True),
+            'metrics': ('get', [], {}, True),
+            'booking_step1': ('get', [slug, service_id], booking, False),
+            'booking_availability': ('get', [slug, service_id], {'days': 14}, False),
+            'booking_step2': ('get', [slug, service_id], {**booking, 'time': '10:00'}, False),
+            'booking_success': ('get', [slug, lambda: self.fresh_appointment().id], {}, False),
+            'public_profile': ('get', [slug], {}, False),
+        }
+        verb, args, data, logged_in = requests[name]
+        args = [arg() if callable(arg) else arg for arg in args]
+        data = {key: value() if callable(value) else value for key, value in data.items()}
+        path = reverse(name, args=args)
+        if method == 'post':
+            # Reserva real: toma el primer bloque libre para que la medición siempre llegue a crear la cita
+            verb = 'post'
+            path += f"?date={booking['date']}&time={free[0].strftime('%H:%M')}"
+            data = {'client_name': 'Ana', 'client_last_name': 'Soto', 'client_rut': '1-9', 'client_email': 'a@example.com', 'client_whatsapp': '+56900000000'}
+        return verb, path, data, logged_in
+
+    def measure(self, label):
+        verb, path, data, logged_in = self.build_request(label)
+        client = self.client_class()
+        if logged_in:
+            client.force_login(self.profile.user)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, verb)(path, data)
+            if response.streaming:
+                b''.join(response.streaming_content)  # Las consultas de un streaming corren al enviarlo
+        self.assertLess(response.status_code, 400, f"{label} respondió {response.status_code}")
+        sql = [query['sql'] for query in queries.captured_queries]
+        if label in ('toggle_profile_visibility', 'toggle_plan'):
+            client.post(path)  # Deshace el cambio: las vistas que se miden después esperan un perfil PRO y visible
+        return sql
+
+    def test_every_url_has_a_budget(self):
+        from . import urls
+        names = {pattern.name for pattern in urls.urlpatterns if pattern.name}
+        self.assertEqual(names, {label.partition(':')[0] for label in QUERY_BUDGETS})
+
+    def test_views_stay_within_budget_and_do_not_grow(self):
+        self.grow(appointments=3, services=1)
+        small = {label: self.measure(label) for label in QUERY_BUDGETS}
+        self.grow(appointments=60, services=12)
+        for label, budget in QUERY_BUDGETS.items():
+            large = self.measure(label)
+            with self.subTest(view=label):
+                report = '\n'.join(large)
+                self.assertEqual(len(small[label]), len(large), f"{label}: {len(small[label])} → {len(large)} consultas\n{report}")
+                self.assertLessEqual(len(large), budget, f"{label}: {len(large)} consultas (presupuesto {budget})\n{report}")
+
+
+
+class AppointmentExportTests(TestCase):
+    def setUp(self):
+        self.profile = make_profile(plan='PRO')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.day = timezone.localdate() - timedelta(days=10)
+        self.book(self.day, time(9, 0), 'COMPLETED', client_name='Ana', client_whatsapp='+56911112222')
+        self.book(self.day + timedelta(days=1), time(10, 0), 'CANCELLED_BY_CLIENT', client_name='=HYPERLINK("x")')
+        self.book(self.day + timedelta(days=5), time(11, 0), 'CONFIRMED', client_name='Eva')
+        other = make_profile(username='otro')
+        self.book(self.day, time(9, 0), 'COMPLETED', client_name='Ajena', professional=other)
+        self.client.force_login(self.profile.user)
+
+    def book(self, day, at, status, professional=None, **fields):
+        start = timezone.make_aware(datetime.combine(day, at))
+        return Appointment.objects.create(professional=professional or self.profile, service=self.service, status=status,
+                                          client_email='c@example.com', start_datetime=start, end_datetime=start, **fields)
+
+    def export(self, client=None, **params):
+        response = (client or self.client).get(reverse('export_appointments'), params)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_streams_own_history_in_order_with_formula_cells_escaped(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn(f'attachment; filename="citas-{self.profile.slug}-', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0][:3], ['Fecha', 'Inicio', 'Término'])
+        self.assertEqual([row[7] for row in rows[1:]], ['Ana', '\'=HYPERLINK("x")', 'Eva'])
+        self.assertEqual(rows[1][:7], [self.day.isoformat(), '09:00', '09:30', 'Corte', '30', '10000', 'Completada'])
+        self.assertEqual(rows[1][11], '+56911112222')  # Un teléfono no se toma por fórmula
+
+    def test_date_range_status_filters_and_excel_format(self):
+        _, content = self.export(start_date=self.day.isoformat(), end_date=(self.day + timedelta(days=1)).isoformat())
+        self.assertEqual(len(content.splitlines()), 3)
+        _, content = self.export(status=['COMPLETED', 'CONFIRMED'], format='excel')
+        self.assertTrue(content.startswith('\ufeffFecha;Inicio;'))
+        self.assertEqual([line.split(';')[7] for line in content.splitlines()[1:]], ['Ana', 'Eva'])
+
+    def test_invalid_range_redirects_with_message(self):
+        response = self.client.get(reverse('export_appointments'), {'start_date': '2030-01-02', 'end_date': '2030-01-01'})
+        self.assertRedirects(response, reverse('appointments'), fetch_redirect_response=False)
+        self.assertIn("La fecha de fin no puede ser anterior al inicio.", [str(m) for m in get_messages(response.wsgi_request)])
+
+    async def test_asgi_streams_an_async_iterator(self):
+        await self.async_client.aforce_login(self.profile.user)
+        response = await self.async_client.get(reverse('export_appointments'))
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8')
+        self.assertEqual(len(content.splitlines()), 4)
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(plan='PRO', display_name='Estudio, Luna')
+        self.service = Service.objects.create(professional=self.profile, name='Corte; clásico', duration_minutes=30, price=10000)
+        self.day = timezone.localdate() + timedelta(days=3)
+        self.pending = self.book(time(9, 0), 'PENDING', client_name='Ana')
+        self.confirmed = self.book(time(10, 0), 'CONFIRMED', client_name='Eva', client_last_name='Pérez ' + 'Larga' * 20)
+        self.book(time(11, 0), 'CANCELLED_BY_CLIENT', client_name='Nora')
+        self.book(time(9, 0), 'CONFIRMED', client_name='Lejana', day=self.day + timedelta(days=400))
+        self.url = reverse('calendar_feed', args=[self.profile.rotate_calendar_token()])
+
+    def book(self, at, status, day=None, **fields):
+        start = timezone.make_aware(datetime.combine(day or self.day, at))
+        return Appointment.objects.create(professional=self.profile, service=self.service, status=status, client_email='c@example.com',
+                                          start_datetime=start, end_datetime=start + timedelta(minutes=30), **fields)
+
+    def fetch(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        content = b''.join(response.streaming_content).decode() if response.streaming else ''
+        return response, content
+
+    def test_feed_lists_active_appointments_in_the_window(self):
+        response, content = self.fetch()
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR\r\n') and content.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+        self.assertIn(f'UID:appointment-{self.pending.pk}@nexthora', content)
+        self.assertIn('STATUS:TENTATIVE', content)
+        self.assertIn('X-WR-CALNAME:Nexthora · Estudio\\, Luna', content)
+        self.assertIn('SUMMARY:Corte\\; clásico · Ana', content)
+        self.assertNotIn('Nora', content)
+        self.assertNotIn('Lejana', content)
+        self.assertTrue(all(len(line.encode()) <= 75 for line in content.split('\r\n')))
+        self.assertIn('Larga' * 3, content.replace('\r\n ', ''))  # Las líneas largas se pliegan sin perder texto
+
+    def test_unchanged_calendar_costs_one_aggregate_and_returns_304(self):
+        first, _ = self.fetch()
+        with self.assertNumQueries(2):  # Perfil por token + agregado
+            again, content = self.fetch(if_none_match=first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(content, '')
+        self.assertEqual(again['ETag'], first['ETag'])
+
+    def test_changes_produce_a_new_etag(self):
+        etag = self.fetch()[0]['ETag']
+        self.pending.status = 'CANCELLED_BY_PRO'
+        self.pending.save()
+        response, content = self.fetch(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content.count('BEGIN:VEVENT'), 1)
+
+        self.service.name = 'Peinado'
+        self.service.save()
+        response, content = self.fetch(if_none_match=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Peinado · Eva', content)
+
+    def test_if_modified_since_alone_sees_cancellations(self):
+        first, _ = self.fetch()
+        self.assertNotIn('Last-Modified', first)
+        self.confirmed.status = 'CANCELLED_BY_PRO'  # La cita editada más recientemente sale del feed
+        self.confirmed.save()
+        response, content = self.fetch(if_modified_since=http_date(_time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Eva', content)
+
+    def test_vevents_are_served_from_cache(self):
+        self.fetch()
+        with self.assertNumQueries(3):  # Perfil + agregado + llaves; ninguna fila completa
+            response, content = self.fetch()
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+
+    def test_token_is_required_rotates_and_is_pro_only(self):
+        self.assertEqual(self.client.get(reverse('calendar_feed', args=['otro'])).status_code, 404)
+        self.client.force_login(self.profile.user)
+        self.client.post(reverse('calendar_token'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.profile.refresh_from_db()
+        new_url = reverse('calendar_feed', args=[self.profile.calendar_token])
+        self.assertContains(self.client.get(reverse('appointments')), new_url)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+
+        ProfessionalProfile.objects.filter(pk=self.profile.pk).update(plan='FREE')
+        self.assertEqual(self.client.get(new_url).status_code, 404)
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.profile = make_profile(plan='PRO', display_name='Estudio')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=60)
+        self.day = timezone.localdate() + timedelta(days=2)
+        BusinessHours.objects.create(professional=self.profile, weekday=self.day.weekday(), start_time=time(9, 0), end_time=time(12, 0))
+
+    def test_requests_are_recorded_per_view_with_queries_and_render_time(self):
+        url = reverse('booking_step1', args=[self.profile.slug, self.service.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'date': self.day.isoformat()})
+        executed = len(queries)  # Se cuenta antes del siguiente request, que vacía connection.queries
+        self.client.get(reverse('public_profile', args=['no-existe']))
+
+        registry = metrics.registry
+        self.assertEqual(registry.value('nexthora_http_requests_total', view='booking_step1', method='GET', status=200), 1)
+        self.assertEqual(registry.value('nexthora_http_requests_total', view='public_profile', method='GET', status=404), 1)
+        self.client.generic('BREW', reverse('public_profile', args=['no-existe']))  # Métodos inventados: una sola etiqueta
+        self.assertEqual(registry.value('nexthora_http_requests_total', view='public_profile', method='other', status=404), 1)
+        self.assertEqual(registry.value('nexthora_db_queries_total', view='booking_step1'), executed)
+        self.assertGreater(registry.value('nexthora_template_render_duration_seconds_total', view='booking_step1'), 0)
+        self.assertEqual(registry.value('nexthora_slot_computations_total', kind='day'), 1)
+        self.assertEqual(registry.value('nexthora_cache_requests_total', cache='slots', result='miss'), 1)
+
+        text = registry.render()
+        self.assertIn('# TYPE nexthora_http_request_duration_seconds histogram', text)
+        self.assertIn('nexthora_http_request_duration_seconds_bucket{view="booking_step1",le="+Inf"} 1', text)
+        self.assertIn('nexthora_http_request_duration_seconds_count{view="booking_step1"} 1', text)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_do_not_wrap_new_connections(self):
+        class FakeConnection:
+            execute_wrappers = []
+        metrics.instrument_new_connection(sender=None, connection=FakeConnection)
+        self.assertEqual(FakeConnection.execute_wrappers, [])
+
+    def test_booking_and_conflict_counters(self):
+        start = timezone.make_aware(datetime.combine(self.day, time(9, 0)))
+        book_appointment(self.profile, self.service, start, client_name='Ana', client_email='ana@example.com')
+        with self.assertRaises(SlotUnavailable):
+            book_appointment(self.profile, self.service, start, client_name='Eva', client_email='eva@example.com')
+        self.assertEqual(metrics.registry.value('nexthora_bookings_created_total'), 1)
+        self.assertEqual(metrics.registry.value('nexthora_booking_conflicts_total'), 1)
+
+    def test_histogram_buckets_are_cumulative_and_labels_escaped(self):
+        registry = metrics.Registry()
+        for seconds in (0.003, 0.02, 0.02, 30):
+            registry.observe('nexthora_http_request_duration_seconds', seconds, view='x"y')
+        text = registry.render()
+        self.assertIn('nexthora_http_request_duration_seconds_bucket{view="x\\"y",le="0.005"} 1', text)
+        self.assertIn('nexthora_http_request_duration_seconds_bucket{view="x\\"y",le="0.025"} 3', text)
+        self.assertIn('nexthora_http_request_duration_seconds_bucket{view="x\\"y",le="10.0"} 3', text)
+        self.assertIn('nexthora_http_request_duration_seconds_bucket{view="x\\"y",le="+Inf"} 4', text)
+
+    @override_settings(METRICS_TOKEN='secreto')
+    def test_endpoint_requires_token_or_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertContains(response, '# TYPE nexthora_bookings_created_total counter')
+
+        self.client.force_login(self.profile.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.filter(pk=self.profile.user_id).update(is_staff=True)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ProfilePageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(display_name='Estudio Luna', plan='PRO')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        self.url = reverse('public_profile', args=[self.profile.slug])
+
+    def test_repeat_hits_skip_the_database_and_revalidate_with_304(self):
+        first = self.client.get(self.url)
+        self.assertContains(first, 'Corte')
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_profile_and_service_changes_invalidate_the_page(self):
+        first = self.client.get(self.url)
+        self.service.name = 'Corte clásico'
+        self.service.save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, 'Corte clásico')
+
+        self.profile.refresh_from_db()
+        self.profile.display_name = 'Estudio Sol'
+        self.profile.save()
+        self.assertContains(self.client.get(self.url), 'Estudio Sol')
+
+        old_url = self.url
+        self.profile.slug = 'estudio-sol'
+        self.profile.save()
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+
+    @override_settings(PROFILE_PAGE_CACHE_TIMEOUT=0)
+    def test_stale_page_is_served_while_another_request_refreshes(self):
+        first = self.client.get(self.url)
+        Service.objects.filter(pk=self.service.pk).update(name='Renombrado')  # Sin señal: la copia sigue vigente
+        version = get_profile_page_version(self.profile.slug)
+        cache.add(f"profile:page:{self.profile.slug}:{version}:refresh", 1)
+        with CaptureQueriesContext(connection) as queries:
+            stale = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(stale.content, first.content)
+
+        cache.delete(f"profile:page:{self.profile.slug}:{version}:refresh")
+        self.assertContains(self.client.get(self.url), 'Renombrado')
+
+    def test_logged_in_visitors_get_an_uncached_page(self):
+        self.client.force_login(self.profile.user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ProfileResolverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        profile_resolver_cache.clear()
+        self.profile = make_profile(plan='PRO', buffer_time_minutes=10)
+
+    def test_repeat_lookups_skip_the_database(self):
+        with self.assertNumQueries(1):
+            first = get_profile_or_404(self.profile.slug)
+        with self.assertNumQueries(0):
+            second = get_profile_or_404(self.profile.slug)
+        self.assertEqual((second.pk, second.plan, second.buffer_time_minutes, second.is_active), (self.profile.pk, 'PRO', 10, True))
+        self.assertIsNot(first, second)
+
+    def test_saving_the_profile_invalidates_the_entry(self):
+        get_profile_or_404(self.profile.slug)
+        self.profile.is_active = False
+        self.profile.save()
+        self.assertFalse(get_profile_or_404(self.profile.slug).is_active)
+
+        old_slug = self.profile.slug
+        self.profile.slug = 'nuevo-enlace'
+        self.profile.save()
+        with self.assertRaises(Http404):
+            get_profile_or_404(old_slug)
+        self.assertEqual(get_profile_or_404('nuevo-enlace').pk, self.profile.pk)
+
+    def test_changes_from_another_process_are_seen_through_the_shared_version(self):
+        get_profile_or_404(self.profile.slug)
+        # Otro proceso guarda el perfil: su LRU local no es este, pero la versión compartida sí cambia
+        ProfessionalProfile.objects.filter(pk=self.profile.pk).update(plan='FREE')
+        bump_profile_page_version(self.profile.slug)
+        self.assertEqual(get_profile_or_404(self.profile.slug).plan, 'FREE')
+
+    def test_lru_is_bounded_and_entries_expire(self):
+        lru = LRUCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        self.assertEqual(len(lru), 2)
+
+        expiring = LRUCache(max_size=2, ttl=0)
+        expiring.set('a', 1)
+        self.assertIsNone(expiring.get('a'))
+
+    def test_slug_allocation_uses_one_query_and_fills_the_first_gap(self):
+        for username in ('ana', 'ana-1', 'ana-3', 'anabel'):
+            make_profile(username=username)
+        with self.assertNumQueries(1):
+            self.assertEqual(ProfessionalProfile.allocate_slug('ana'), 'ana-2')
+        self.assertEqual(ProfessionalProfile.allocate_slug('anabel'), 'anabel-1')
+        self.assertEqual(ProfessionalProfile.allocate_slug('carla'), 'carla')
+
+    def test_reserved_paths_are_not_profile_slugs(self):
+        self.assertEqual(make_profile(username='metrics').slug, 'metrics-1')
+        form = ProfessionalProfileForm(data={'display_name': 'Métricas', 'slug': 'metrics'}, instance=make_profile(username='otro'))
+        self.assertIn('slug', form.errors)
+
+
+class ProfileImagePipelineTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        self.profile = make_profile(plan='PRO')
+
+    def upload(self, name, size, fmt='JPEG'):
+        buffer = BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'Camara Secreta'  # Make
+        Image.new('RGB', size, 'teal').save(buffer, fmt, exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_variants_are_resized_and_stripped(self):
+        self.profile.profile_picture = self.upload('foto.jpg', (800, 600))
+        self.profile.banner_image = self.upload('banner.jpg', (1500, 400))
+        with self.captureOnCommitCallbacks(execute=True):  # Las tareas se encolan al confirmar la transacción
+            self.profile.save()
+        self.assertEqual(list(Task.objects.values_list('name', flat=True)), ['booking.images.process_profile_images'])
+
+        self.assertEqual(work('test', burst=True), 1)  # El request solo deja la tarea; el worker genera las variantes
+        self.profile.refresh_from_db()
+        picture, banner = self.profile.picture_variants, self.profile.banner_variants
+        self.assertEqual(picture.sizes, [['avatar', 96], ['profile', 256]])
+        self.assertEqual(banner.sizes, [['sm', 640], ['md', 1280]])  # Sin agrandar a 1920
+        self.assertIn('variants/banner.jpg_md.webp 1280w', banner.webp_srcset)
+        self.assertTrue(picture.src.endswith('variants/foto.jpg_avatar.jpg'))
+
+        storage = self.profile.profile_picture.storage
+        with Image.open(storage.path(variant_name(self.profile.profile_picture.name, 'avatar', 'jpg'))) as avatar:
+            self.assertEqual(avatar.size, (96, 96))
+            self.assertEqual(len(avatar.getexif()), 0)
+        self.assertContains(self.client.get(reverse('public_profile', args=[self.profile.slug])), 'banner.jpg_sm.webp 640w')
+
+    def test_same_stem_with_another_extension_gets_its_own_variants(self):
+        other = make_profile('otro', plan='PRO')
+        self.profile.profile_picture = self.upload('a.png', (300, 300), fmt='PNG')
+        other.profile_picture = self.upload('a.jpg', (300, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+            other.save()
+        work('test', burst=True)
+        self.profile.refresh_from_db()
+        other.refresh_from_db()
+        self.assertNotEqual(self.profile.picture_variants.src, other.picture_variants.src)
+
+        storage = other.profile_picture.storage
+        mine = variant_name(self.profile.profile_picture.name, 'avatar', 'webp')
+        other.profile_picture = self.upload('b.jpg', (300, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        work('test', burst=True)
+        self.assertTrue(storage.exists(mine))  # Reemplazar la foto del otro no borra las variantes de esta
+
+    def test_replacing_images_deletes_old_files_and_variants(self):
+        self.profile.profile_picture = self.upload('vieja.jpg', (300, 300))
+        self.profile.banner_image = self.upload('viejo.jpg', (900, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        work('test', burst=True)
+        self.profile.refresh_from_db()
+        storage = self.profile.profile_picture.storage
+        old_names = [self.profile.profile_picture.name, self.profile.banner_image.name,
+                     variant_name(self.profile.profile_picture.name, 'avatar', 'webp'), variant_name(self.profile.banner_image.name, 'sm', 'jpg')]
+        self.assertTrue(all(storage.exists(name) for name in old_names))
+
+        self.profile.profile_picture = self.upload('nueva.jpg', (300, 300))
+        self.profile.banner_image = self.upload('nuevo.jpg', (900, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        self.assertTrue(all(storage.exists(name) for name in old_names))
+        work('test', burst=True)
+        self.assertFalse(any(storage.exists(name) for name in old_names))
+        self.assertFalse(self.profile.picture_variants.ready)  # Hasta procesarla se sirve el original
+        self.assertEqual(self.profile.picture_variants.src, self.profile.profile_picture.url)
+
+    def test_old_files_are_queued_only_after_commit(self):
+        self.profile.profile_picture = self.upload('foto.jpg', (300, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.save()
+        Task.objects.all().delete()
+
+        self.profile.profile_picture = self.upload('otra.jpg', (300, 300))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.profile.save()
+            self.assertFalse(Task.objects.exists())  # Antes del commit la fila aún apunta a la foto anterior
+        self.assertEqual(len(callbacks), 2)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(sorted(Task.objects.values_list('name', flat=True)), ['booking.images.delete_profile_files', 'booking.images.process_profile_images'])
+
+    def test_banner_size_is_validated(self):
+        heavy = SimpleUploadedFile('banner.jpg', b'0' * (4 * 1024 * 1024 + 1))
+        form = ProfessionalProfileForm(data={'display_name': 'Estudio', 'slug': self.profile.slug}, files={'banner_image': heavy}, instance=self.profile)
+        self.assertFalse(form.is_valid())
+        self.assertIn('banner_image', form.errors)
+
+
+TASK_CALLS = []
+
+
+@task(max_attempts=2)
+def record_call(value, fail=False):
+    TASK_CALLS.append(value)
+    if fail:
+        raise RuntimeError("falla a propósito")
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        TASK_CALLS.clear()
+
+    def test_delay_stores_the_call_and_worker_runs_it(self):
+        queued = record_call.delay('hola')
+        self.assertEqual((queued.name, queued.args, queued.status), ('booking.tests.record_call', ['hola'], 'PENDING'))
+        self.assertEqual(TASK_CALLS, [])
+        self.assertEqual(work('test', burst=True), 1)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('DONE', 1))
+        self.assertEqual(TASK_CALLS, ['hola'])
+
+    def test_failures_back_off_and_end_dead(self):
+        queued = record_call.delay('x', fail=True)
+        work('test', burst=True)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('PENDING', 1))
+        self.assertGreater(queued.run_at, timezone.now() + timedelta(seconds=retry_delay(1) - 5))
+        self.assertIn('falla a propósito', queued.last_error)
+        self.assertEqual(work('test', burst=True), 0)  # Aún no toca reintentar
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        work('test', burst=True)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('DEAD', 2))
+        self.assertEqual(TASK_CALLS, ['x', 'x'])
+        self.assertEqual([retry_delay(n) for n in (1, 2, 3)], [10, 20, 40])
+
+    def test_a_task_is_claimed_once_and_abandoned_ones_are_reclaimed(self):
+        queued = record_call.delay('y')
+        self.assertEqual(claim_tasks('a'), [queued])
+        self.assertEqual(claim_tasks('b'), [])
+
+        Task.objects.filter(pk=queued.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        [reclaimed] = claim_tasks('b')
+        self.assertEqual((reclaimed.locked_by, reclaimed.attempts), ('b', 2))
+        self.assertTrue(run_task(reclaimed))
+
+    def test_unknown_tasks_fail_instead_of_crashing_the_worker(self):
+        Task.objects.create(name='booking.tests.no_existe', max_attempts=1)
+        work('test', burst=True)
+        self.assertEqual(Task.objects.get().status, 'DEAD')
+
+    def test_database_errors_back_off_instead_of_stopping_the_worker(self):
+        record_call.delay('z')
+        claimed = claim_tasks('test')
+        stop = mock.Mock(**{'is_set.side_effect': [False, False, True]})
+        with mock.patch('booking.tasks.claim_tasks', side_effect=[OperationalError('database is locked'), claimed]), \
+                self.assertLogs('booking.tasks', 'ERROR'):
+            self.assertEqual(work('test', stop=stop), 1)
+        stop.wait.assert_called_once_with(1.0)
+        self.assertEqual(TASK_CALLS, ['z'])
+
+        with mock.patch('booking.tasks.claim_tasks', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                work('test', burst=True)  # En burst (cron, pruebas) el error se propaga
+
+    def test_runworker_burst(self):
+        record_call.delay(1)
+        record_call.delay(2)
+        out = StringIO()
+        call_command('runworker', '--burst', '--concurrency', '1', stdout=out)
+        self.assertIn('2 tarea(s) procesadas', out.getvalue())
+        self.assertEqual(sorted(TASK_CALLS), [1, 2])
+
+
+class PublicBookingFlowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.profile = make_profile(display_name='Estudio Luna', plan='PRO')
+        self.service = Service.objects.create(professional=self.profile, name='Corte', duration_minutes=30, price=10000)
+        for weekday in range(7):
+            BusinessHours.objects.create(professional=self.profile, weekday=weekday, start_time=time(9, 0), end_time=time(12, 0))
+        self.day = timezone.localdate() + timedelta(days=2)
+
+    def test_public_flow(self):
+        slug, service_id = self.profile.slug, self.service.id
+        profile = self.client.get(reverse('public_profile', args=[slug]))
+        self.assertContains(profile, 'Corte')
+
+        booking = self.client.get(reverse('booking_step1', args=[slug, service_id]), {'date': self.day.isoformat()})
+        self.assertEqual(booking.context['available_slots'][0].strftime('%H:%M'), '09:00')
+
+        confirm_url = reverse('booking_step2', args=[slug, service_id]) + f"?date={self.day.isoformat()}&time=09:00"
+        self.assertContains(self.client.get(confirm_url), 'Corte')
+        data = {'client_name': 'Ana', 'client_last_name': 'Soto', 'client_rut': '1-9', 'client_email': 'a@example.com', 'client_whatsapp': '+56900000000'}
+        booked = self.client.post(confirm_url, data)
+        appointment = Appointment.objects.get(professional=self.profile)
+        self.assertRedirects(booked, reverse('booking_success', args=[slug, appointment.id]), fetch_redirect_response=False)
+        self.assertContains(self.client.get(booked['Location']), 'Estudio Luna')
+
+        taken = self.client.post(confirm_url, data)
+        self.assertRedirects(taken, reverse('booking_step1', args=[slug, service_id]) + f"?date={self.day.isoformat()}", fetch_redirect_response=False)
+
+    def test_invalid_client_data_re_renders_the_form(self):
+        confirm_url = reverse('booking_step2', args=[self.profile.slug, self.service.id]) + f"?date={self.day.isoformat()}&time=09:00"
+        missing = self.client.post(confirm_url, {'client_name': 'Ana', 'client_rut': '1-9'})
+        self.assertEqual(missing.status_code, 200)
+        self.assertContains(missing, 'Este campo es obligatorio.')
+        self.assertContains(missing, 'value="Ana"')
+
+        long_rut = self.client.post(confirm_url, {'client_name': 'Ana', 'client_email': 'a@example.com', 'client_rut': '1' * 13})
+        self.assertEqual(long_rut.status_code, 200)
+        self.assertIn('client_rut', long_rut.context['form'].errors)  # En PostgreSQL llegaba a la base como DataError
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_owner_and_missing_objects(self):
+        self.client.force_login(self.profile.user)
+        owner = self.client.get(reverse('public_profile', args=[self.profile.slug]))
+        self.assertContains(owner, 'Estudio Luna')  # Con sesión: sin caché, con la barra del profesional
+        self.assertFalse(owner.has_header('ETag'))
+        self.assertEqual((self.client.get(reverse('booking_step1', args=[self.profile.slug, 999]))).status_code, 404)
+        self.assertEqual((self.client.get(reverse('booking_success', args=['otro', 1]))).status_code, 404)
+
+
+class RequestProfilerTests(TestCase):
+    def setUp(self):
+        self.reports = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.reports, ignore_errors=True)
+        self.enterContext(override_settings(PROFILER_DIR=self.reports, PROFILER_SAMPLE_RATE=0.0))
+        self.profile = make_profile(plan='PRO')
+        self.staff = User.objects.create_user(username='staff', password='x', is_staff=True, is_superuser=True)
+
+    def test_staff_profile_records_functions_sql_origin_and_templates(self):
+        self.client.force_login(self.profile.user)
+        User.objects.filter(pk=self.profile.user_id).update(is_staff=True, is_superuser=True)
+        response = self.client.get(reverse('dashboard'), {'__profile': '1'})
+        self.assertEqual(response.status_code, 200)
+
+        record = RequestProfile.objects.get()
+        self.assertEqual(response['X-Request-Profile'], reverse('admin:booking_requestprofile_change', args=[record.pk]))
+        self.assertEqual((record.view_name, record.status_code, record.user_id), ('dashboard', 200, self.profile.user_id))
+        self.assertGreater(record.sql_count, 0)
+        report = record.load_report()
+        self.assertEqual(len(report['queries']), record.sql_count)
+        self.assertTrue(any('booking/views.py' in frame for query in report['queries'] for frame in query['origin']))
+        self.assertIn('dashboard.html', [template['name'] for template in report['templates']])
+        self.assertTrue(report['functions'])
+
+        admin_page = self.client.get(response['X-Request-Profile'])
+        self.assertContains(admin_page, 'dashboard.html')
+        record.delete()
+        self.assertFalse(os.path.exists(record.report_path))
+
+    def test_parameter_must_match_exactly(self):
+        self.client.force_login(self.staff)
+        for params in ({'x__profile': '1'}, {'__profile': '10'}, {'__profile': '0'}):
+            self.assertFalse(self.client.get(reverse('index'), params).has_header('X-Request-Profile'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_parameter_is_ignored_for_non_staff_users(self):
+        self.client.force_login(self.profile.user)
+        response = self.client.get(reverse('dashboard'), {'__profile': '1'})
+        self.assertFalse(response.has_header('X-Request-Profile'))
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_sampling_profiles_anonymous_requests_and_store_is_bounded(self):
+        with override_settings(PROFILER_SAMPLE_RATE=1.0, PROFILER_MAX_ENTRIES=2):
+            for _ in range(3):
+                response = self.client.get(reverse('public_profile', args=[self.profile.slug]))
+                self.assertFalse(response.has_header('X-Request-Profile'))  # El enlace al admin es solo para staff
+        self.assertEqual(RequestProfile.objects.filter(sampled=True, user=None).count(), 2)
+        self.assertEqual(sorted(os.listdir(self.reports)), sorted(RequestProfile.objects.values_list('report_file', flat=True)))
+
+    @override_settings(PROFILER_ENABLED=False)
+    def test_disabled_profiler_is_not_loaded(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('index'), {'__profile': '1'})
+        self.assertFalse(response.has_header('X-Request-Profile'))
+        self.assertFalse(RequestProfile.objects.exists())
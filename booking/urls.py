@@ -26,9 +26,17 @@ urlpatterns = [
     path('dashboard/schedule/delete-off/<int:timeoff_id>/', views.delete_timeoff_view, name='delete_timeoff'),
 
     path('dashboard/appointments/', views.appointments_view, name='appointments'),
+    path('dashboard/appointments/export/', views.export_appointments_view, name='export_appointments'),
+    path('dashboard/appointments/calendar/', views.calendar_token_view, name='calendar_token'),
+    path('dashboard/appointments/page/<str:tab>/', views.appointments_page_view, name='appointments_page'),
+    path('dashboard/appointments/bulk-status/', views.bulk_update_appointments_view, name='bulk_update_appointments'),
     path('dashboard/appointments/<int:appt_id>/status/<str:new_status>/', views.update_appointment_status, name='update_appointment_status'),
+
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('calendar/<str:token>.ics', views.calendar_feed_view, name='calendar_feed'),
     
     path('<slug:profile_slug>/book/<int:service_id>/', views.booking_view, name='booking_step1'),
+    path('<slug:profile_slug>/book/<int:service_id>/availability/', views.booking_availability_view, name='booking_availability'),
     path('<slug:profile_slug>/book/<int:service_id>/confirm/', views.booking_confirm_view, name='booking_step2'),
     
     # --- NUEVA RUTA PARA EL ÉXITO ---
@@ -1,14 +1,30 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
 from datetime import datetime, timedelta, date, time
 from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm
 
-from .forms import NexthoraUserCreationForm, ServiceForm, BatchScheduleForm, TimeOffForm, ProfessionalProfileForm, AccountSettingsForm, ProScheduleSettingsForm
-from .models import Service, ProfessionalProfile, BusinessHours, TimeOff, Appointment
+from .forms import NexthoraUserCreationForm, ServiceForm, BatchScheduleForm, TimeOffForm, ProfessionalProfileForm, AccountSettingsForm, ProScheduleSettingsForm, AppointmentExportForm, BookingClientForm
+from .models import Service, ProfessionalProfile, BusinessHours, TimeOff, Appointment, AppointmentArchive
+from .caching import get_or_render_profile_page
+from .calendar_feed import feed_etag, feed_queryset, feed_window, stream_feed
+from .exports import EXPORT_FORMATS, aiterate, appointment_rows, export_querysets, stream_csv
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from .pagination import InvalidCursor, keyset_page
+from .profiles import get_profile_or_404
+from .reservations import book_appointment, bulk_update_status, SlotUnavailable
+from .rollups import revenue_between
+from .slots import get_available_slots, get_availability_range, set_business_hours, AVAILABILITY_DEFAULT_DAYS, AVAILABILITY_MAX_DAYS
 
 # --- ACTUALIZADO: Ahora muestra la Landing Page en vez de redirigir al Login ---
 def index_view(request):
@@ -116,27 +132,21 @@ def dashboard_view(request):
     today = timezone.localtime(now).date()
     tomorrow = today + timedelta(days=1)
 
-    today_appointments = Appointment.objects.filter(
-        professional=profile, start_datetime__date=today, status__in=['PENDING', 'CONFIRMED']
-    ).order_by('start_datetime')
+    today_appointments = Appointment.objects.for_day(profile, today).active().select_related('service').order_by('start_datetime')
     
-    tomorrow_appointments = Appointment.objects.filter(
-        professional=profile, start_datetime__date=tomorrow, status__in=['PENDING', 'CONFIRMED']
-    ).order_by('start_datetime')
+    tomorrow_appointments = Appointment.objects.for_day(profile, tomorrow).active().select_related('service').order_by('start_datetime')
 
     next_appointment = today_appointments.filter(start_datetime__gte=now).first()
     
     pending_appointments = Appointment.objects.filter(
         professional=profile, status='PENDING'
-    ).order_by('created_at')
+    ).select_related('service').order_by('created_at')
     
-    pending_count = pending_appointments.count()
+    pending_count = profile.pending_count
 
     current_month = today.replace(day=1)
-    monthly_appointments = Appointment.objects.filter(
-        professional=profile, status='CONFIRMED', start_datetime__gte=current_month
-    )
-    monthly_income = sum(app.service.price for app in monthly_appointments if app.service and app.service.price)
+    next_month = (current_month + timedelta(days=32)).replace(day=1)
+    monthly_income = revenue_between(profile, current_month, next_month - timedelta(days=1))
 
     return render(request, 'dashboard.html', {
         'today_appointments': today_appointments,
@@ -173,9 +183,15 @@ def services_view(request):
 
     return render(request, 'services.html', {'form': form, 'services': services, 'services_count': services_count, 'service_limit': SERVICE_LIMIT, 'profile': profile})
 
+def get_own_service(request, service_id):
+    profile = request.user.profile
+    service = get_object_or_404(Service, id=service_id, professional=profile)
+    service.professional = profile  # Ya está cargado: las señales no vuelven a consultarlo
+    return service
+
 @login_required
 def edit_service_view(request, service_id):
-    service = get_object_or_404(Service, id=service_id, professional=request.user.profile)
+    service = get_own_service(request, service_id)
     if request.method == 'POST':
         form = ServiceForm(request.POST, instance=service)
         if form.is_valid():
@@ -188,7 +204,7 @@ def edit_service_view(request, service_id):
 
 @login_required
 def toggle_service_view(request, service_id):
-    service = get_object_or_404(Service, id=service_id, professional=request.user.profile)
+    service = get_own_service(request, service_id)
     service.is_active = not service.is_active
     service.save()
     estado = "visible" if service.is_active else "oculto"
@@ -197,7 +213,7 @@ def toggle_service_view(request, service_id):
 
 @login_required
 def delete_service_view(request, service_id):
-    service = get_object_or_404(Service, id=service_id, professional=request.user.profile)
+    service = get_own_service(request, service_id)
     if request.method == 'POST':
         service.delete()
         messages.success(request, "Servicio eliminado.")
@@ -214,15 +230,15 @@ def schedule_view(request):
         if 'submit_hours' in request.POST:
             hours_form = BatchScheduleForm(request.POST, prefix='hours')
             if hours_form.is_valid():
-                selected_days = hours_form.cleaned_data['days']
+                selected_days = [int(day_code) for day_code in hours_form.cleaned_data['days']]
                 start = hours_form.cleaned_data['start_time']
                 end = hours_form.cleaned_data['end_time']
-                count = 0
-                for day_code in selected_days:
-                    BusinessHours.objects.filter(professional=profile, weekday=int(day_code)).delete()
-                    BusinessHours.objects.create(professional=profile, weekday=int(day_code), start_time=start, end_time=end)
-                    count += 1
-                messages.success(request, f"Horario actualizado para {count} días.")
+                add_shift = hours_form.cleaned_data['add_shift']
+                set_business_hours(profile, selected_days, start, end, add=add_shift)
+                if add_shift:
+                    messages.success(request, f"Turno agregado a {len(selected_days)} días.")
+                else:
+                    messages.success(request, f"Horario actualizado para {len(selected_days)} días.")
                 return redirect('schedule')
         
         elif 'submit_off' in request.POST:
@@ -264,33 +280,126 @@ def delete_timeoff_view(request, timeoff_id):
         messages.success(request, "Bloqueo eliminado.")
     return redirect('schedule')
 
+# Columnas que usan las plantillas de la agenda (el resto no se trae desde la base de datos)
+APPOINTMENT_LIST_FIELDS = (
+    'id', 'status', 'client_name', 'client_last_name', 'client_email', 'client_whatsapp', 'client_rut',
+    'start_datetime', 'created_at', 'service__name', 'service__duration_minutes',
+)
+APPOINTMENTS_PAGE_SIZE = 20
+APPOINTMENT_TABS = ('pending', 'upcoming', 'past', 'cancelled')
+
+def appointment_tab_queryset(profile, tab, now):
+    # Devuelve (queryset o lista de querysets, descendente) para cada pestaña de la agenda.
+    # Las pestañas de historial leen también el archivo; las de próximas citas, solo la tabla activa
+    appointments, archived = (
+        model.objects.filter(professional=profile).select_related('service').only(*APPOINTMENT_LIST_FIELDS)
+        for model in (Appointment, AppointmentArchive)
+    )
+    if tab == 'pending':
+        return appointments.filter(start_datetime__gte=now, status='PENDING'), False
+    if tab == 'upcoming':
+        return appointments.filter(start_datetime__gte=now, status='CONFIRMED'), False
+    if tab == 'past':
+        return [qs.filter(start_datetime__lt=now, status__in=['CONFIRMED', 'COMPLETED']) for qs in (appointments, archived)], True
+    return [qs.filter(status__in=['CANCELLED_BY_PRO', 'CANCELLED_BY_CLIENT']) for qs in (appointments, archived)], True
+
+def appointment_tab_page(profile, tab, now, cursor=None):
+    queryset, descending = appointment_tab_queryset(profile, tab, now)
+    return keyset_page(queryset, APPOINTMENTS_PAGE_SIZE, cursor, descending)
+
 @login_required
 def appointments_view(request):
     profile = request.user.profile
     now = timezone.now()
-    
-    pending_appointments = Appointment.objects.filter(professional=profile, start_datetime__gte=now, status='PENDING').order_by('start_datetime')
-    upcoming_appointments = Appointment.objects.filter(professional=profile, start_datetime__gte=now, status='CONFIRMED').order_by('start_datetime')
-    past_appointments = Appointment.objects.filter(professional=profile, start_datetime__lt=now, status__in=['CONFIRMED', 'COMPLETED']).order_by('-start_datetime')
-    cancelled_appointments = Appointment.objects.filter(professional=profile, status__in=['CANCELLED_BY_PRO', 'CANCELLED_BY_CLIENT']).order_by('-start_datetime')
-    
-    pending_count = pending_appointments.count()
+    pages = {f'{tab}_page': appointment_tab_page(profile, tab, now) for tab in APPOINTMENT_TABS}
+
+    pending_count = Appointment.objects.filter(professional=profile, start_datetime__gte=now, status='PENDING').count()
+    upcoming_count = Appointment.objects.filter(professional=profile, start_datetime__gte=now, status='CONFIRMED').count()
 
     return render(request, 'appointments.html', {
-        'pending_appointments': pending_appointments,
-        'upcoming_appointments': upcoming_appointments,
-        'past_appointments': past_appointments,
-        'cancelled_appointments': cancelled_appointments,
-        'pending_count': pending_count
+        **pages,
+        'pending_count': pending_count,
+        'upcoming_count': upcoming_count,
+        'export_form': AppointmentExportForm(),
+        'calendar_feed_url': request.build_absolute_uri(reverse('calendar_feed', args=[profile.calendar_token])) if profile.calendar_token else None,
     })
 
+@login_required
+def export_appointments_view(request):
+    # Historial completo en CSV, enviado mientras se lee de la base (ver exports.py)
+    form = AppointmentExportForm(request.GET)
+    if not form.is_valid():
+        messages.error(request, form.errors.get('__all__', ["Revisa los filtros de la exportación."])[0])
+        return redirect('appointments')
+
+    profile = request.user.profile
+    data = form.cleaned_data
+    querysets = export_querysets(profile, data['start_date'], data['end_date'], data['status'])
+    content = stream_csv(appointment_rows(querysets), **EXPORT_FORMATS[data['format']])
+    if isinstance(request, ASGIRequest):
+        content = aiterate(content)
+
+    response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="citas-{profile.slug}-{timezone.localdate().isoformat()}.csv"'
+    return response
+
+@login_required
+def calendar_token_view(request):
+    # Crea (o rota, revocando el enlace anterior) el token del feed .ics
+    if request.method == 'POST':
+        profile = request.user.profile
+        if profile.plan == 'FREE':
+            messages.error(request, "La sincronización con calendarios es una función PRO.")
+        else:
+            profile.rotate_calendar_token()
+            messages.success(request, "Enlace de calendario generado. Si tenías uno anterior, dejó de funcionar.")
+    return redirect('appointments')
+
+def calendar_feed_view(request, token):
+    # Lo consultan Google/Apple Calendar cada pocos minutos: si nada cambió, un agregado y un 304 sin cuerpo
+    profile = get_object_or_404(ProfessionalProfile.objects.only('id', 'slug', 'display_name', 'plan'), calendar_token=token)
+    if profile.plan == 'FREE':
+        raise Http404
+    start_day, end_day = feed_window(timezone.localdate())
+    queryset = feed_queryset(profile, start_day, end_day)
+    etag = feed_etag(profile, queryset, start_day)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content = stream_feed(profile, queryset)
+        if isinstance(request, ASGIRequest):
+            content = aiterate(content)
+        response = StreamingHttpResponse(content, content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="{profile.slug}.ics"'
+    response['ETag'] = etag
+    # El enlace lleva un token: que solo lo guarde el cliente, nunca un caché compartido
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+@login_required
+def appointments_page_view(request, tab):
+    # Fragmento HTML para el scroll infinito; el cursor siguiente viaja en la cabecera X-Next-Cursor
+    if tab not in APPOINTMENT_TABS:
+        raise Http404
+    try:
+        page = appointment_tab_page(request.user.profile, tab, timezone.now(), request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponse(status=400)
+    response = render(request, f'partials/appointments_{tab}.html', {'appointments': page.items})
+    if page.next_cursor:
+        response['X-Next-Cursor'] = page.next_cursor
+    return response
+
 @login_required
 def update_appointment_status(request, appt_id, new_status):
     if request.method == 'POST':
         appt = get_object_or_404(Appointment, id=appt_id, professional=request.user.profile)
         valid_statuses = [choice[0] for choice in Appointment.STATUS_CHOICES]
         
-        if new_status in valid_statuses:
+        # Mismas reglas que el cambio en lote: canceladas y completadas son finales
+        if new_status in valid_statuses and new_status != appt.status and new_status not in Appointment.STATUS_TRANSITIONS.get(appt.status, []):
+            messages.error(request, f"La cita con {appt.client_name} no admite ese cambio de estado.")
+        elif new_status in valid_statuses:
             appt.status = new_status
             appt.save()
             
@@ -301,111 +410,133 @@ def update_appointment_status(request, appt_id, new_status):
     return redirect(referer)
 
 
-def get_available_slots(profile, service, check_date):
-    is_blocked = TimeOff.objects.filter(professional=profile, start_date__lte=check_date, end_date__gte=check_date).exists()
-    if is_blocked: return []
-    
-    weekday = check_date.weekday()
+BULK_STATUS_MAX_IDS = 200
+
+@login_required
+def bulk_update_appointments_view(request):
+    # Varias citas a un mismo estado en una sola escritura; responde el resultado de cada id
+    if request.method != 'POST':
+        return JsonResponse({'success': False}, status=400)
+    new_status = request.POST.get('status')
     try:
-        work_hours = BusinessHours.objects.get(professional=profile, weekday=weekday)
-    except BusinessHours.DoesNotExist:
-        return []
+        ids = [int(value) for value in request.POST.getlist('ids')]
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Parámetros inválidos.'}, status=400)
+    if new_status not in dict(Appointment.STATUS_CHOICES) or not ids or len(ids) > BULK_STATUS_MAX_IDS:
+        return JsonResponse({'success': False, 'error': 'Parámetros inválidos.'}, status=400)
+
+    results = bulk_update_status(request.user.profile, ids, new_status)
+    return JsonResponse({
+        'success': True,
+        'updated': sum(result == 'updated' for result in results.values()),
+        'results': {str(pk): result for pk, result in results.items()},
+    })
 
-    existing_appointments = Appointment.objects.filter(professional=profile, start_datetime__date=check_date, status__in=['PENDING', 'CONFIRMED'])
-    
-    slots = []
-    current_time = datetime.combine(check_date, work_hours.start_time)
-    end_work_time = datetime.combine(check_date, work_hours.end_time)
-    now = timezone.localtime(timezone.now())
-    duration = timedelta(minutes=service.duration_minutes)
-    
-    buffer = timedelta(minutes=profile.buffer_time_minutes) if profile.plan != 'FREE' else timedelta(minutes=0)
-    
-    has_lunch = False
-    if profile.plan != 'FREE' and profile.lunch_start_time and profile.lunch_end_time:
-        lunch_start = datetime.combine(check_date, profile.lunch_start_time)
-        lunch_end = datetime.combine(check_date, profile.lunch_end_time)
-        has_lunch = True
-
-    while current_time + duration <= end_work_time:
-        slot_start = current_time
-        slot_end = current_time + duration
-        
-        if has_lunch and (slot_start < lunch_end and slot_end > lunch_start):
-            current_time = lunch_end
-            continue
+# --- FLUJO PÚBLICO DE RESERVA ---
 
-        if check_date == now.date() and slot_start.time() < now.time():
-            current_time += duration + buffer
-            continue
-            
-        is_taken = False
-        for appt in existing_appointments:
-            appt_start = timezone.localtime(appt.start_datetime).replace(tzinfo=None)
-            appt_end_with_buffer = timezone.localtime(appt.end_datetime).replace(tzinfo=None) + buffer
-            if slot_start < appt_end_with_buffer and slot_end > appt_start:
-                is_taken = True
-                break
-                
-        if not is_taken:
-            slots.append(current_time.time())
-        current_time += duration + buffer 
-    return slots
+def get_public_service(profile_slug, service_id):
+    # Servicio, profesional y usuario en una sola consulta: el slug del perfil ya viene en la URL
+    return get_object_or_404(Service.objects.select_related('professional__user'), id=service_id, professional__slug=profile_slug)
 
-def profile_view(request, profile_slug):
-    profile = get_object_or_404(ProfessionalProfile, slug=profile_slug)
+def profile_context(profile_slug):
+    profile = get_object_or_404(ProfessionalProfile.objects.select_related('user'), slug=profile_slug)
     services = Service.objects.filter(professional=profile, is_active=True)
     if profile.plan == 'FREE':
         services = services[:2]
-    return render(request, 'profile.html', {'profile': profile, 'services': services})
+    return {'profile': profile, 'services': services}
+
+def profile_view(request, profile_slug):
+    # Con sesión o mensajes pendientes la página cambia según el visitante: se renderiza sin caché
+    if request.user.is_authenticated or len(messages.get_messages(request)):
+        return render(request, 'profile.html', profile_context(profile_slug))
+
+    page = get_or_render_profile_page(profile_slug, lambda: render_to_string('profile.html', profile_context(profile_slug), request))
+    response = HttpResponse(page['content'])
+    response['ETag'] = page['etag']
+    response['Last-Modified'] = http_date(page['last_modified'])
+    # Navegadores y CDN pueden guardarla, pero deben revalidar: la respuesta típica es un 304 sin cuerpo
+    patch_cache_control(response, public=True, no_cache=True)
+    return get_conditional_response(request, etag=page['etag'], last_modified=page['last_modified'], response=response)
 
 def booking_view(request, profile_slug, service_id):
-    profile = get_object_or_404(ProfessionalProfile, slug=profile_slug)
+    service = get_public_service(profile_slug, service_id)
+    profile = service.professional
     if not profile.is_active: return redirect('public_profile', profile_slug=profile.slug)
-    
-    service = get_object_or_404(Service, id=service_id, professional=profile)
+
     date_str = request.GET.get('date')
     selected_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else date.today()
     available_slots = get_available_slots(profile, service, selected_date)
     return render(request, 'booking.html', {'profile': profile, 'service': service, 'selected_date': selected_date, 'available_slots': available_slots})
 
+def booking_availability_view(request, profile_slug, service_id):
+    # Endpoint JSON que los clientes consultan seguido: el perfil sale de la caché en memoria del proceso
+    profile = get_profile_or_404(profile_slug)
+    if not profile.is_active: return JsonResponse({'success': False}, status=404)
+
+    service = get_object_or_404(Service, id=service_id, professional=profile)
+    today = timezone.localdate()
+    try:
+        start_str = request.GET.get('start')
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else today
+        days = int(request.GET.get('days', AVAILABILITY_DEFAULT_DAYS))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Parámetros inválidos.'}, status=400)
+
+    start_date = max(start_date, today)
+    days = min(max(days, 1), AVAILABILITY_MAX_DAYS)
+    availability = get_availability_range(profile, service, start_date, days)
+    return JsonResponse({
+        'success': True,
+        'service_id': service.id,
+        'days': [
+            {'date': day.isoformat(), 'available': bool(slots), 'slots': [slot.strftime('%H:%M') for slot in slots]}
+            for day, slots in availability.items()
+        ],
+    })
+
 def booking_confirm_view(request, profile_slug, service_id):
-    profile = get_object_or_404(ProfessionalProfile, slug=profile_slug)
+    service = get_public_service(profile_slug, service_id)
+    profile = service.professional
     if not profile.is_active: return redirect('public_profile', profile_slug=profile.slug)
-        
-    service = get_object_or_404(Service, id=service_id, professional=profile)
+
     date_str = request.GET.get('date')
     time_str = request.GET.get('time')
     
+    form = BookingClientForm(request.POST or None)
     if request.method == 'POST':
-        client_name = request.POST.get('client_name')
-        client_last_name = request.POST.get('client_last_name')
-        client_rut = request.POST.get('client_rut')
-        client_email = request.POST.get('client_email')
-        client_whatsapp = request.POST.get('client_whatsapp')
-
         try:
             start_datetime_naive = datetime.strptime(f"{date_str} {time_str}", '%Y-%m-%d %H:%M')
-            start_datetime = timezone.make_aware(start_datetime_naive)
-            
-            appointment = Appointment.objects.create(
-                professional=profile, service=service, client_name=client_name,
-                client_last_name=client_last_name, client_rut=client_rut,
-                client_email=client_email, client_whatsapp=client_whatsapp,
-                start_datetime=start_datetime
-            )
+        except (TypeError, ValueError):
+            messages.error(request, "La fecha u hora seleccionada no es válida. Elige un horario nuevamente.")
+            return redirect('booking_step1', profile_slug=profile.slug, service_id=service.id)
+
+        if form.is_valid():
+            try:
+                appointment = book_appointment(profile, service, timezone.make_aware(start_datetime_naive), **form.cleaned_data)
+            except SlotUnavailable:
+                messages.error(request, "¡Lo sentimos! Esa hora acaba de ser reservada. Por favor, elige otro horario.")
+                return redirect(f"{reverse('booking_step1', args=[profile.slug, service.id])}?date={date_str}")
             return redirect('booking_success', profile_slug=profile.slug, appointment_id=appointment.id)
-            
-        except Exception as e:
-            messages.error(request, f"Error al agendar. Inténtalo de nuevo. ({e})")
 
-    return render(request, 'booking_confirm.html', {'profile': profile, 'service': service, 'date_str': date_str, 'time_str': time_str})
+    return render(request, 'booking_confirm.html', {'profile': profile, 'service': service, 'date_str': date_str, 'time_str': time_str, 'form': form})
 
 def booking_success_view(request, profile_slug, appointment_id):
-    profile = get_object_or_404(ProfessionalProfile, slug=profile_slug)
-    appointment = get_object_or_404(Appointment, id=appointment_id, professional=profile)
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('service', 'professional__user'), id=appointment_id, professional__slug=profile_slug
+    )
     return render(request, 'success.html', {
         'service': appointment.service, 
         'appointment': appointment, 
-        'profile': profile
-    })
\ No newline at end of file
+        'profile': appointment.professional
+    })
+
+
+# --- MÉTRICAS (PROMETHEUS) ---
+def metrics_view(request):
+    # Prometheus se identifica con el token (sin sesión ni consultas); una persona, con su cuenta de staff
+    token = settings.METRICS_TOKEN
+    if not (token and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}")) and not request.user.is_staff:
+        return HttpResponseForbidden("Acceso restringido.")
+    response = HttpResponse(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+    patch_cache_control(response, no_store=True)
+    return response
@@ -36,12 +36,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # NUEVO: WhiteNoise procesa los archivos estáticos rápido
+    'booking.metrics.MetricsMiddleware', # NUEVO: Latencia, consultas y plantillas por vista (ver /metrics)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'booking.profiling.ProfilingMiddleware', # NUEVO: ?__profile=1 (staff) perfila el request; ver admin > Request profiles
 ]
 
 # Restaurado a tu carpeta original
@@ -52,7 +54,7 @@ ROOT_URLCONF = 'nexthora_config.urls'
 # ---
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'booking.metrics.InstrumentedDjangoTemplates',  # DjangoTemplates que mide el tiempo de render
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -61,6 +63,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'booking.context_processors.notifications',
             ],
         },
     },
@@ -82,6 +85,69 @@ DATABASES = {
     )
 }
 
+# SQLite: abrimos las transacciones con BEGIN IMMEDIATE para que las reservas concurrentes se serialicen
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {})['transaction_mode'] = 'IMMEDIATE'
+
+# ---
+# CACHÉ: memoria local por defecto; en producción se puede apuntar a un backend compartido (Redis, Memcached)
+# ---
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='nexthora'),
+    }
+}
+
+# Segundos que se guarda el cálculo de horas disponibles (se invalida solo al cambiar la agenda)
+AVAILABILITY_CACHE_TIMEOUT = config('AVAILABILITY_CACHE_TIMEOUT', default=300, cast=int)
+# Página pública del perfil: segundos en que la copia está fresca y segundos extra en que puede servirse vencida
+PROFILE_PAGE_CACHE_TIMEOUT = config('PROFILE_PAGE_CACHE_TIMEOUT', default=300, cast=int)
+PROFILE_PAGE_STALE_TIMEOUT = config('PROFILE_PAGE_STALE_TIMEOUT', default=3600, cast=int)
+# Resolución slug → perfil en memoria de cada proceso: máximo de entradas y segundos que vive cada una
+PROFILE_RESOLVER_MAX_SIZE = config('PROFILE_RESOLVER_MAX_SIZE', default=2048, cast=int)
+PROFILE_RESOLVER_TTL = config('PROFILE_RESOLVER_TTL', default=60, cast=int)
+
+# Feed .ics de cada profesional: días hacia atrás y hacia adelante, cada cuánto lo piden los calendarios y
+# segundos que se guarda cada VEVENT ya armado
+CALENDAR_FEED_PAST_DAYS = config('CALENDAR_FEED_PAST_DAYS', default=30, cast=int)
+CALENDAR_FEED_FUTURE_DAYS = config('CALENDAR_FEED_FUTURE_DAYS', default=365, cast=int)
+CALENDAR_FEED_REFRESH_MINUTES = config('CALENDAR_FEED_REFRESH_MINUTES', default=15, cast=int)
+CALENDAR_FEED_EVENT_TIMEOUT = config('CALENDAR_FEED_EVENT_TIMEOUT', default=7 * 24 * 3600, cast=int)
+
+# Email: por defecto se imprime en consola; en producción EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=587, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=30, cast=int)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='Nexthora <no-reply@nexthora.cl>')
+
+# Recordatorios (manage.py send_reminders, cada minuto desde cron): horas antes de la cita y emails por lote
+REMINDER_HOURS_BEFORE = config('REMINDER_HOURS_BEFORE', default=24, cast=int)
+REMINDER_BATCH_SIZE = config('REMINDER_BATCH_SIZE', default=200, cast=int)
+
+# Métricas para Prometheus: /metrics acepta "Authorization: Bearer <METRICS_TOKEN>" o una sesión de staff
+METRICS_ENABLED = config('METRICS_ENABLED', default=True, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Perfilador de requests: ?__profile=1 para staff, o una fracción de todos los requests (0.01 = 1%)
+PROFILER_ENABLED = config('PROFILER_ENABLED', default=True, cast=bool)
+PROFILER_SAMPLE_RATE = config('PROFILER_SAMPLE_RATE', default=0.0, cast=float)
+PROFILER_DIR = config('PROFILER_DIR', default=os.path.join(BASE_DIR, 'request_profiles'))
+PROFILER_MAX_ENTRIES = config('PROFILER_MAX_ENTRIES', default=200, cast=int)
+
+# Cola de tareas (manage.py runworker)
+TASK_WORKER_CONCURRENCY = config('TASK_WORKER_CONCURRENCY', default=2, cast=int)  # hilos por proceso worker
+TASK_MAX_ATTEMPTS = config('TASK_MAX_ATTEMPTS', default=5, cast=int)  # después de esto la tarea queda en DEAD
+TASK_RETRY_BACKOFF = 10       # segundos antes del primer reintento; se duplica en cada intento
+TASK_RETRY_MAX_DELAY = 3600
+TASK_POLL_INTERVAL = 1.0      # segundos entre consultas cuando la cola está vacía
+TASK_LOCK_TIMEOUT = 600       # una tarea "en ejecución" más antigua que esto se considera abandonada
+TASK_DB_RETRY_MAX_DELAY = 60  # espera máxima del worker entre reintentos cuando la base de datos falla
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {